@@ -0,0 +1,77 @@
+"""
+EXIF date benchmark
+-------------------
+Compares the fast EXIF header reader with the Pillow path it replaced, on a
+generated set of JPEGs carrying camera-sized EXIF blocks (MakerNote and all).
+
+    python benchmarks/bench_exif.py [--files 500] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from organizer.dates import read_pillow_exif_date  # noqa: E402
+from organizer.exif import read_exif_date  # noqa: E402
+
+
+def make_corpus(folder, count):
+    """Write count JPEGs with DateTimeOriginal, DateTime and a 32 KB MakerNote"""
+    from PIL import Image
+
+    image = Image.new('RGB', (640, 480), (90, 120, 150))
+    paths = []
+    for i in range(count):
+        exif = Image.Exif()
+        exif[306] = '2021:06:01 12:00:00'
+        exif_ifd = exif.get_ifd(34665)
+        exif_ifd[36867] = f'2021:06:{1 + i % 28:02d} 10:{i % 60:02d}:00'
+        exif_ifd[37500] = os.urandom(32 * 1024)
+        path = os.path.join(folder, f'IMG_{i:05d}.jpg')
+        image.save(path, exif=exif, quality=85)
+        paths.append(path)
+    return paths
+
+
+def time_reader(reader, paths, repeat):
+    """Best wall time over repeat passes of reader over paths"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for path in paths:
+            reader(path)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = make_corpus(folder, args.files)
+
+        # Both readers must agree before their speed means anything
+        for path in paths:
+            assert read_exif_date(path) == read_pillow_exif_date(path), path
+
+        results = {}
+        for name, reader in (('pillow', read_pillow_exif_date), ('fast', read_exif_date)):
+            elapsed = time_reader(reader, paths, args.repeat)
+            results[name] = elapsed
+            print(f"{name:>8}: {elapsed * 1000:8.1f} ms  "
+                  f"{len(paths) / elapsed:10.0f} files/s  "
+                  f"{elapsed / len(paths) * 1e6:7.1f} us/file")
+
+    print(f"speedup: {results['pillow'] / results['fast']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Network storage latency benchmark
+---------------------------------
+Times whole organize runs against a local folder made to answer like a NAS:
+every file system call on the corpus or the library first waits --latency
+milliseconds, as an SMB or NFS round trip would, and data calls also wait
+for their bytes at --bandwidth. The waits are sleeps, so they release the
+GIL the way a blocked syscall does, and the figures show how well each
+engine keeps the link busy rather than how fast the local disk is.
+
+Each latency is run with one worker, with --workers threads and with the
+asyncio engine (--async-io), and the speedup over one worker is printed.
+
+    python benchmarks/bench_latency.py [--files 300] [--latency 5,20] [--workers 8]
+"""
+
+import argparse
+import builtins
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import add_spec_arguments, generate, spec_from_args  # noqa: E402
+from organizer import Organizer, OrganizerConfig  # noqa: E402
+from organizer.aio import DEFAULT_IO_CONCURRENCY, DEFAULT_MOUNT_LIMIT  # noqa: E402
+
+# os functions taking a path (or a dir_fd relative name) first, one round trip each
+PATH_CALLS = (
+    'stat', 'lstat', 'scandir', 'listdir', 'mkdir', 'link', 'rename', 'replace',
+    'remove', 'unlink', 'rmdir', 'utime', 'chmod',
+)
+# os functions moving data between file descriptors, a round trip plus the bytes
+DATA_CALLS = ('copy_file_range', 'sendfile')
+
+
+class LatentFS:
+    """Makes file system calls under roots wait latency seconds, and data calls also for bandwidth
+
+    Use as a context manager; the os functions are patched for every thread
+    while it is active. calls counts the delayed calls.
+    """
+
+    def __init__(self, roots, latency, bandwidth=0):
+        self.roots = tuple(os.path.join(os.path.abspath(root), '') for root in roots)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.calls = 0
+        self._fds = set()
+        self._lock = threading.Lock()
+        self._saved = {}
+
+    def _latent(self, path):
+        if isinstance(path, int):
+            return path in self._fds
+        if isinstance(path, bytes):
+            path = os.fsdecode(path)
+        try:
+            path = os.path.join(os.path.abspath(os.fspath(path)), '')
+        except TypeError:
+            return False
+        return path.startswith(self.roots)
+
+    def _wait(self, size=0):
+        with self._lock:
+            self.calls += 1
+        delay = self.latency + (size / self.bandwidth if self.bandwidth else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _path_call(self, real):
+        def call(path='.', *args, **kwargs):
+            # Relative names under a folder fd only occur in the library
+            if self._latent(path) or kwargs.get('dir_fd') is not None or kwargs.get('src_dir_fd') is not None:
+                self._wait()
+            return real(path, *args, **kwargs)
+        return call
+
+    def _data_call(self, real):
+        def call(*args, **kwargs):
+            moved = real(*args, **kwargs)
+            if args[0] in self._fds or args[1] in self._fds:
+                self._wait(moved)
+            return moved
+        return call
+
+    def _open(self, real):
+        def call(path, *args, **kwargs):
+            latent = self._latent(path) or kwargs.get('dir_fd') is not None
+            if latent:
+                self._wait()
+            fd = real(path, *args, **kwargs)
+            if latent:
+                self._fds.add(fd)
+            return fd
+        return call
+
+    def _open_file(self, real):
+        def call(file, *args, **kwargs):
+            latent = not isinstance(file, int) and self._latent(file)
+            if latent:
+                self._wait()
+            f = real(file, *args, **kwargs)
+            if latent:
+                self._fds.add(f.fileno())
+            return f
+        return call
+
+    def _close(self, real):
+        def call(fd):
+            self._fds.discard(fd)
+            return real(fd)
+        return call
+
+    def __enter__(self):
+        patches = {name: self._path_call(getattr(os, name)) for name in PATH_CALLS}
+        patches.update({name: self._data_call(getattr(os, name)) for name in DATA_CALLS if hasattr(os, name)})
+        patches['open'] = self._open(os.open)
+        patches['close'] = self._close(os.close)
+        for name, patched in patches.items():
+            self._saved[name] = getattr(os, name)
+            setattr(os, name, patched)
+        self._saved_open = builtins.open
+        builtins.open = self._open_file(builtins.open)
+        return self
+
+    def __exit__(self, *exc):
+        for name, real in self._saved.items():
+            setattr(os, name, real)
+        builtins.open = self._saved_open
+        self._saved = {}
+
+
+def engines(args):
+    """(name, OrganizerConfig settings) of every engine to time"""
+    runs = [('workers1', {'workers': 1})]
+    if args.workers > 1:
+        runs.append((f'workers{args.workers}', {'workers': args.workers}))
+    runs.append(('asyncio', {
+        'workers': args.workers, 'async_io': True,
+        'io_concurrency': args.io_concurrency, 'mount_limit': args.mount_limit,
+    }))
+    return runs
+
+
+def run_engines(corpus, work, args):
+    """Time an organize run per latency and engine"""
+    library = os.path.join(work, 'library')
+    results = {}
+    for latency_ms in args.latency:
+        for name, settings in engines(args):
+            shutil.rmtree(library, ignore_errors=True)
+            config = OrganizerConfig(
+                source=corpus, photo_dest=library, use_cache=False, resume=False,
+                journal_path=os.path.join(work, 'journal.sqlite'), **settings
+            )
+            with LatentFS((corpus, library), latency_ms / 1000, args.bandwidth * 1e6) as fs:
+                started = time.perf_counter()
+                stats = Organizer(config).run()
+                seconds = time.perf_counter() - started
+            results[f'{name}@{latency_ms:g}ms'] = {
+                'latency_ms': latency_ms,
+                'engine': name,
+                'files': stats.processed,
+                'failed': stats.failed,
+                'calls': fs.calls,
+                'seconds': round(seconds, 3),
+                'files_per_second': round(stats.processed / seconds, 1) if seconds else 0.0,
+            }
+    return results
+
+
+def print_results(results):
+    """Print one line per run, with the speedup over one worker at the same latency"""
+    single = {result['latency_ms']: result for result in results.values() if result['engine'] == 'workers1'}
+    for name, result in results.items():
+        line = (f"{name:>20}: {result['seconds']:8.2f} s  {result['files_per_second']:8.1f} files/s  "
+                f"{result['calls']:7d} calls")
+        base = single.get(result['latency_ms'])
+        if base and result['seconds']:
+            line += f"  {base['seconds'] / result['seconds']:5.2f}x"
+        if result['failed']:
+            line += f"  ({result['failed']} failed)"
+        print(line)
+
+
+def _float_list(text):
+    return [float(part) for part in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus', help='use an existing corpus instead of generating one')
+    add_spec_arguments(parser)
+    parser.set_defaults(files=300, size_kb=64)
+    parser.add_argument('--latency', type=_float_list, default=[5, 20],
+                        help='milliseconds per file system call, comma separated (default: 5,20)')
+    parser.add_argument('--bandwidth', type=float, default=100,
+                        help='MB/s of data calls, 0 for no limit (default: 100)')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='threads for the thread pool run (default: 8)')
+    parser.add_argument('--io-concurrency', type=int, default=DEFAULT_IO_CONCURRENCY)
+    parser.add_argument('--mount-limit', type=int, default=DEFAULT_MOUNT_LIMIT)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work:
+        corpus = args.corpus
+        if not corpus:
+            corpus = os.path.join(work, 'corpus')
+            manifest = generate(corpus, spec_from_args(args))
+            print(f"Corpus: {manifest['files']} files, {manifest['bytes'] / 1e6:.1f} MB")
+        results = run_engines(corpus, work, args)
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
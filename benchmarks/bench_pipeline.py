@@ -0,0 +1,209 @@
+"""
+Pipeline benchmark
+------------------
+Times the stages of an organize run separately on a synthetic corpus (see
+corpus.py) and writes the figures as JSON, so runs on different versions
+can be compared:
+
+- scan: walking the source for media files
+- dates: extracting every date from scratch, and again through a warm cache
+- naming: picking Year/Month folders and resolving name collisions
+- transfer: placing every file, per transfer mode
+- run: a whole Organizer.run, per worker count
+
+Each stage is run --repeat times and the best time is kept. The corpus is
+read from the page cache after the first pass, so the figures measure the
+organizer rather than the disk.
+
+    python benchmarks/bench_pipeline.py [--files 2000] [--output results.json]
+    python benchmarks/bench_pipeline.py --corpus /data/corpus --compare old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import add_spec_arguments, generate, spec_from_args  # noqa: E402
+from organizer import MetadataCache, Organizer, OrganizerConfig  # noqa: E402
+from organizer.cache import resolve_date  # noqa: E402
+from organizer.dates import read_media_date  # noqa: E402
+from organizer.engine import PHOTO_EXTENSIONS  # noqa: E402
+from organizer.scan import scan_media  # noqa: E402
+from organizer.transfer import Transferer  # noqa: E402
+
+RESULTS_VERSION = 1
+
+
+def best_of(repeat, run, setup=None):
+    """Best wall time of run() over repeat passes, calling setup() untimed before each"""
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def stage(files, size, seconds):
+    """Result record of one stage"""
+    return {
+        'files': files,
+        'bytes': size,
+        'seconds': round(seconds, 6),
+        'files_per_second': round(files / seconds, 1) if seconds else 0.0,
+        'mb_per_second': round(size / 1e6 / seconds, 2) if seconds else 0.0,
+    }
+
+
+def git_commit():
+    """Commit of the working tree, or None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_stages(corpus, work, args):
+    """Time every stage on corpus, using work for destinations and the cache"""
+    config = OrganizerConfig(source=corpus, photo_dest=os.path.join(work, 'library'), use_cache=False)
+    extensions = config.extensions()
+    paths = list(scan_media(corpus, extensions))
+    total = sum(os.path.getsize(path) for path in paths)
+    stages = {}
+
+    stages['scan'] = stage(len(paths), total, best_of(
+        args.repeat, lambda: sum(1 for _ in scan_media(corpus, extensions))
+    ))
+
+    dates = {}
+
+    def extract():
+        for path in paths:
+            dates[path] = read_media_date(path, PHOTO_EXTENSIONS)[0]
+    stages['dates'] = stage(len(paths), total, best_of(args.repeat, extract))
+
+    cache = MetadataCache(os.path.join(work, 'metadata.sqlite'))
+    cache.update((path,) + resolve_date(path, PHOTO_EXTENSIONS) for path in paths)
+
+    def extract_cached():
+        for path, known in zip(paths, cache.lookup(paths)):
+            resolve_date(path, PHOTO_EXTENSIONS, known)
+    stages['dates_cached'] = stage(len(paths), total, best_of(args.repeat, extract_cached))
+    cache.close()
+
+    planned = {}
+
+    def name():
+        organizer = Organizer(config)
+        for path in paths:
+            dest_dir = organizer.destination_dir(path, dates[path])
+            planned[path] = organizer.unique_destination(dest_dir, os.path.basename(path))
+    stages['naming'] = stage(len(paths), total, best_of(args.repeat, name))
+
+    def fresh_library():
+        shutil.rmtree(config.photo_dest, ignore_errors=True)
+        for folder in {os.path.dirname(dest) for dest in planned.values()}:
+            os.makedirs(folder, exist_ok=True)
+
+    for mode in args.transfer:
+        def transfer(transferer=Transferer(mode)):
+            for path in paths:
+                transferer.transfer(path, planned[path])
+        stages[f'transfer_{mode}'] = stage(len(paths), total, best_of(args.repeat, transfer, fresh_library))
+
+    for workers in args.workers:
+        run_config = OrganizerConfig(
+            source=corpus, photo_dest=config.photo_dest, workers=workers, use_cache=False,
+            journal_path=os.path.join(work, 'journal.sqlite')
+        )
+        outcome = {}
+
+        def run(run_config=run_config):
+            outcome['stats'] = Organizer(run_config).run()
+        seconds = best_of(args.repeat, run, lambda: shutil.rmtree(config.photo_dest, ignore_errors=True))
+        stages[f'run_workers{workers}'] = stage(outcome['stats'].processed, total, seconds)
+
+    return stages
+
+
+def print_stages(stages, baseline=None):
+    """Print one line per stage, with the speedup over baseline where it has the stage"""
+    for name, result in stages.items():
+        line = (f"{name:>20}: {result['seconds'] * 1000:10.1f} ms  "
+                f"{result['files_per_second']:10.0f} files/s  {result['mb_per_second']:9.1f} MB/s")
+        old = (baseline or {}).get(name)
+        if old and result['seconds']:
+            line += f"  {old['seconds'] / result['seconds']:5.2f}x"
+        print(line)
+
+
+def _int_list(text):
+    return [int(part) for part in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus', help='use an existing corpus instead of generating one')
+    add_spec_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--transfer', type=lambda text: text.split(','), default=['copy', 'auto'],
+                        help='transfer modes to time, comma separated (default: copy,auto)')
+    parser.add_argument('--workers', type=_int_list, default=[1, os.cpu_count() or 1],
+                        help='worker counts to time whole runs with, comma separated')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare with')
+    args = parser.parse_args(argv)
+    args.workers = sorted(set(args.workers))
+
+    with tempfile.TemporaryDirectory() as work:
+        corpus = args.corpus
+        if corpus:
+            with open(os.path.join(corpus, 'corpus.json'), encoding='utf-8') as f:
+                manifest = json.load(f)
+        else:
+            corpus = os.path.join(work, 'corpus')
+            manifest = generate(corpus, spec_from_args(args))
+        print(f"Corpus: {manifest['files']} files, {manifest['bytes'] / 1e6:.1f} MB")
+        stages = run_stages(corpus, work, args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['stages']
+    print_stages(stages, baseline)
+
+    if args.output:
+        results = {
+            'version': RESULTS_VERSION,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'corpus': manifest,
+            'repeat': args.repeat,
+            'stages': stages,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Interrupted run check
+---------------------
+Interrupts an organize run partway through with a KeyboardInterrupt, as a
+Ctrl+C at the command line does, runs it again and checks that the second
+run only placed what the first one had not: the library must hold the same
+contents, folder by folder, as a library made by one uninterrupted run, with
+no file placed twice under a _1 name. With --plan the runs execute a plan
+made beforehand instead of walking the corpus.
+
+    python benchmarks/bench_resume.py [--files 300] [--stop-after 100] [--workers 4] [--plan]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_shards import contents  # noqa: E402
+from corpus import add_spec_arguments, generate, spec_from_args  # noqa: E402
+from organizer import Organizer, OrganizerConfig  # noqa: E402
+from organizer.plan import PlanReader, PlanWriter  # noqa: E402
+
+
+def interrupt_after(count):
+    """on_progress callback raising KeyboardInterrupt once count files are placed"""
+    def on_progress(stats, file_path):
+        if stats.processed >= count:
+            raise KeyboardInterrupt()
+    return on_progress
+
+
+def write_plan(config, path):
+    """Plan organizing by config into path, once"""
+    if os.path.exists(path):
+        return
+    settings = {key: getattr(config, key) for key in PlanReader.SETTINGS}
+    with PlanWriter(path, settings) as writer:
+        for entry in Organizer(config).plan():
+            writer.write(entry)
+
+
+def organize(corpus, library, work, args, on_progress=None):
+    """Organize corpus into library, returning its RunStats or None when interrupted"""
+    name = os.path.join(work, os.path.basename(library))
+    config = OrganizerConfig(
+        source=corpus, photo_dest=library, workers=args.workers, use_cache=False,
+        journal_path=name + '.journal.sqlite',
+    )
+    organizer = Organizer(config, on_progress=on_progress, on_error=lambda *_: None)
+    try:
+        if args.plan:
+            write_plan(config, name + '.plan.jsonl')
+            reader = PlanReader(name + '.plan.jsonl')
+            return organizer.execute_plan(reader, total=reader.count())
+        return organizer.run()
+    except KeyboardInterrupt:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_spec_arguments(parser)
+    parser.set_defaults(files=300, size_kb=16)
+    parser.add_argument('--stop-after', type=int, default=100,
+                        help='files placed before the run is interrupted (default: 100)')
+    parser.add_argument('--workers', type=int, default=4, help='workers of each run (default: 4)')
+    parser.add_argument('--plan', action='store_true', help='execute a plan instead of walking the corpus')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work:
+        corpus = os.path.join(work, 'corpus')
+        manifest = generate(corpus, spec_from_args(args))
+        print(f"Corpus: {manifest['files']} files, {manifest['bytes'] / 1e6:.1f} MB")
+        # corpus.json is not media, so it never reaches a library
+        reference = os.path.join(work, 'reference')
+        organize(corpus, reference, work, args)
+        expected = contents(reference)
+
+        library = os.path.join(work, 'library')
+        first = organize(corpus, library, work, args, interrupt_after(args.stop_after))
+        if first is not None:
+            print(f"The first run finished before {args.stop_after} files; lower --stop-after.")
+            return 1
+        placed = sum(contents(library).values())
+        second = organize(corpus, library, work, args)
+        found = contents(library)
+
+    print(f"Interrupted after {placed} files, the rerun placed {second.processed} "
+          f"and skipped {second.resumed}.")
+    missing, extra = expected - found, found - expected
+    if missing or extra:
+        print(f"MISMATCH: {sum(missing.values())} files missing, {sum(extra.values())} placed twice")
+        return 1
+    print("The resumed library matches an uninterrupted run.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+Sharded run check
+-----------------
+Runs a sharded organize the way it is meant to be used: several worker
+processes against one work manifest, and checks the library they merge
+against a library made by a single unsharded run of the same corpus.
+Names may differ where files from different shards share one (the merge
+adds _1, _2, ... in its own order), so the libraries are compared as the
+contents found in each folder.
+
+With --kill, one worker is killed as soon as it holds a shard; the others leave
+that shard to its lease, and a late worker started once the lease has run
+out takes it over and merges. The wall time of the sharded run is printed
+next to the single run's.
+
+    python benchmarks/bench_shards.py [--files 300] [--workers 3] [--shards 8] [--kill]
+"""
+
+import argparse
+import hashlib
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import add_spec_arguments, generate, spec_from_args  # noqa: E402
+from organizer.shard import STAGING_DIRNAME  # noqa: E402
+
+
+def _command(args, *extra):
+    command = [sys.executable, '-m', 'photo_organizer', '-q', '--no-cache', '--lease', str(args.lease)]
+    if args.limit_files:
+        command += ['--limit-files', str(args.limit_files)]
+    return command + list(extra)
+
+
+def _start(command, env, log):
+    with open(log, 'w', encoding='utf-8') as f:
+        return subprocess.Popen(command, cwd=ROOT, env=env, stdout=f, stderr=subprocess.STDOUT)
+
+
+def contents(library):
+    """Counter of (folder relative to library, md5 of the file) over every file"""
+    found = Counter()
+    for folder, _dirs, files in os.walk(library):
+        for name in files:
+            with open(os.path.join(folder, name), 'rb') as f:
+                digest = hashlib.md5(f.read()).hexdigest()
+            found[(os.path.relpath(folder, library), digest)] += 1
+    return found
+
+
+def run_single(corpus, work, args, env):
+    """Organize corpus in one process, returning (library, seconds)"""
+    library = os.path.join(work, 'single')
+    started = time.perf_counter()
+    subprocess.run(_command(args, corpus, '--dest', library), cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return library, time.perf_counter() - started
+
+
+def _kill_holding_shard(worker, manifest):
+    """Kill worker as soon as the manifest shows it holding a shard; False if it exits first"""
+    owner = f'{socket.gethostname()}:{worker.pid}'
+    conn = sqlite3.connect(manifest, timeout=60)
+    try:
+        while worker.poll() is None:
+            if conn.execute("SELECT 1 FROM shards WHERE state = 'running' AND owner = ?", (owner,)).fetchone():
+                worker.kill()
+                return True
+            time.sleep(0.02)
+        return False
+    finally:
+        conn.close()
+
+
+def run_sharded(corpus, work, args, env):
+    """Organize corpus with args.workers processes sharing a manifest, returning (library, seconds, killed, taken_over)"""
+    library = os.path.join(work, 'sharded')
+    manifest = os.path.join(work, 'work.sqlite')
+    logs = [os.path.join(work, f'worker{i}.log') for i in range(args.workers + 1)]
+    started = time.perf_counter()
+    workers = [_start(_command(args, corpus, '--dest', library, '--manifest', manifest,
+                               '--shards', str(args.shards)), env, logs[0])]
+    while not os.path.exists(manifest):
+        if workers[0].poll() is not None:
+            raise RuntimeError(f"The first worker exited with {workers[0].returncode}, see {logs[0]}")
+        time.sleep(0.05)
+    workers += [_start(_command(args, '--manifest', manifest), env, logs[i]) for i in range(1, args.workers)]
+
+    killed = args.kill and args.workers > 1 and _kill_holding_shard(workers[-1], manifest)
+    for worker in workers:
+        worker.wait()
+    taken_over = os.path.isdir(os.path.join(library, STAGING_DIRNAME))
+    if taken_over:
+        # A shard is still leased to the killed worker
+        time.sleep(args.lease)
+        _start(_command(args, '--manifest', manifest), env, logs[-1]).wait()
+    return library, time.perf_counter() - started, killed, taken_over
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus', help='use an existing corpus instead of generating one')
+    add_spec_arguments(parser)
+    parser.set_defaults(files=300, size_kb=16)
+    parser.add_argument('--workers', type=int, default=3, help='worker processes (default: 3)')
+    parser.add_argument('--shards', type=int, default=8, help='shards of the manifest (default: 8)')
+    parser.add_argument('--lease', type=float, default=2, help='shard lease in seconds (default: 2)')
+    parser.add_argument('--kill', action='store_true', help='kill one worker while it holds a shard')
+    parser.add_argument('--limit-files', type=float, default=0,
+                        help='files per second per worker, so --kill lands mid-shard (default: no limit)')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work:
+        env = dict(os.environ, XDG_CACHE_HOME=os.path.join(work, 'cache'))
+        corpus = args.corpus
+        if not corpus:
+            corpus = os.path.join(work, 'corpus')
+            manifest = generate(corpus, spec_from_args(args))
+            print(f"Corpus: {manifest['files']} files, {manifest['bytes'] / 1e6:.1f} MB")
+        single, single_seconds = run_single(corpus, work, args, env)
+        sharded, sharded_seconds, killed, taken_over = run_sharded(corpus, work, args, env)
+        expected, found = contents(single), contents(sharded)
+        leftover = os.path.exists(os.path.join(sharded, STAGING_DIRNAME))
+
+    print(f"{'single':>20}: {single_seconds:8.2f} s  {sum(expected.values()):6d} files")
+    print(f"{f'{args.workers} workers':>20}: {sharded_seconds:8.2f} s  {sum(found.values()):6d} files"
+          + ("  (one killed" + (", its shard taken over)" if taken_over else ")") if killed else ""))
+    missing, extra = expected - found, found - expected
+    if missing or extra or leftover:
+        print(f"MISMATCH: {sum(missing.values())} files missing, {sum(extra.values())} unexpected"
+              + (f", {STAGING_DIRNAME} left behind" if leftover else ""))
+        for (folder, digest), count in sorted((missing + extra).items())[:10]:
+            print(f"  {folder}/{digest} x{count}")
+        return 1
+    print("The sharded library matches the single run.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
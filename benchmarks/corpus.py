@@ -0,0 +1,243 @@
+"""
+Synthetic media corpus
+----------------------
+Generates a reproducible folder of media files for the benchmarks: JPEGs
+with and without EXIF, PNGs, GIFs and MP4/MOV stubs carrying an mvhd
+creation time, spread over nested folders, with camera-style names that
+clash within a month and a share of byte-identical duplicates.
+
+Each image is encoded once with Pillow and padded to its target size after
+the end-of-image marker, so a corpus of many gigabytes takes about as long
+to write as the disk needs. The same seed always gives the same corpus,
+file contents and modification times included.
+
+    python benchmarks/corpus.py OUTPUT [--files 2000] [--size-kb 256] [--depth 3]
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import struct
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+
+# Seconds between the QuickTime epoch (1904-01-01) and the Unix epoch
+QUICKTIME_EPOCH_OFFSET = 2082844800
+
+# Share of each kind of file, in the order they are drawn
+DEFAULT_MIX = {'jpeg_exif': 0.55, 'jpeg': 0.10, 'png': 0.10, 'gif': 0.05, 'mp4': 0.15, 'mov': 0.05}
+
+EXTENSIONS = {'jpeg_exif': '.jpg', 'jpeg': '.jpg', 'png': '.png', 'gif': '.gif', 'mp4': '.mp4', 'mov': '.mov'}
+
+FIRST_DATE = datetime(2018, 1, 1)
+
+
+@dataclass
+class CorpusSpec:
+    """Parameters of a generated corpus"""
+    files: int = 2000
+    # Mean file size; sizes vary between half and one and a half times this
+    size_kb: int = 256
+    # Folder levels below the root, and subfolders per level
+    depth: int = 3
+    fanout: int = 4
+    # Share of files that are byte copies of an earlier file
+    duplicates: float = 0.05
+    # Share of files that reuse the name of an earlier file from the same month
+    collisions: float = 0.10
+    # Months the dates are spread over
+    months: int = 24
+    seed: int = 1
+    mix: dict = None
+
+    def kinds(self):
+        return self.mix or DEFAULT_MIX
+
+
+def _exif_block(date):
+    """APP1 payload with DateTime in IFD0 and DateTimeOriginal in the Exif IFD"""
+    text = date.strftime('%Y:%m:%d %H:%M:%S').encode('ascii') + b'\0'
+    # Header, IFD0 with two entries, Exif IFD with one entry, then the two strings
+    ifd0 = 8
+    exif_ifd = ifd0 + 2 + 2 * 12 + 4
+    strings = exif_ifd + 2 + 12 + 4
+    tiff = b'II*\x00' + struct.pack('<I', ifd0)
+    tiff += struct.pack('<H', 2)
+    tiff += struct.pack('<HHII', 0x0132, 2, len(text), strings)
+    tiff += struct.pack('<HHII', 0x8769, 4, 1, exif_ifd)
+    tiff += struct.pack('<I', 0)
+    tiff += struct.pack('<H', 1)
+    tiff += struct.pack('<HHII', 0x9003, 2, len(text), strings + len(text))
+    tiff += struct.pack('<I', 0)
+    tiff += text + text
+    return b'Exif\x00\x00' + tiff
+
+
+def _with_exif(jpeg, date):
+    """Insert an EXIF APP1 segment right after the SOI marker"""
+    payload = _exif_block(date)
+    return jpeg[:2] + b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload + jpeg[2:]
+
+
+def _atom(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def _video_head(brand, date, size):
+    """ftyp + moov/mvhd with date as creation time + the header of an mdat filling up to size
+
+    Returns the head and the number of mdat bytes that follow it.
+    """
+    seconds = int(date.timestamp()) + QUICKTIME_EPOCH_OFFSET
+    mvhd = struct.pack('>B3xIIII', 0, seconds, seconds, 600, 600 * 10) + bytes(80)
+    head = _atom(b'ftyp', brand + b'\x00\x00\x02\x00' + brand) + _atom(b'moov', _atom(b'mvhd', mvhd))
+    padding = max(0, size - len(head) - 8)
+    return head + struct.pack('>I4s', 8 + padding, b'mdat'), padding
+
+
+def _base_images():
+    """Small encoded images every photo in the corpus starts from"""
+    from PIL import Image
+
+    image = Image.new('RGB', (320, 240), (90, 120, 150))
+    encoded = {}
+    for kind, fmt in (('jpeg', 'JPEG'), ('png', 'PNG'), ('gif', 'GIF')):
+        buffer = io.BytesIO()
+        image.save(buffer, fmt)
+        encoded[kind] = buffer.getvalue()
+    return encoded
+
+
+def _folders(spec):
+    """Relative paths of the leaf folders files are spread over"""
+    folders = ['']
+    for _ in range(spec.depth):
+        folders = [os.path.join(parent, f'dir{i:02d}') for parent in folders for i in range(spec.fanout)]
+    return folders
+
+
+def _pick(rng, weights):
+    value = rng.random() * sum(weights.values())
+    for kind, weight in weights.items():
+        value -= weight
+        if value < 0:
+            return kind
+    return kind
+
+
+def _write(path, head, padding, rng):
+    """Write head followed by padding pseudo-random bytes"""
+    with open(path, 'wb') as f:
+        f.write(head)
+        while padding > 0:
+            chunk = min(padding, 1 << 20)
+            f.write(rng.randbytes(chunk))
+            padding -= chunk
+
+
+def generate(root, spec):
+    """Write the corpus described by spec under root and return a manifest dict"""
+    rng = random.Random(spec.seed)
+    images = _base_images()
+    folders = _folders(spec)
+    kinds = spec.kinds()
+    written = []
+    names_by_month = {}
+    counts = {kind: 0 for kind in kinds}
+    total_bytes = 0
+
+    for i in range(spec.files):
+        folder = os.path.join(root, rng.choice(folders))
+        os.makedirs(folder, exist_ok=True)
+
+        if written and rng.random() < spec.duplicates:
+            # Same bytes and date under a new name
+            original, kind, date = rng.choice(written)
+            ext = EXTENSIONS[kind]
+            path = os.path.join(folder, f'DUP_{i:06d}{ext}')
+            with open(original, 'rb') as src, open(path, 'wb') as dst:
+                dst.write(src.read())
+        else:
+            kind = _pick(rng, kinds)
+            ext = EXTENSIONS[kind]
+            date = FIRST_DATE + timedelta(
+                days=rng.randrange(spec.months * 30), seconds=rng.randrange(86400)
+            )
+            month = (date.year, date.month)
+            taken = names_by_month.setdefault(month, [])
+            if taken and rng.random() < spec.collisions:
+                stem = rng.choice(taken)
+            else:
+                stem = f'IMG_{i:06d}'
+                taken.append(stem)
+            path = os.path.join(folder, stem + ext)
+            # A clash within one folder gets a distinct name, as a camera would
+            if os.path.exists(path):
+                path = os.path.join(folder, f'{stem}_{i:06d}{ext}')
+
+            size = int(spec.size_kb * 1024 * rng.uniform(0.5, 1.5))
+            if kind in ('mp4', 'mov'):
+                head, padding = _video_head(b'isom' if kind == 'mp4' else b'qt  ', date, size)
+            else:
+                head = images['jpeg' if kind.startswith('jpeg') else kind]
+                if kind == 'jpeg_exif':
+                    head = _with_exif(head, date)
+                padding = max(0, size - len(head))
+            _write(path, head, padding, rng)
+            written.append((path, kind, date))
+
+        # Files without an embedded date are filed by modification time
+        timestamp = date.timestamp()
+        os.utime(path, (timestamp, timestamp))
+        counts[kind] += 1
+        total_bytes += os.path.getsize(path)
+
+    manifest = {
+        'spec': asdict(spec),
+        'files': spec.files,
+        'bytes': total_bytes,
+        'kinds': counts,
+    }
+    with open(os.path.join(root, 'corpus.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def add_spec_arguments(parser):
+    """Add the CorpusSpec options to an argument parser"""
+    defaults = CorpusSpec()
+    parser.add_argument('--files', type=int, default=defaults.files)
+    parser.add_argument('--size-kb', type=int, default=defaults.size_kb)
+    parser.add_argument('--depth', type=int, default=defaults.depth)
+    parser.add_argument('--fanout', type=int, default=defaults.fanout)
+    parser.add_argument('--duplicates', type=float, default=defaults.duplicates,
+                        help='share of files that are copies of another file')
+    parser.add_argument('--collisions', type=float, default=defaults.collisions,
+                        help='share of files reusing a name from the same month')
+    parser.add_argument('--months', type=int, default=defaults.months)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+
+
+def spec_from_args(args):
+    return CorpusSpec(
+        files=args.files, size_kb=args.size_kb, depth=args.depth, fanout=args.fanout,
+        duplicates=args.duplicates, collisions=args.collisions, months=args.months,
+        seed=args.seed,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('output', help='folder to create the corpus in')
+    add_spec_arguments(parser)
+    args = parser.parse_args(argv)
+
+    manifest = generate(args.output, spec_from_args(args))
+    print(f"{manifest['files']} files, {manifest['bytes'] / 1e6:.1f} MB in {args.output}: "
+          + ", ".join(f"{kind} {count}" for kind, count in manifest['kinds'].items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""
+Photo & Video Organizer engine
+------------------------------
+GUI-free organizing core shared by the Tk app and the command line.
+"""
+
+from .cache import MetadataCache
+from .dates import get_media_date, read_media_date
+from .engine import (
+    MONTH_TRANSLATIONS,
+    PHOTO_EXTENSIONS,
+    VIDEO_EXTENSIONS,
+    Organizer,
+    OrganizerConfig,
+    RunStats,
+    get_localized_month,
+)
+
+__all__ = [
+    'MONTH_TRANSLATIONS',
+    'MetadataCache',
+    'PHOTO_EXTENSIONS',
+    'VIDEO_EXTENSIONS',
+    'Organizer',
+    'OrganizerConfig',
+    'RunStats',
+    'get_localized_month',
+    'get_media_date',
+    'read_media_date',
+]
@@ -0,0 +1,14 @@
+"""
+Command line entry point that never imports Tk, for servers without tkinter:
+
+    python -m organizer SOURCE --dest DEST [options]
+"""
+
+import sys
+from multiprocessing import freeze_support
+
+from .cli import main
+
+if __name__ == '__main__':
+    freeze_support()
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+Asyncio I/O
+-----------
+An executor for network storage, where every stat, open and mkdir waits
+5-20 ms for the server. A thread pool sized for the CPU leaves the link idle
+most of that time, and a pool sized for the link lets one slow mount take
+every thread.
+
+IOLoop runs an asyncio event loop on a thread of its own. Every call handed
+to it becomes a task that first waits, for free, on a semaphore per mount
+point the call touches (both ends of a transfer) and only then takes one of
+concurrency threads for the blocking syscalls. Many calls are in flight
+at once, and no mount has more than its limit of them.
+
+It is a drop-in executor for the engine: submit() returns a
+concurrent.futures.Future, which can still be cancelled until its call has
+started. Calls are tagged with the paths they work on through bind(); paths
+are attributed to the mount of the configured root they are under, so only
+paths elsewhere cost a walk up to their mount point, once per folder.
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import wait as futures_wait
+from contextlib import AsyncExitStack
+
+# Blocking calls in flight at once, over all mounts
+DEFAULT_IO_CONCURRENCY = 64
+# Calls in flight at once per mount point, unless set for that mount
+DEFAULT_MOUNT_LIMIT = 16
+
+
+def mount_point(path):
+    """Mount point a path is on, walking up past parts that do not exist yet"""
+    path = os.path.abspath(path)
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+class _Bound:
+    """A callable tagged with the mount points it does I/O on"""
+
+    __slots__ = ('fn', 'mounts')
+
+    def __init__(self, fn, mounts):
+        self.fn = fn
+        self.mounts = mounts
+
+    def __call__(self, *args):
+        return self.fn(*args)
+
+
+class _Lane:
+    """Executor view of an IOLoop with a limit of its own on top of the mount limits"""
+
+    def __init__(self, io, limit):
+        self.io = io
+        self.limit = limit
+
+    def submit(self, fn, *args):
+        return self.io._submit(fn, args, self)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        # The loop belongs to the IOLoop
+        pass
+
+
+class IOLoop:
+    """Executor running blocking calls from an asyncio loop, limited per mount point
+
+    roots are the folders most paths are under (source and destinations);
+    mount_limits maps folders to the limit of the mount they are on.
+    """
+
+    def __init__(self, concurrency=DEFAULT_IO_CONCURRENCY, mount_limit=DEFAULT_MOUNT_LIMIT,
+                 mount_limits=None, roots=()):
+        self.concurrency = max(1, concurrency)
+        self.mount_limit = max(1, mount_limit)
+        self._limits = {mount_point(path): max(1, limit) for path, limit in (mount_limits or {}).items()}
+        # Longest roots first, so nested roots win
+        self._roots = sorted(
+            ((os.path.join(os.path.abspath(root), ''), mount_point(root)) for root in roots if root),
+            key=lambda item: len(item[0]), reverse=True
+        )
+        self._folder_mounts = {}
+        # Semaphores per mount and per lane, only touched on the loop thread
+        self._semaphores = {}
+        self._pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix='organize-io')
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='organize-io-loop', daemon=True)
+        self._thread.start()
+        self._lock = threading.Lock()
+        self._outstanding = set()
+        self._closed = False
+
+    def mount_of(self, path):
+        """Mount point of a path, from its root where it has one"""
+        path = os.path.abspath(path)
+        for prefix, mount in self._roots:
+            if path.startswith(prefix):
+                return mount
+        folder = os.path.dirname(path)
+        mount = self._folder_mounts.get(folder)
+        if mount is None:
+            mount = self._folder_mounts[folder] = mount_point(folder)
+        return mount
+
+    def bind(self, fn, paths):
+        """fn tagged with the mounts of paths, for submit()"""
+        mounts = sorted({self.mount_of(path) for path in paths if path})
+        return _Bound(fn, tuple(mounts))
+
+    def lane(self, limit):
+        """Executor sharing this loop whose calls are also held to limit at a time"""
+        return _Lane(self, max(1, limit))
+
+    def submit(self, fn, *args):
+        """Run fn(*args) once its mounts have room; returns a concurrent Future"""
+        return self._submit(fn, args)
+
+    def map(self, fn, *iterables):
+        futures = [self.submit(fn, *args) for args in zip(*iterables)]
+        return (future.result() for future in futures)
+
+    def _submit(self, fn, args, lane=None):
+        if self._closed:
+            raise RuntimeError("cannot submit after shutdown")
+        future = Future()
+        with self._lock:
+            self._outstanding.add(future)
+        future.add_done_callback(self._done)
+        asyncio.run_coroutine_threadsafe(self._call(future, fn, args, lane), self._loop)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._outstanding.discard(future)
+
+    def _semaphore(self, key, limit):
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = self._semaphores[key] = asyncio.Semaphore(limit)
+        return semaphore
+
+    async def _call(self, future, fn, args, lane):
+        async with AsyncExitStack() as stack:
+            if lane:
+                await stack.enter_async_context(self._semaphore(lane, lane.limit))
+            # Mounts are taken in sorted order, so two transfers never wait on each other
+            for mount in getattr(fn, 'mounts', ()):
+                await stack.enter_async_context(self._semaphore(mount, self._limits.get(mount, self.mount_limit)))
+            # Cancelled while waiting for room
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                result = await self._loop.run_in_executor(self._pool, fn, *args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """Stop taking calls, optionally cancel those not started, and stop the loop"""
+        if self._closed:
+            return
+        self._closed = True
+        with self._lock:
+            outstanding = list(self._outstanding)
+        if cancel_futures:
+            for future in outstanding:
+                future.cancel()
+        if wait:
+            futures_wait(outstanding)
+        asyncio.run_coroutine_threadsafe(self._drain(wait), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._pool.shutdown(wait=wait)
+
+    async def _drain(self, wait):
+        # Tasks of cancelled calls may still be waiting for room; they return once they get it
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if not wait:
+            for task in tasks:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
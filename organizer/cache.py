@@ -0,0 +1,155 @@
+"""
+Metadata cache
+--------------
+Remembers the date extracted from each file in a small SQLite database, keyed
+by path and checked against the file's size and modification time. When a
+folder is organized again, unchanged files cost a single stat instead of a
+fresh open and EXIF parse.
+
+The database lives in the user cache directory and is trimmed to
+max_entries after every run, dropping the entries that were used least
+recently.
+"""
+
+import os
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from .dates import SOURCE_NOW, read_media_date
+
+# Bumped whenever date extraction changes, so stale dates are re-read
+SCHEMA_VERSION = 3
+CACHE_FILENAME = 'metadata.sqlite'
+DEFAULT_MAX_ENTRIES = 1_000_000
+
+# SQLite's default limit on bound parameters per statement is 999
+_LOOKUP_CHUNK = 500
+
+# A date along with where it came from and the stat it was read under; the
+# inode is not cached, it is filled in from the current stat for scheduling
+DateInfo = namedtuple('DateInfo', 'date source size mtime_ns inode', defaults=(0,))
+
+
+def default_cache_dir():
+    """Per-user cache directory for the organizer"""
+    if sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Caches/Photo Organizer')
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~\\AppData\\Local')
+        return os.path.join(base, 'Photo Organizer', 'Cache')
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'photo_organizer')
+
+
+def default_cache_path():
+    """Location of the metadata cache database"""
+    return os.path.join(default_cache_dir(), CACHE_FILENAME)
+
+
+def resolve_date(file_path, photo_extensions, cached=None):
+    """Stat a file and return (DateInfo, hit), reusing cached when it still matches
+
+    Runs on the worker pool, so it never touches the database itself.
+    """
+    st = os.stat(file_path)
+    if cached and cached.size == st.st_size and cached.mtime_ns == st.st_mtime_ns:
+        return cached._replace(inode=st.st_ino), True
+    date, source = read_media_date(file_path, photo_extensions, st)
+    return DateInfo(date, source, st.st_size, st.st_mtime_ns, st.st_ino), False
+
+
+class MetadataCache:
+    """SQLite store of extracted dates keyed by absolute path"""
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES, rebuild=False):
+        self.path = path or default_cache_path()
+        self.max_entries = max_entries
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if rebuild or version != SCHEMA_VERSION:
+            self._create_schema()
+
+    def _create_schema(self):
+        with self.conn:
+            self.conn.execute('DROP TABLE IF EXISTS media')
+            self.conn.execute(
+                'CREATE TABLE media ('
+                ' path TEXT PRIMARY KEY,'
+                ' size INTEGER NOT NULL,'
+                ' mtime_ns INTEGER NOT NULL,'
+                ' date TEXT NOT NULL,'
+                ' source TEXT NOT NULL,'
+                ' last_used REAL NOT NULL'
+                ') WITHOUT ROWID'
+            )
+            self.conn.execute('CREATE INDEX media_last_used ON media (last_used)')
+            self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def lookup(self, paths):
+        """Cached DateInfo for each of paths, None where nothing is stored"""
+        keys = [os.path.abspath(p) for p in paths]
+        found = {}
+        for i in range(0, len(keys), _LOOKUP_CHUNK):
+            chunk = keys[i:i + _LOOKUP_CHUNK]
+            rows = self.conn.execute(
+                'SELECT path, size, mtime_ns, date, source FROM media '
+                f'WHERE path IN ({",".join("?" * len(chunk))})',
+                chunk
+            )
+            for path, size, mtime_ns, date, source in rows:
+                found[path] = DateInfo(datetime.fromisoformat(date), source, size, mtime_ns)
+        return [found.get(key) for key in keys]
+
+    def update(self, results):
+        """Store fresh results and mark hits as used, given (path, DateInfo, hit) triples"""
+        now = time.time()
+        fresh = []
+        used = []
+        for path, info, hit in results:
+            key = os.path.abspath(path)
+            if hit:
+                used.append((now, key))
+            elif info.source != SOURCE_NOW:
+                # Dates we could not read are worth retrying next time
+                fresh.append((key, info.size, info.mtime_ns, info.date.isoformat(), info.source, now))
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO media (path, size, mtime_ns, date, source, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                fresh
+            )
+            self.conn.executemany('UPDATE media SET last_used = ? WHERE path = ?', used)
+
+    def evict(self):
+        """Drop the least recently used entries beyond max_entries"""
+        count = self.conn.execute('SELECT COUNT(*) FROM media').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            with self.conn:
+                self.conn.execute(
+                    'DELETE FROM media WHERE path IN '
+                    '(SELECT path FROM media ORDER BY last_used LIMIT ?)',
+                    (excess,)
+                )
+        return max(excess, 0)
+
+    def clear(self):
+        """Remove every cached entry"""
+        with self.conn:
+            self.conn.execute('DELETE FROM media')
+
+    def close(self):
+        """Trim the cache and close the database"""
+        try:
+            self.evict()
+        finally:
+            self.conn.close()
@@ -0,0 +1,137 @@
+"""
+Library catalog
+---------------
+A SQLite index of every file the organizer placed: where it came from,
+where it went, its capture date and where that date came from, its size
+and a content hash. The catalog lives in the library root and is written
+batch by batch as a run goes, in one transaction per batch, so questions
+like "what do we have from 2019" or "is this file already organized" are
+answered from the index instead of a walk of the library.
+
+The hash is the partial hash of organizer.dedup (size plus the first and
+last 64 KB), computed on the transfer workers right after a file is
+placed, so it costs one small read from the page cache.
+
+In incremental mode a run skips every source the catalog already has with
+the same size and modification time, without looking at the library.
+"""
+
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import datetime
+
+CATALOG_FILENAME = '.photo_organizer_catalog.sqlite'
+SCHEMA_VERSION = 1
+
+# SQLite's default limit on bound parameters per statement is 999
+_LOOKUP_CHUNK = 500
+
+CatalogEntry = namedtuple('CatalogEntry', 'source dest date date_source size mtime_ns hash placed')
+
+
+def default_catalog_path(root):
+    """Catalog location in a library root"""
+    return os.path.join(root, CATALOG_FILENAME)
+
+
+def parse_period(text):
+    """Turn 'YYYY' or 'YYYY-MM' into the (start, end) dates it spans"""
+    parts = text.split('-')
+    year = int(parts[0])
+    if len(parts) == 1:
+        return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    month = int(parts[1])
+    if month == 12:
+        return datetime(year, 12, 1), datetime(year + 1, 1, 1)
+    return datetime(year, month, 1), datetime(year, month + 1, 1)
+
+
+class Catalog:
+    """Placed files of a library, keyed by absolute source path"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self._create_schema()
+
+    def _create_schema(self):
+        with self.conn:
+            self.conn.execute('DROP TABLE IF EXISTS files')
+            self.conn.execute(
+                'CREATE TABLE files ('
+                ' source TEXT PRIMARY KEY,'
+                ' dest TEXT NOT NULL,'
+                ' date TEXT NOT NULL,'
+                ' date_source TEXT NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' mtime_ns INTEGER NOT NULL,'
+                ' hash BLOB,'
+                ' placed REAL NOT NULL'
+                ') WITHOUT ROWID'
+            )
+            self.conn.execute('CREATE INDEX files_date ON files (date)')
+            self.conn.execute('CREATE INDEX files_content ON files (size, hash)')
+            self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def lookup(self, paths):
+        """(size, mtime_ns) recorded for each path, None where the catalog has no entry"""
+        keys = [os.path.abspath(path) for path in paths]
+        found = {}
+        for i in range(0, len(keys), _LOOKUP_CHUNK):
+            chunk = keys[i:i + _LOOKUP_CHUNK]
+            marks = ','.join('?' * len(chunk))
+            for source, size, mtime_ns in self.conn.execute(
+                f'SELECT source, size, mtime_ns FROM files WHERE source IN ({marks})', chunk
+            ):
+                found[source] = (size, mtime_ns)
+        return [found.get(key) for key in keys]
+
+    def add(self, file_path, dest_path, info, digest):
+        """Record a placed file from its DateInfo; written with the next flush"""
+        self.conn.execute(
+            'INSERT OR REPLACE INTO files'
+            ' (source, dest, date, date_source, size, mtime_ns, hash, placed)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (os.path.abspath(file_path), os.path.abspath(dest_path), info.date.isoformat(),
+             info.source, info.size, info.mtime_ns, digest, time.time())
+        )
+
+    def flush(self):
+        """Commit the entries added since the last flush"""
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def _entries(self, sql, params=()):
+        return [CatalogEntry(*row) for row in self.conn.execute(
+            'SELECT source, dest, date, date_source, size, mtime_ns, hash, placed FROM files ' + sql, params
+        )]
+
+    def in_period(self, start, end):
+        """Entries with capture dates from start up to end, oldest first"""
+        return self._entries('WHERE date >= ? AND date < ? ORDER BY date', (start.isoformat(), end.isoformat()))
+
+    def by_source(self, file_path):
+        """Entry of a source path, None if it was never placed"""
+        entries = self._entries('WHERE source = ?', (os.path.abspath(file_path),))
+        return entries[0] if entries else None
+
+    def by_content(self, size, digest):
+        """Entries of files with this size and partial hash"""
+        return self._entries('WHERE size = ? AND hash = ?', (size, digest))
+
+    def summary(self):
+        """(year-month, files, bytes) per capture month, in order"""
+        return self.conn.execute(
+            'SELECT substr(date, 1, 7) AS month, COUNT(*), SUM(size) FROM files GROUP BY month ORDER BY month'
+        ).fetchall()
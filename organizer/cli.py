@@ -0,0 +1,542 @@
+"""
+Command line interface
+----------------------
+Runs the organizing engine without a GUI, for scripted and scheduled
+imports:
+
+    python -m photo_organizer SOURCE --dest DEST [options]
+    python -m photo_organizer SOURCE --dest DEST --plan plan.jsonl
+    python -m photo_organizer --execute-plan plan.jsonl
+    python -m photo_organizer SOURCE --dest DEST --watch
+    python -m photo_organizer SOURCE --dest DEST --manifest work.sqlite --shards 64
+    python -m photo_organizer --manifest work.sqlite
+    python -m photo_organizer --dest DEST --catalog-list 2019
+    python -m photo_organizer --dest DEST --find-similar --quarantine DIR
+"""
+
+import argparse
+import os
+import signal
+import sys
+import time
+from dataclasses import replace
+
+from .aio import DEFAULT_IO_CONCURRENCY, DEFAULT_MOUNT_LIMIT
+from .cache import DEFAULT_MAX_ENTRIES
+from .catalog import Catalog, default_catalog_path, parse_period
+from .dedup import DEDUP_MODES, PARTIAL_CHUNK, full_hash, partial_hash
+from .engine import FILE_TYPES, MONTH_TRANSLATIONS, Organizer, OrganizerConfig, RunStats, is_video
+from .journal import plan_journal_path
+from .plan import PlanReader, PlanSummary, PlanWriter, moves_by_rename
+from .progress import ProgressTracker, format_duration
+from .shard import DEFAULT_SHARDS, LEASE_SECONDS, WorkManifest, merge_shards, organize_shards
+from .similar import DEFAULT_DISTANCE, HASH_KINDS, find_similar, quarantine
+from .throttle import parse_rate
+from .transfer import TRANSFER_MODES
+from .watch import DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE, open_watcher
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 1.0
+
+
+def build_parser():
+    """Create the argument parser for the organize command"""
+    parser = argparse.ArgumentParser(
+        prog='photo_organizer',
+        description='Organize photos and videos into Year/Month folders.'
+    )
+    parser.add_argument('source', nargs='?', help='folder containing the media files')
+    parser.add_argument('--dest',
+                        help='destination folder for photos (and videos unless --video-dest is given)')
+    parser.add_argument('--video-dest', default='',
+                        help='separate destination folder for videos')
+    parser.add_argument('--type', dest='file_types', choices=FILE_TYPES, default='all',
+                        help='which media to organize (default: all)')
+    parser.add_argument('--language', choices=list(MONTH_TRANSLATIONS), default='English',
+                        help='language of the month folder names (default: English)')
+    parser.add_argument('--move', action='store_true',
+                        help='delete files from the source after organizing')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of parallel workers for date extraction and transfers (default: 1)')
+    parser.add_argument('--processes', action='store_true',
+                        help='extract dates in worker processes instead of threads')
+    parser.add_argument('--async-io', action='store_true',
+                        help='keep many file operations in flight at once, for network storage')
+    parser.add_argument('--io-concurrency', type=int, default=DEFAULT_IO_CONCURRENCY, metavar='N',
+                        help=f'file operations in flight with --async-io (default: {DEFAULT_IO_CONCURRENCY})')
+    parser.add_argument('--mount-limit', action='append', type=parse_mount_limit, default=[],
+                        metavar='[PATH=]N',
+                        help='file operations in flight per mount point with --async-io, or on the mount '
+                             f'of PATH only; may be repeated (default: {DEFAULT_MOUNT_LIMIT})')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not read or write the metadata cache')
+    parser.add_argument('--rebuild-cache', action='store_true',
+                        help='discard the metadata cache and fill it again from this run')
+    parser.add_argument('--cache', dest='cache_path', default='',
+                        help='metadata cache database (default: in the user cache directory)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_ENTRIES,
+                        help=f'maximum number of cached files (default: {DEFAULT_MAX_ENTRIES})')
+    parser.add_argument('--dedup', choices=DEDUP_MODES,
+                        help='skip files whose content is already in the library, '
+                             'or hard link them into place')
+    parser.add_argument('--rebuild-hash-index', action='store_true',
+                        help='re-read the library into its dedup hash index')
+    parser.add_argument('--transfer', dest='transfer_mode', choices=TRANSFER_MODES, default='auto',
+                        help='how files are placed: auto picks rename, reflink or copy_file_range '
+                             'where the file systems allow it (default: auto)')
+    parser.add_argument('--limit-rate', metavar='RATE', type=parse_rate, default=0,
+                        help='transfer at most RATE bytes per second, e.g. 500K or 20M (default: no limit)')
+    parser.add_argument('--limit-files', metavar='N', type=float, default=0,
+                        help='start at most N transfers per second (default: no limit)')
+    parser.add_argument('--adaptive-throttle', action='store_true',
+                        help='slow transfers down below the limits while the storage responds slowly')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='start over instead of skipping files an interrupted run already placed')
+    parser.add_argument('--journal', dest='journal_path', default='',
+                        help='run journal location (default: in the user cache directory)')
+    parser.add_argument('--catalog', action='store_true',
+                        help='record every placed file in the library catalog')
+    parser.add_argument('--incremental', action='store_true',
+                        help='skip sources the library catalog has, unchanged (implies --catalog)')
+    parser.add_argument('--catalog-path', default='',
+                        help='library catalog location (default: in --dest)')
+    parser.add_argument('--catalog-summary', action='store_true',
+                        help='print the files and size per month in the library catalog of --dest')
+    parser.add_argument('--catalog-list', metavar='PERIOD',
+                        help='list the cataloged files captured in PERIOD (YYYY or YYYY-MM)')
+    parser.add_argument('--catalog-lookup', nargs='+', metavar='FILE',
+                        help='tell whether each FILE, or a copy of it, is already in the library')
+    parser.add_argument('--find-similar', action='store_true',
+                        help='report near-duplicate images in --dest (after organizing SOURCE, if given); '
+                             'needs NumPy')
+    parser.add_argument('--similar-hash', choices=HASH_KINDS, default='dhash',
+                        help='perceptual hash for --find-similar (default: dhash)')
+    parser.add_argument('--similar-distance', type=int, default=DEFAULT_DISTANCE, metavar='BITS',
+                        help='most differing hash bits of near-duplicates, out of 64 '
+                             f'(default: {DEFAULT_DISTANCE})')
+    parser.add_argument('--quarantine', metavar='DIR', default='',
+                        help='move the near-duplicates found into DIR, keeping the largest file of each group')
+    parser.add_argument('--metrics', action='store_true',
+                        help='time every stage and print a breakdown with the slowest files')
+    parser.add_argument('--metrics-out', metavar='FILE', default='',
+                        help='also write the metrics to FILE, as Prometheus text for .prom/.txt, else JSON')
+    parser.add_argument('--plan', metavar='PLAN',
+                        help='only plan the run and write the plan to PLAN (.jsonl or .sqlite)')
+    parser.add_argument('--execute-plan', metavar='PLAN',
+                        help='carry out a plan written earlier with --plan')
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='work on the shards of a sharded run listed in FILE, on a shared file system')
+    parser.add_argument('--shards', type=int, metavar='N',
+                        help=f'make the --manifest FILE for SOURCE with N shards first (e.g. {DEFAULT_SHARDS})')
+    parser.add_argument('--file-list', metavar='LIST',
+                        help='with --shards, shard the files listed in LIST (one per line) '
+                             'instead of walking SOURCE')
+    parser.add_argument('--merge', action='store_true',
+                        help='only merge the shards of --manifest FILE into the library, once all are done')
+    parser.add_argument('--lease', type=float, default=LEASE_SECONDS,
+                        help=f'seconds a claimed shard stays reserved without renewal (default: {LEASE_SECONDS})')
+    parser.add_argument('--watch', action='store_true',
+                        help='after organizing, keep organizing new files as they land in SOURCE')
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE,
+                        help='seconds a file must stay unchanged before it is organized '
+                             f'in watch mode (default: {DEFAULT_SETTLE:g})')
+    parser.add_argument('--poll', action='store_true',
+                        help='watch by walking SOURCE periodically instead of using inotify')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f'seconds between walks when polling (default: {DEFAULT_POLL_INTERVAL:g})')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only print errors and the final summary')
+    return parser
+
+
+def parse_mount_limit(text):
+    """Parse N or PATH=N into (PATH or '', N)"""
+    path, _, limit = text.rpartition('=')
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected N or PATH=N, got {text}")
+    if limit < 1:
+        raise argparse.ArgumentTypeError(f"mount limit must be at least 1, got {text}")
+    return path, limit
+
+
+def io_settings(args):
+    """OrganizerConfig settings of the I/O engine"""
+    limits = dict(args.mount_limit)
+    return dict(
+        async_io=args.async_io,
+        io_concurrency=args.io_concurrency,
+        mount_limit=limits.pop('', DEFAULT_MOUNT_LIMIT),
+        mount_limits=limits,
+    )
+
+
+def config_from_args(args):
+    """Turn parsed arguments into an OrganizerConfig"""
+    return OrganizerConfig(
+        source=args.source,
+        photo_dest=args.dest,
+        video_dest=args.video_dest,
+        file_types=args.file_types,
+        language=args.language,
+        delete_source=args.move,
+        workers=args.workers,
+        process_pool=args.processes,
+        use_cache=not args.no_cache,
+        cache_path=args.cache_path,
+        rebuild_cache=args.rebuild_cache,
+        cache_max_entries=args.cache_size,
+        dedup=args.dedup or '',
+        rebuild_hash_index=args.rebuild_hash_index,
+        transfer_mode=args.transfer_mode,
+        max_bytes_per_second=args.limit_rate,
+        max_files_per_second=args.limit_files,
+        adaptive_throttle=args.adaptive_throttle,
+        resume=not args.no_resume,
+        journal_path=args.journal_path,
+        metrics=args.metrics or bool(args.metrics_out),
+        catalog=args.catalog,
+        catalog_path=args.catalog_path,
+        incremental=args.incremental,
+        **io_settings(args)
+    )
+
+
+def absolute_folders(config):
+    """config with absolute source and destination folders, for runs carried out elsewhere"""
+    return replace(
+        config,
+        source=os.path.abspath(config.source),
+        photo_dest=os.path.abspath(config.photo_dest),
+        video_dest=os.path.abspath(config.video_dest) if config.video_dest else '',
+    )
+
+
+class ProgressPrinter:
+    """Prints a progress line at most once per PROGRESS_INTERVAL"""
+
+    def __init__(self, stream=sys.stderr):
+        self.stream = stream
+        self.last_print = 0.0
+        self.tracker = ProgressTracker()
+
+    def __call__(self, stats, file_path):
+        now = time.monotonic()
+        if now - self.last_print < PROGRESS_INTERVAL and stats.processed != stats.total:
+            return
+        self.last_print = now
+        self.tracker.update(stats.processed, stats.total, stats.bytes_transferred, now)
+        print(f"Files Processed: {stats.processed} / {stats.total} ({self.tracker.summary()})",
+              file=self.stream)
+
+
+def print_summary(stats, config):
+    """Print the outcome of an organize or plan execution"""
+    action_text = "moved" if config.delete_source else "copied"
+    # Duplicates count as processed, but only links (if any) were placed for them
+    outcome = f"{stats.processed - stats.duplicates} of {stats.total} files {action_text}, "
+    if stats.duplicates:
+        outcome += f"{stats.duplicates} duplicates {'linked' if config.dedup == 'link' else 'skipped'}, "
+    print(outcome + f"{stats.failed} failed in {stats.elapsed:.1f}s "
+          f"({stats.files_per_second:.1f} files/s).")
+    if stats.unchanged:
+        print(f"Incremental: {stats.unchanged} files skipped, already in the library catalog.")
+    if stats.resumed or stats.partial_files_removed:
+        print(f"Resumed: {stats.resumed} files already placed by an earlier run, "
+              f"{stats.partial_files_removed} partial files removed.")
+    if stats.transfer_methods:
+        print("Transfers: " + ", ".join(f"{name} {count}" for name, count in sorted(stats.transfer_methods.items())))
+    if stats.throttled_seconds:
+        print(f"Throttled: transfers waited {stats.throttled_seconds:.1f}s in total for the rate limits.")
+    if config.use_cache:
+        print(f"Metadata cache: {stats.cache_hits} hits, {stats.cache_misses} misses.")
+    if config.dedup:
+        print(f"Duplicates: {stats.duplicates} files, "
+              f"{stats.bytes_deduplicated / 1e6:.1f} MB not copied.")
+
+
+def same_content(catalog, file_path):
+    """(entry, unconfirmed) for a file: a cataloged copy of it, or one that can no longer be compared
+
+    The catalog only has partial hashes, so a match of a larger file is
+    confirmed against the full content of the library file.
+    """
+    size = os.path.getsize(file_path)
+    matches = catalog.by_content(size, partial_hash(file_path, size))
+    if size <= 2 * PARTIAL_CHUNK:
+        # The partial hash covered the whole file
+        return (matches[0] if matches else None), None
+    digest = None
+    unconfirmed = None
+    for match in matches:
+        if not os.path.exists(match.dest):
+            unconfirmed = unconfirmed or match
+            continue
+        digest = digest or full_hash(file_path)
+        if full_hash(match.dest) == digest:
+            return match, None
+    return None, unconfirmed
+
+
+def query_catalog(parser, args):
+    """Answer the catalog queries of args from the library catalog"""
+    if not args.catalog_path and not args.dest:
+        parser.error("--dest or --catalog-path is required for catalog queries")
+    path = args.catalog_path or default_catalog_path(args.dest)
+    if not os.path.exists(path):
+        print(f"No library catalog at {path}, organize with --catalog first.", file=sys.stderr)
+        return 2
+    catalog = Catalog(path)
+    try:
+        if args.catalog_summary:
+            total_files = total_bytes = 0
+            for month, files, size in catalog.summary():
+                print(f"{month}  {files:8d} files {size / 1e6:12.1f} MB")
+                total_files += files
+                total_bytes += size
+            print(f"{total_files} files, {total_bytes / 1e6:.1f} MB in the catalog.")
+        if args.catalog_list:
+            try:
+                start, end = parse_period(args.catalog_list)
+            except ValueError:
+                parser.error(f"--catalog-list takes YYYY or YYYY-MM, not {args.catalog_list}")
+            entries = catalog.in_period(start, end)
+            for entry in entries:
+                print(f"{entry.date[:10]}  {entry.dest}")
+            print(f"{len(entries)} files from {args.catalog_list}.")
+        missing = 0
+        for file_path in args.catalog_lookup or ():
+            entry = catalog.by_source(file_path)
+            unconfirmed = None
+            if entry is None and os.path.isfile(file_path):
+                entry, unconfirmed = same_content(catalog, file_path)
+            if entry is None and unconfirmed:
+                missing += 1
+                print(f"{file_path}: possibly a copy of {unconfirmed.dest}, which no longer exists to compare")
+            elif entry is None:
+                missing += 1
+                print(f"{file_path}: not organized")
+            elif not os.path.exists(entry.dest):
+                print(f"{file_path}: cataloged as {entry.dest}, which no longer exists")
+            else:
+                print(f"{file_path}: {entry.dest}")
+        return 1 if missing else 0
+    finally:
+        catalog.close()
+
+
+def report_similar(args):
+    """Find near-duplicate images in the library, then report or quarantine them"""
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print("Finding near-duplicates needs NumPy: pip install numpy", file=sys.stderr)
+        return 2
+    quarantine_dir = os.path.abspath(args.quarantine) if args.quarantine else ''
+    groups, stats = find_similar(args.dest, args.similar_distance, args.similar_hash,
+                                 workers=max(4, args.workers), exclude=quarantine_dir)
+    for group in groups:
+        print(group.keeper)
+        for path, distance in group.similar:
+            print(f"  {distance:2d}  {path}")
+    similar = sum(len(group.similar) for group in groups)
+    print(f"Near-duplicates: {similar} files in {len(groups)} groups among {stats.files} images "
+          f"({stats.hashed} hashed, {stats.unreadable} unreadable).")
+    if quarantine_dir and similar:
+        moved = quarantine(groups, args.dest, quarantine_dir)
+        print(f"Moved {moved} files to {quarantine_dir}.")
+    return 0
+
+
+def report_metrics(stats, path=''):
+    """Print the stage breakdown of a run with metrics on, and export it to path"""
+    if not stats.metrics:
+        return
+    for line in stats.metrics.summary():
+        print(line)
+    if path:
+        stats.metrics.write(path)
+        print(f"Metrics written to {path}.")
+
+
+def write_plan(organizer, path, metrics_out=''):
+    """Plan a run into path and print what it would do"""
+    config = organizer.config
+    settings = {key: getattr(config, key) for key in PlanReader.SETTINGS}
+    summary = PlanSummary()
+    renamed = {}
+    stats = RunStats()
+    with PlanWriter(path, settings) as writer:
+        for entry in organizer.plan(stats):
+            writer.write(entry)
+            root = config.dest_for(is_video(entry.source))
+            if root not in renamed:
+                renamed[root] = (config.delete_source and config.transfer_mode == 'auto'
+                                 and moves_by_rename(config.source, root))
+            summary.add(entry, renamed[root])
+
+    for folder, (files, size) in sorted(summary.folders.items()):
+        print(f"{size / 1e6:12.1f} MB {files:8d} files  {folder}")
+    print(f"Planned {summary.files} files, {summary.bytes / 1e6:.1f} MB, "
+          f"{stats.failed} failed in {stats.elapsed:.1f}s. Plan written to {path}.")
+    print(f"Estimated run time: {format_duration(summary.estimated_seconds())}")
+    report_metrics(stats, metrics_out)
+    return 1 if stats.failed else 0
+
+
+def skipping(watcher, on_progress):
+    """Progress callback that also keeps the watcher from handing out files already placed"""
+    def callback(stats, file_path):
+        watcher.skip(file_path)
+        if on_progress:
+            on_progress(stats, file_path)
+    return callback
+
+
+def watch(organizer, watcher):
+    """Organize new files as they land in the source folder until interrupted"""
+    print(f"Watching {organizer.config.source} ({watcher.kind}), press Ctrl+C to stop.", file=sys.stderr)
+    # Stop between files instead of raising KeyboardInterrupt in the middle of one
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: organizer.cancel())
+    return organizer.watch(watcher)
+
+
+def run_sharded(parser, args, on_progress):
+    """Make a work manifest if asked, work on its shards and merge them once all are done"""
+    if args.dedup:
+        parser.error("--dedup is not supported with --manifest")
+    if args.shards:
+        if not args.source or not args.dest:
+            parser.error("SOURCE and --dest are required to make a manifest")
+        # Other machines have to find the same folders
+        config = absolute_folders(config_from_args(args))
+        settings = {key: getattr(config, key) for key in PlanReader.SETTINGS}
+        file_list = None
+        if args.file_list:
+            with open(args.file_list, encoding='utf-8') as f:
+                file_list = [line.rstrip('\n') for line in f if line.strip()]
+        manifest = WorkManifest.create(args.manifest, settings, args.shards, file_list)
+        print(f"Work manifest written to {args.manifest}: {manifest.counts().get('pending', 0)} shards.",
+              file=sys.stderr)
+    else:
+        manifest = WorkManifest(args.manifest)
+        config = replace(config_from_args(args), **manifest.settings())
+
+    try:
+        failed = 0
+        if not args.merge:
+            def on_shard(shard, stats):
+                if not args.quiet:
+                    print(f"Shard {shard}: {stats.processed} of {stats.total} files, "
+                          f"{stats.failed} failed.", file=sys.stderr)
+            try:
+                stats = organize_shards(manifest, config, lease=args.lease,
+                                        on_progress=on_progress, on_shard=on_shard)
+            except KeyboardInterrupt:
+                print("Organization cancelled, the shard is taken over once its lease runs out.",
+                      file=sys.stderr)
+                return 130
+            print_summary(stats, config)
+            failed = stats.failed
+
+        merged = merge_shards(manifest, lease=args.lease)
+        if merged:
+            print(f"Merged {merged.files} files from {merged.shards} shards into the library, "
+                  f"{merged.renamed} renamed to avoid name clashes.")
+        elif manifest.merged():
+            print("The shards have already been merged.")
+        else:
+            print(f"Shards still being worked on: {manifest.unfinished()}. "
+                  "The worker finishing the last one merges them into the library.")
+        return 1 if failed else 0
+    finally:
+        manifest.close()
+
+
+def main(argv=None):
+    """Entry point for the organize command"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    on_progress = None if args.quiet else ProgressPrinter()
+
+    if args.manifest:
+        return run_sharded(parser, args, on_progress)
+    if args.shards or args.file_list or args.merge:
+        parser.error("--shards, --file-list and --merge need --manifest")
+
+    if args.catalog_summary or args.catalog_list or args.catalog_lookup:
+        return query_catalog(parser, args)
+
+    if args.find_similar and not args.source:
+        if not args.dest:
+            parser.error("--dest is required for --find-similar")
+        return report_similar(args)
+
+    if args.execute_plan:
+        reader = PlanReader(args.execute_plan)
+        config = OrganizerConfig(
+            workers=args.workers,
+            transfer_mode=args.transfer_mode,
+            max_bytes_per_second=args.limit_rate,
+            max_files_per_second=args.limit_files,
+            adaptive_throttle=args.adaptive_throttle,
+            use_cache=False,
+            metrics=args.metrics or bool(args.metrics_out),
+            catalog=args.catalog,
+            catalog_path=args.catalog_path,
+            resume=not args.no_resume,
+            journal_path=args.journal_path or plan_journal_path(args.execute_plan),
+            **io_settings(args),
+            **reader.settings()
+        )
+        organizer = Organizer(config, on_progress=on_progress)
+        try:
+            stats = organizer.execute_plan(reader, total=reader.count())
+        except KeyboardInterrupt:
+            print("Organization cancelled.", file=sys.stderr)
+            return 130
+        print_summary(stats, config)
+        report_metrics(stats, args.metrics_out)
+        return 1 if stats.failed else 0
+
+    if not args.source or not args.dest:
+        parser.error("SOURCE and --dest are required unless --execute-plan is given")
+    if not os.path.isdir(args.source):
+        print(f"Source folder not found: {args.source}", file=sys.stderr)
+        return 2
+
+    config = config_from_args(args)
+    if args.plan:
+        # The plan may be carried out from another folder or machine
+        config = absolute_folders(config)
+    organizer = Organizer(config, on_progress=on_progress)
+    watcher = None
+    if args.watch and not args.plan:
+        # Watch from before the first pass, so files landing behind its scan are not missed
+        watcher = open_watcher(config.source, config.extensions(), settle=args.settle,
+                               poll_interval=args.poll_interval, polling=args.poll)
+        organizer.on_progress = skipping(watcher, on_progress)
+
+    try:
+        if args.plan:
+            return write_plan(organizer, args.plan, args.metrics_out)
+        stats = organizer.run()
+    except KeyboardInterrupt:
+        if watcher:
+            watcher.stop()
+        print("Organization cancelled.", file=sys.stderr)
+        return 130
+    organizer.on_progress = on_progress
+
+    print_summary(stats, config)
+    report_metrics(stats, args.metrics_out)
+    similar_status = 0
+    if args.find_similar and not stats.cancelled:
+        similar_status = report_similar(args)
+    if watcher and not stats.cancelled:
+        stats = watch(organizer, watcher)
+        print_summary(stats, config)
+        report_metrics(stats, args.metrics_out)
+    return 1 if stats.failed else similar_status
@@ -0,0 +1,94 @@
+"""
+Media dates
+-----------
+Works out when a photo or video was taken.
+
+Photo dates are read by the header-only readers in organizer.photo (JPEG,
+HEIC/HEIF, RAW and WebP), and videos by the container readers in
+organizer.video. Photos the fast readers cannot handle go through Pillow,
+and everything else falls back to the file modification time.
+"""
+
+import os
+import struct
+from datetime import datetime
+
+from .exif import TAG_NAMES
+from .photo import read_photo_date
+from .video import VIDEO_READERS, read_video_date
+
+# EXIF tags for DateTimeOriginal and DateTime
+EXIF_DATE_TAGS = (36867, 306)
+EXIF_DATE_FORMAT = '%Y:%m:%d %H:%M:%S'
+
+# Where a date came from when no metadata had one
+SOURCE_MTIME = 'mtime'
+SOURCE_NOW = 'now'
+
+# Pillow is heavy, so it is only imported the first time a photo needs it
+_Image = None
+
+
+def _pil_image():
+    """Lazy load Pillow's Image module"""
+    global _Image
+    if _Image is None:
+        from PIL import Image
+        _Image = Image
+    return _Image
+
+
+def read_pillow_exif_date(file_path):
+    """Read the capture date through Pillow's full EXIF decoder, as (date, tag name)"""
+    with _pil_image().open(file_path) as img:
+        exif = img._getexif() if hasattr(img, '_getexif') else None
+        if exif:
+            # Look for DateTimeOriginal or DateTime tag
+            for tag_id in EXIF_DATE_TAGS:
+                if tag_id in exif:
+                    return datetime.strptime(exif[tag_id], EXIF_DATE_FORMAT), TAG_NAMES[tag_id]
+    return None
+
+
+def read_media_date(file_path, photo_extensions=('.jpg', '.jpeg', '.png', '.gif'), stat=None):
+    """Get the creation date of a media file along with where it came from
+
+    The source is the EXIF tag or video atom/chunk name, 'mtime' for the modification time
+    fallback or 'now' when the file could not be read at all. Passing the
+    file's os.stat result saves a second stat for the fallback.
+    """
+    try:
+        # Try to get EXIF data for photos, fast path first
+        if file_path.lower().endswith(photo_extensions):
+            try:
+                found = read_photo_date(file_path)
+            except (ValueError, struct.error):
+                try:
+                    found = read_pillow_exif_date(file_path)
+                except Exception:
+                    found = None
+            if found:
+                return found
+
+        # Videos carry their date in the container
+        elif os.path.splitext(file_path)[1].lower() in VIDEO_READERS:
+            try:
+                found = read_video_date(file_path)
+            except (ValueError, struct.error):
+                found = None
+            if found:
+                return found
+
+        # Fall back to file modification time
+        mtime = stat.st_mtime if stat else os.path.getmtime(file_path)
+        return datetime.fromtimestamp(mtime), SOURCE_MTIME
+
+    except Exception as e:
+        print(f"Error getting date for {file_path}: {str(e)}")
+        # Return current date if all methods fail
+        return datetime.now(), SOURCE_NOW
+
+
+def get_media_date(file_path, photo_extensions=('.jpg', '.jpeg', '.png', '.gif')):
+    """Get the creation date of a media file"""
+    return read_media_date(file_path, photo_extensions)[0]
@@ -0,0 +1,189 @@
+"""
+Duplicate detection
+-------------------
+Finds files whose content is already in the destination library, so a
+repeated card dump does not turn IMG_1234.JPG into IMG_1234_1.JPG.
+
+Every library root keeps a hash index (a SQLite file in the root itself)
+listing its files with their size and, once computed, a partial hash over the
+first and last 64 KB and a full content hash. A source file is compared
+in three steps, each only when the previous one matched:
+
+1. size, answered by the index without touching the disk
+2. partial hash, reading at most 128 KB from each file
+3. full hash, reading both files completely
+
+The index is filled with one walk of the library the first time it is
+opened and kept up to date with every file the organizer places. Entries for
+files that were deleted or changed since are noticed and fixed when they come
+up as candidates.
+"""
+
+import hashlib
+import os
+import sqlite3
+
+from .scan import scan_media
+
+INDEX_FILENAME = '.photo_organizer_hashes.sqlite'
+SCHEMA_VERSION = 1
+
+# Bytes hashed at each end of a file for the partial hash
+PARTIAL_CHUNK = 64 * 1024
+HASH_BUFFER = 1024 * 1024
+
+DEDUP_MODES = ('skip', 'link')
+
+
+def partial_hash(path, size):
+    """Hash of the size and the first and last PARTIAL_CHUNK bytes of a file"""
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(PARTIAL_CHUNK))
+        if size > 2 * PARTIAL_CHUNK:
+            f.seek(-PARTIAL_CHUNK, os.SEEK_END)
+        digest.update(f.read(PARTIAL_CHUNK))
+    return digest.digest()
+
+
+def full_hash(path):
+    """Hash of the whole content of a file"""
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_BUFFER):
+            digest.update(chunk)
+    return digest.digest()
+
+
+class _Hashes:
+    """Lazily computed hashes of one file"""
+
+    def __init__(self, path, size, partial=None, full=None):
+        self.path = path
+        self.size = size
+        self._partial = partial
+        self._full = full
+
+    @property
+    def partial(self):
+        if self._partial is None:
+            self._partial = partial_hash(self.path, self.size)
+        return self._partial
+
+    @property
+    def full(self):
+        if self.size <= 2 * PARTIAL_CHUNK:
+            # The partial hash already covers every byte
+            return self.partial
+        if self._full is None:
+            self._full = full_hash(self.path)
+        return self._full
+
+
+class HashIndex:
+    """Content index of one destination library
+
+    wait_for(path) is called before a candidate's content is read, so a
+    file this run is still writing can be finished first.
+    """
+
+    def __init__(self, root, extensions, rebuild=False, wait_for=None):
+        self.root = root
+        self.wait_for = wait_for or (lambda path: None)
+        os.makedirs(root, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, INDEX_FILENAME), timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if rebuild or version != SCHEMA_VERSION:
+            self._create_schema()
+            self._index_library(extensions)
+
+    def _create_schema(self):
+        with self.conn:
+            self.conn.execute('DROP TABLE IF EXISTS files')
+            self.conn.execute(
+                'CREATE TABLE files ('
+                ' path TEXT PRIMARY KEY,'
+                ' size INTEGER NOT NULL,'
+                ' mtime_ns INTEGER,'
+                ' partial BLOB,'
+                ' full BLOB'
+                ') WITHOUT ROWID'
+            )
+            self.conn.execute('CREATE INDEX files_size ON files (size)')
+            self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def _index_library(self, extensions):
+        """Record every media file already in the library, without hashing"""
+        rows = []
+        for path in scan_media(self.root, extensions):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            rows.append((os.path.relpath(path, self.root), st.st_size, st.st_mtime_ns))
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO files (path, size, mtime_ns) VALUES (?, ?, ?)', rows)
+
+    def find(self, file_path, size):
+        """Path of a library file with the same content as file_path, or None
+
+        Returns (existing path, hashes of file_path) so the hashes can be
+        stored with the file once it is placed.
+        """
+        source = _Hashes(file_path, size)
+        candidates = self.conn.execute(
+            'SELECT path, mtime_ns, partial, full FROM files WHERE size = ?', (size,)
+        ).fetchall()
+        for rel_path, mtime_ns, partial, full in candidates:
+            path = os.path.join(self.root, rel_path)
+            self.wait_for(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._forget(rel_path)
+                continue
+            if st.st_size != size:
+                self._forget(rel_path)
+                continue
+            if mtime_ns is not None and st.st_mtime_ns != mtime_ns:
+                # Changed since it was hashed
+                partial = full = None
+
+            candidate = _Hashes(path, size, partial, full)
+            try:
+                same = candidate.partial == source.partial and candidate.full == source.full
+            except OSError:
+                continue
+            finally:
+                self._store_hashes(rel_path, st.st_mtime_ns, candidate)
+            if same:
+                return path, source
+        return None, source
+
+    def add(self, dest_path, size, hashes=None):
+        """Record a file placed in the library"""
+        partial = hashes._partial if hashes else None
+        full = hashes._full if hashes else None
+        self.conn.execute(
+            'INSERT OR REPLACE INTO files (path, size, mtime_ns, partial, full) VALUES (?, ?, NULL, ?, ?)',
+            (os.path.relpath(dest_path, self.root), size, partial, full)
+        )
+
+    def _store_hashes(self, rel_path, mtime_ns, hashes):
+        self.conn.execute(
+            'UPDATE files SET mtime_ns = ?, partial = ?, full = ? WHERE path = ?',
+            (mtime_ns, hashes._partial, hashes._full, rel_path)
+        )
+
+    def _forget(self, rel_path):
+        self.conn.execute('DELETE FROM files WHERE path = ?', (rel_path,))
+
+    def flush(self):
+        """Commit pending index changes"""
+        self.conn.commit()
+
+    def close(self):
+        """Commit and close the index"""
+        self.conn.commit()
+        self.conn.close()
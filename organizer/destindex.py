@@ -0,0 +1,122 @@
+"""
+Destination index
+-----------------
+Keeps the names in every destination folder a run writes to in memory, so
+finding a free name for IMG_0001.JPG does not cost one stat per _1, _2, ...
+candidate. Each folder is listed with a single os.scandir the first time it
+is used, names are added as files are placed, and the next free suffix is
+remembered per base name.
+
+The index also creates each folder once, on first use, instead of calling
+os.makedirs for every file. Where the platform supports it, it then keeps
+the folder open, so transfers can work relative to the folder (dir_fd)
+instead of resolving its full path again for every file, which costs
+round trips on network file systems.
+
+The index assumes nothing else writes to the destination folders during a
+run.
+"""
+
+import os
+import sys
+
+# Open folder descriptors kept per run, well below the usual 1024 fd limit
+MAX_DIR_FDS = 256
+
+# dir_fd-relative creation, renames and links (POSIX)
+DIR_FD_SUPPORTED = (
+    hasattr(os, 'O_DIRECTORY')
+    and {os.open, os.rename, os.link, os.remove} <= os.supports_dir_fd
+)
+
+# Destination file systems on macOS and Windows usually ignore case
+if sys.platform in ('darwin', 'win32'):
+    def _name_key(name):
+        return name.casefold()
+else:
+    def _name_key(name):
+        return name
+
+
+class _FolderIndex:
+    """Taken names and next free suffixes of one folder"""
+
+    def __init__(self, names):
+        self.names = {_name_key(name) for name in names}
+        self.next_suffix = {}
+        self.created = False
+        self.fd = None
+
+
+class DestinationIndex:
+    """Hands out free file names per destination folder
+
+    With dir_fds, prepared folders are kept open until close().
+    """
+
+    def __init__(self, dir_fds=False):
+        self._folders = {}
+        self._dir_fds = dir_fds and DIR_FD_SUPPORTED
+        self._open_fds = 0
+
+    def _folder(self, dest_dir):
+        folder = self._folders.get(dest_dir)
+        if folder is None:
+            try:
+                with os.scandir(dest_dir) as entries:
+                    folder = _FolderIndex(entry.name for entry in entries)
+            except FileNotFoundError:
+                folder = _FolderIndex(())
+            self._folders[dest_dir] = folder
+        return folder
+
+    def reserve(self, dest_dir, filename):
+        """Claim a free name in dest_dir, adding _1, _2, ... on clashes, and return its path"""
+        folder = self._folder(dest_dir)
+        key = _name_key(filename)
+        if key in folder.names:
+            base, ext = os.path.splitext(filename)
+            counter = folder.next_suffix.get(key, 1)
+            filename = f"{base}_{counter}{ext}"
+            while _name_key(filename) in folder.names:
+                counter += 1
+                filename = f"{base}_{counter}{ext}"
+            folder.next_suffix[key] = counter + 1
+        folder.names.add(_name_key(filename))
+        return os.path.join(dest_dir, filename)
+
+    def prepare(self, dest_dir):
+        """Create dest_dir unless this index already did, and open it if dir_fds is on"""
+        folder = self._folders.get(dest_dir)
+        if folder is not None and folder.created:
+            return
+        os.makedirs(dest_dir, exist_ok=True)
+        if folder is None:
+            folder = self._folder(dest_dir)
+        folder.created = True
+        if self._dir_fds and self._open_fds < MAX_DIR_FDS:
+            try:
+                folder.fd = os.open(dest_dir, os.O_RDONLY | os.O_DIRECTORY)
+                self._open_fds += 1
+            except OSError:
+                pass
+
+    def dir_fd(self, dest_dir):
+        """Open descriptor of a prepared folder, None if it was not kept open"""
+        folder = self._folders.get(dest_dir)
+        return folder.fd if folder else None
+
+    def close(self):
+        """Close the folder descriptors; call once no transfer uses them any more"""
+        for folder in self._folders.values():
+            if folder.fd is not None:
+                os.close(folder.fd)
+                folder.fd = None
+        self._open_fds = 0
+
+    def release(self, dest_path):
+        """Forget a reservation whose transfer never happened"""
+        dest_dir, filename = os.path.split(dest_path)
+        folder = self._folders.get(dest_dir)
+        if folder:
+            folder.names.discard(_name_key(filename))
@@ -0,0 +1,894 @@
+"""
+Organizing engine
+-----------------
+The GUI-free core of the Photo & Video Organizer. A run scans the source
+folder, works out the date of every media file, plans its Year/Month
+destination and copies or moves it there.
+
+Settings come from an OrganizerConfig and progress is reported through
+callbacks, so the same engine drives both the Tk app and the command line.
+
+With more than one worker, date extraction and transfers run on a pool while
+destination names are still picked one file at a time in scan order, so the
+_1, _2, ... suffixes come out the same as in a serial run.
+
+The source tree is walked once per run, on a background thread that streams
+paths to the organizer; the total grows as the walk progresses. watch()
+feeds files from an organizer.watch watcher through the same pipeline as
+they land in the source folder.
+
+On network storage, async_io hands dates and transfers to an asyncio loop
+that keeps many of them in flight, with a limit per mount point, see
+organizer.aio.
+
+Transfers can be held to byte and file rate limits, fixed or backing off as
+the storage slows down, see organizer.throttle.
+
+Placed files can be recorded in a catalog in the library (see
+organizer.catalog), which incremental runs use to skip sources they
+already organized.
+
+Transfers are recorded in a journal (see organizer.journal), so a run that
+crashed or was cancelled resumes where it stopped when started again with
+the same settings.
+
+plan() runs the same scan, dating and naming without touching any file, and
+execute_plan() carries out a plan made earlier, see organizer.plan.
+"""
+
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from itertools import islice
+
+from .aio import DEFAULT_IO_CONCURRENCY, DEFAULT_MOUNT_LIMIT, IOLoop
+from .cache import DEFAULT_MAX_ENTRIES, DateInfo, MetadataCache, resolve_date
+from .catalog import Catalog, default_catalog_path
+from .dates import get_media_date
+from .dedup import HashIndex, partial_hash
+from .destindex import DestinationIndex
+from .journal import Journal, default_journal_path
+from .metrics import NO_TIMER, RunMetrics, timed
+from .plan import PlanEntry
+from .scan import PathList, ScanQueue, scan_media
+from .schedule import LARGE_FILE_SIZE, LARGE_WORKERS, TransferScheduler
+from .throttle import Throttle
+from .transfer import Transferer
+
+# Supported file types
+PHOTO_EXTENSIONS = (
+    '.jpg', '.jpeg', '.png', '.gif', '.heic', '.heif', '.webp',
+    '.cr2', '.nef', '.arw', '.dng',
+)
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
+
+# Month folder names per language
+MONTH_TRANSLATIONS = {
+    'English': {
+        'January': 'January', 'February': 'February', 'March': 'March',
+        'April': 'April', 'May': 'May', 'June': 'June',
+        'July': 'July', 'August': 'August', 'September': 'September',
+        'October': 'October', 'November': 'November', 'December': 'December'
+    },
+    'Swedish': {
+        'January': 'Januari', 'February': 'Februari', 'March': 'Mars',
+        'April': 'April', 'May': 'Maj', 'June': 'Juni',
+        'July': 'Juli', 'August': 'Augusti', 'September': 'September',
+        'October': 'Oktober', 'November': 'November', 'December': 'December'
+    }
+}
+
+FILE_TYPES = ('all', 'photos', 'videos')
+
+# English month names in calendar order, the keys of MONTH_TRANSLATIONS
+ENGLISH_MONTHS = (
+    'January', 'February', 'March', 'April', 'May', 'June',
+    'July', 'August', 'September', 'October', 'November', 'December'
+)
+
+# Month folder names per language, indexed by month - 1
+MONTH_NAMES = {
+    language: tuple(months[name] for name in ENGLISH_MONTHS)
+    for language, months in MONTH_TRANSLATIONS.items()
+}
+
+# Files handed to the worker pool per batch, per worker
+BATCH_PER_WORKER = 16
+
+
+@dataclass
+class OrganizerConfig:
+    """Settings for one organize run"""
+    source: str
+    photo_dest: str = ''
+    # Empty means videos go to the photo destination
+    video_dest: str = ''
+    file_types: str = 'all'
+    language: str = 'English'
+    delete_source: bool = False
+    # Parallel date extraction and transfers; 1 keeps everything on one thread
+    workers: int = 1
+    # Extract dates in worker processes instead of threads (sidesteps the GIL)
+    process_pool: bool = False
+    # Run dates and transfers from an asyncio loop instead, with up to
+    # io_concurrency blocking calls in flight and mount_limit per mount point
+    # (mount_limits maps folders to a limit for their mount)
+    async_io: bool = False
+    io_concurrency: int = DEFAULT_IO_CONCURRENCY
+    mount_limit: int = DEFAULT_MOUNT_LIMIT
+    mount_limits: dict = field(default_factory=dict)
+    # Metadata cache; an empty path means the default location in the user cache dir
+    use_cache: bool = True
+    cache_path: str = ''
+    rebuild_cache: bool = False
+    cache_max_entries: int = DEFAULT_MAX_ENTRIES
+    # Content deduplication against the library: '' (off), 'skip' or 'link'
+    dedup: str = ''
+    rebuild_hash_index: bool = False
+    # How files are placed, see organizer.transfer
+    transfer_mode: str = 'auto'
+    # Files of at least large_file_size bytes are transferred apart from the
+    # rest, at most large_workers at a time, see organizer.schedule
+    large_file_size: int = LARGE_FILE_SIZE
+    large_workers: int = LARGE_WORKERS
+    # Transfer rate limits shared by all workers, 0 for none; adaptive backs
+    # off below them while the storage responds slowly
+    max_bytes_per_second: float = 0
+    max_files_per_second: float = 0
+    adaptive_throttle: bool = False
+    # Skip files an interrupted run with the same settings already placed;
+    # an empty journal path means the default location in the user cache dir
+    resume: bool = True
+    journal_path: str = ''
+    # The journal is on a shared file system: it does without WAL and is kept
+    # after the run, for the caller to remove once the run is accounted for
+    shared_journal: bool = False
+    # Per-stage timings and counters in RunStats.metrics, see organizer.metrics
+    metrics: bool = False
+    # Record placed files in the library catalog (by default in the photo
+    # destination); incremental skips sources it has, unchanged, and implies it
+    catalog: bool = False
+    catalog_path: str = ''
+    incremental: bool = False
+
+    def extensions(self):
+        """File extensions included by the file type selection"""
+        if self.file_types == 'photos':
+            return PHOTO_EXTENSIONS
+        if self.file_types == 'videos':
+            return VIDEO_EXTENSIONS
+        return PHOTO_EXTENSIONS + VIDEO_EXTENSIONS
+
+    def dest_for(self, is_video):
+        """Destination root for a photo or a video"""
+        if is_video and self.video_dest:
+            return self.video_dest
+        return self.photo_dest
+
+
+@dataclass
+class RunStats:
+    """Outcome of an organize run"""
+    total: int = 0
+    processed: int = 0
+    failed: int = 0
+    bytes_transferred: int = 0
+    cancelled: bool = False
+    elapsed: float = 0.0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    duplicates: int = 0
+    bytes_deduplicated: int = 0
+    # Files placed per transfer strategy
+    transfer_methods: dict = field(default_factory=dict)
+    # Files an interrupted earlier run had placed, and partial files it left
+    resumed: int = 0
+    partial_files_removed: int = 0
+    # Sources an incremental run skipped, unchanged since the catalog recorded them
+    unchanged: int = 0
+    # Seconds transfers spent waiting for the rate limits
+    throttled_seconds: float = 0.0
+    # RunMetrics of the run when config.metrics is on
+    metrics: object = None
+
+    @property
+    def files_per_second(self):
+        """Throughput of placed files over the whole run"""
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_second(self):
+        """Throughput of transferred bytes over the whole run"""
+        return self.bytes_transferred / self.elapsed if self.elapsed else 0.0
+
+
+# A submitted transfer of size bytes; duplicate marks a file placed by dedup.
+# For the catalog: the file's DateInfo and its path in the library, which for a
+# skipped duplicate is the copy already there
+_Transfer = namedtuple('_Transfer', 'file_path dest_path future size duplicate info library_path')
+
+
+def _with_hash(fn, hash_path, size, *args):
+    """Call fn(*args), then return its result and the partial hash of hash_path"""
+    result = fn(*args)
+    return result, partial_hash(hash_path, size)
+
+
+def is_video(file_path):
+    """Check whether a path is a supported video file"""
+    return file_path.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def _batched(iterable, size):
+    """Split an iterable into lists of at most size items"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class _InlineExecutor:
+    """Executor stand-in that runs calls immediately on the calling thread"""
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def map(self, fn, *iterables):
+        return map(fn, *iterables)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def get_localized_month(date, language):
+    """Get month name in the given language"""
+    # By month number, as strftime('%B') follows the process locale
+    return MONTH_NAMES[language][date.month - 1]
+
+
+class Organizer:
+    """Sorts media files into Year/Month folders according to a config
+
+    on_progress(stats, file_path) is called with the live RunStats after every
+    file that was placed, and on_error(file_path, exception) for every file
+    that failed. Both are called on the thread running the organize. While the
+    source is still being walked, stats.total is the number of files found so
+    far, or expected_total if that is larger.
+    """
+
+    def __init__(self, config, on_progress=None, on_error=None, expected_total=0):
+        self.config = config
+        self.expected_total = expected_total
+        self.transferer = Transferer(config.transfer_mode, config.delete_source, config.large_file_size)
+        self.on_progress = on_progress
+        self.on_error = on_error or self._print_error
+        self.cancel_flag = False
+        # Names taken in each destination folder, on disk or by this run
+        self.dest_index = DestinationIndex()
+        self._scanner = None
+        self._watcher = None
+        self._scheduler = None
+        self._catalog = None
+        self._io = None
+        # Year/month folder per (is video, year, month), worked out once per run
+        self._month_dirs = {}
+        self.throttle = self._make_throttle()
+        self.metrics = None
+        # Hash index per library root and transfers still writing, for dedup
+        self._hash_indexes = {}
+        self._pending = {}
+
+    def cancel(self):
+        """Ask a running organize to stop after the current file"""
+        self.cancel_flag = True
+        # A watcher may be waiting for new files
+        if self._watcher:
+            self._watcher.stop()
+        # Transfers waiting for the rate limits finish without further delay
+        if self.throttle:
+            self.throttle.interrupt()
+
+    def scan(self):
+        """Yield every matching media file under the source folder"""
+        return scan_media(self.config.source, self.config.extensions())
+
+    def count_files(self):
+        """Count the matching media files under the source folder"""
+        return sum(1 for _ in self.scan())
+
+    def destination_dir(self, file_path, date):
+        """Year/month folder a file belongs in"""
+        return self.destination_dirs([(file_path, date)])[0]
+
+    def destination_dirs(self, dated):
+        """Year/month folders of a batch of (file_path, date) pairs, in order
+
+        Files are bucketed by (is video, year, month) in one pass and the
+        path of every bucket is only built the first time a run sees it.
+        """
+        month_dirs = self._month_dirs
+        buckets = [(is_video(file_path), date.year, date.month) for file_path, date in dated]
+        for key in set(buckets).difference(month_dirs):
+            video, year, month = key
+            month_dirs[key] = os.path.join(
+                self.config.dest_for(video), str(year), MONTH_NAMES[self.config.language][month - 1]
+            )
+        return [month_dirs[key] for key in buckets]
+
+    def unique_destination(self, dest_dir, filename):
+        """Pick a free name in dest_dir, adding _1, _2, ... on clashes"""
+        return self.dest_index.reserve(dest_dir, filename)
+
+    def transfer(self, file_path, dest_path, size=None):
+        """Move or copy a file based on the delete setting, returning the strategy used
+
+        size is the file's size for the rate limits; it is looked up when not given.
+        """
+        dir_fd = self.dest_index.dir_fd(os.path.dirname(dest_path))
+        if self.throttle is None:
+            return self.transferer.transfer(file_path, dest_path, dir_fd)
+        if size is None:
+            size = os.path.getsize(file_path)
+        return self.throttle.call(size, self.transferer.transfer, file_path, dest_path, dir_fd)
+
+    def place_duplicate(self, file_path, existing, dest_path):
+        """Hard link an already organized copy to dest_path (if any) instead of copying"""
+        if dest_path:
+            dest_dir, filename = os.path.split(dest_path)
+            dir_fd = self.dest_index.dir_fd(dest_dir)
+            try:
+                os.link(existing, filename if dir_fd is not None else dest_path, dst_dir_fd=dir_fd)
+            except OSError:
+                # Different file system or no link support, place it normally
+                return self.transfer(file_path, dest_path)
+        if self.config.delete_source:
+            os.remove(file_path)
+        return None
+
+    def _hash_index(self, file_path):
+        """Hash index of the library a file is headed for"""
+        root = self.config.dest_for(is_video(file_path))
+        index = self._hash_indexes.get(root)
+        if index is None:
+            index = HashIndex(
+                root,
+                PHOTO_EXTENSIONS + VIDEO_EXTENSIONS,
+                rebuild=self.config.rebuild_hash_index,
+                wait_for=self._wait_for_transfer
+            )
+            self._hash_indexes[root] = index
+        return index
+
+    def _wait_for_transfer(self, dest_path):
+        """Block until this run has finished writing dest_path"""
+        job = self._pending.get(dest_path)
+        if job:
+            if job.future is None:
+                self._scheduler.flush()
+            wait([job.future])
+
+    def _dispatch(self, file_path, info, dest_dir, scheduler, journal=None):
+        """Reserve a name in dest_dir for a dated file, journal it and queue its transfer"""
+        if self.config.dedup:
+            index = self._hash_index(file_path)
+            with self._timer('dedup', file_path):
+                existing, hashes = index.find(file_path, info.size)
+            if existing:
+                dest_path = None
+                if self.config.dedup == 'link':
+                    dest_path = self._reserve(dest_dir, file_path)
+                    index.add(dest_path, info.size, hashes)
+                if journal:
+                    journal.begin(file_path, dest_path, info.size)
+                library_path = dest_path or existing
+                job = self._schedule(scheduler, file_path, info.size, info.inode,
+                                     self.place_duplicate, file_path, existing, dest_path,
+                                     hash_path=library_path)
+                return _Transfer(file_path, dest_path, job, info.size, True, info, library_path)
+
+        dest_path = self._reserve(dest_dir, file_path)
+        if self.config.dedup:
+            index.add(dest_path, info.size, hashes)
+        if journal:
+            journal.begin(file_path, dest_path, info.size)
+        job = self._schedule(scheduler, file_path, info.size, info.inode,
+                             self.transfer, file_path, dest_path, info.size, hash_path=dest_path)
+        self._pending[dest_path] = job
+        return _Transfer(file_path, dest_path, job, info.size, False, info, dest_path)
+
+    def get_date(self, file_path):
+        """Date a file is filed under"""
+        return get_media_date(file_path, PHOTO_EXTENSIONS)
+
+    def plan_destination(self, file_path, date):
+        """Create the year/month folder for a file (once per run) and reserve a free name in it"""
+        return self._reserve(self.destination_dir(file_path, date), file_path)
+
+    def _reserve(self, dest_dir, file_path):
+        """Create dest_dir (once per run) and reserve a free name in it for file_path"""
+        with self._timer('makedirs', file_path):
+            self.dest_index.prepare(dest_dir)
+        with self._timer('naming', file_path):
+            return self.unique_destination(dest_dir, os.path.basename(file_path))
+
+    def organize_file(self, file_path):
+        """Place a single file in its year/month folder and return its new path"""
+        dest_path = self.plan_destination(file_path, self.get_date(file_path))
+        self.transfer(file_path, dest_path)
+        return dest_path
+
+    def _batch_size(self):
+        """Files per batch, enough to keep every worker (or the I/O loop) busy"""
+        if self.config.async_io:
+            return max(1, self.config.io_concurrency) * BATCH_PER_WORKER
+        return max(1, self.config.workers) * BATCH_PER_WORKER
+
+    def _executors(self):
+        """Pools for date extraction and transfers, inline for a single worker"""
+        self._io = None
+        if self.config.async_io:
+            config = self.config
+            io = self._io = IOLoop(config.io_concurrency, config.mount_limit, config.mount_limits,
+                                   roots=(config.source, config.photo_dest, config.video_dest))
+            if config.process_pool:
+                return ProcessPoolExecutor(max(1, config.workers)), io
+            return io, io
+        workers = max(1, self.config.workers)
+        if workers == 1:
+            inline = _InlineExecutor()
+            return inline, inline
+        transfer_pool = ThreadPoolExecutor(workers, thread_name_prefix='organize')
+        if self.config.process_pool:
+            return ProcessPoolExecutor(workers), transfer_pool
+        return transfer_pool, transfer_pool
+
+    def _open_cache(self):
+        """Open the metadata cache, or return None when it is off or unusable"""
+        if not self.config.use_cache:
+            return None
+        try:
+            return MetadataCache(
+                self.config.cache_path or None,
+                max_entries=self.config.cache_max_entries,
+                rebuild=self.config.rebuild_cache
+            )
+        except (OSError, sqlite3.Error) as e:
+            print(f"Metadata cache disabled: {str(e)}")
+            return None
+
+    def _open_catalog(self):
+        """Open the library catalog, or return None when it is off or unusable"""
+        if not (self.config.catalog or self.config.incremental):
+            return None
+        try:
+            return Catalog(self.config.catalog_path or default_catalog_path(self.config.photo_dest))
+        except (OSError, sqlite3.Error) as e:
+            print(f"Library catalog disabled: {str(e)}")
+            return None
+
+    def _skip_unchanged(self, batch, stats):
+        """Drop the files of a batch the catalog has with the same size and modification time"""
+        remaining = []
+        for file_path, known in zip(batch, self._catalog.lookup(batch)):
+            if known:
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    st = None
+                if st and known == (st.st_size, st.st_mtime_ns):
+                    stats.unchanged += 1
+                    continue
+            remaining.append(file_path)
+        return remaining
+
+    def _open_journal(self, stats):
+        """Open the run journal and settle what an interrupted run left behind"""
+        try:
+            journal = Journal(self.config.journal_path or default_journal_path(self.config),
+                              wal=not self.config.shared_journal)
+            stats.partial_files_removed = journal.recover(self.config.delete_source)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Run journal disabled: {str(e)}")
+            return None
+        if not self.config.resume:
+            journal.clear()
+        return journal
+
+    def run(self):
+        """Organize every matching file under the source folder"""
+        return self._run(ScanQueue(self.config.source, self.config.extensions()))
+
+    def run_paths(self, paths):
+        """Organize the given files, as run() does with the files a scan finds"""
+        return self._run(PathList(list(paths)))
+
+    def watch(self, watcher):
+        """Organize new files as a watcher reports them, until cancelled
+
+        Files already in the source folder are left to run().
+        """
+        self._watcher = watcher
+        try:
+            return self._run(watcher)
+        finally:
+            self._watcher = None
+
+    def _run(self, scanner):
+        """Organize the batches of files a scanner or watcher hands out"""
+        self.cancel_flag = False
+        self.dest_index = DestinationIndex(dir_fds=True)
+        self._month_dirs = {}
+        self._hash_indexes = {}
+        self._pending = {}
+        self.throttle = self._make_throttle()
+        self.metrics = RunMetrics() if self.config.metrics else None
+        stats = RunStats()
+        started = time.monotonic()
+
+        # Settle the journal before the scan sees sources it may remove
+        journal = self._open_journal(stats)
+        scanner.start()
+        self._scanner = scanner
+        cache = self._open_cache()
+        catalog = self._catalog = self._open_catalog()
+        date_pool, transfer_pool = self._executors()
+        scheduler = self._scheduler = self._make_scheduler(transfer_pool)
+        batch_size = self._batch_size()
+        in_flight = []
+        # Stays False when the loop is left by an exception, such as a KeyboardInterrupt
+        completed = False
+        try:
+            for batch in scanner.batches(batch_size):
+                # Check if cancellation was requested
+                if self.cancel_flag:
+                    break
+
+                if journal:
+                    remaining = [file_path for file_path in batch if not journal.is_done(file_path)]
+                    stats.resumed += len(batch) - len(remaining)
+                    batch = remaining
+                if catalog and self.config.incremental:
+                    batch = self._skip_unchanged(batch, stats)
+
+                # Start on the dates of this batch while the previous one transfers
+                dates = self._submit_dates(batch, cache, date_pool)
+                self._collect(in_flight, stats, journal)
+
+                in_flight = []
+                resolved = []
+                for file_path, future in zip(batch, dates):
+                    if self.cancel_flag:
+                        break
+                    try:
+                        resolved.append((file_path, *self._date_result(file_path, future)))
+                    except Exception as e:
+                        self._failed(stats, file_path, e)
+
+                # Names are still reserved in scan order, which keeps the suffixes stable
+                dest_dirs = self.destination_dirs([(file_path, info.date) for file_path, info, _ in resolved])
+                for (file_path, info, _), dest_dir in zip(resolved, dest_dirs):
+                    if self.cancel_flag:
+                        break
+                    try:
+                        in_flight.append(self._dispatch(file_path, info, dest_dir, scheduler, journal))
+                    except Exception as e:
+                        self._failed(stats, file_path, e)
+                scheduler.flush()
+
+                self._record_dates(resolved, cache, stats)
+                for index in self._hash_indexes.values():
+                    index.flush()
+                if journal:
+                    if self._watcher:
+                        journal.prune()
+                    else:
+                        journal.flush()
+                if catalog:
+                    catalog.flush()
+
+            # Let started transfers finish so no half-written files are left behind
+            self._collect(in_flight, stats, journal)
+            completed = not self.cancel_flag and scanner.done
+        finally:
+            scanner.stop()
+            scheduler.shutdown(wait=True, cancel_futures=True)
+            transfer_pool.shutdown(wait=True, cancel_futures=True)
+            date_pool.shutdown(wait=True, cancel_futures=True)
+            self.dest_index.close()
+            if cache:
+                cache.close()
+            for index in self._hash_indexes.values():
+                index.close()
+            if catalog:
+                catalog.close()
+            self._catalog = None
+            if journal:
+                journal.close(finished=completed and not stats.failed and not self.config.shared_journal)
+
+        stats.total = scanner.found - stats.resumed - stats.unchanged
+        stats.cancelled = self.cancel_flag
+        stats.elapsed = time.monotonic() - started
+        if self.throttle:
+            stats.throttled_seconds = self.throttle.waited
+        self._finish_metrics(stats)
+        return stats
+
+    def plan(self, stats=None):
+        """Yield a PlanEntry for every matching file without touching any of them
+
+        Only stats files and reads their headers; no folders are created and
+        dedup is not applied. Pass a RunStats to have it filled in.
+        """
+        self.cancel_flag = False
+        self.dest_index = DestinationIndex()
+        self._month_dirs = {}
+        self.metrics = RunMetrics() if self.config.metrics else None
+        stats = stats if stats is not None else RunStats()
+        started = time.monotonic()
+        action = 'move' if self.config.delete_source else 'copy'
+
+        scanner = ScanQueue(self.config.source, self.config.extensions()).start()
+        self._scanner = scanner
+        cache = self._open_cache()
+        date_pool, transfer_pool = self._executors()
+        batch_size = self._batch_size()
+        try:
+            for batch in scanner.batches(batch_size):
+                if self.cancel_flag:
+                    break
+                dated = []
+                for file_path, future in zip(batch, self._submit_dates(batch, cache, date_pool)):
+                    try:
+                        dated.append((file_path, *self._date_result(file_path, future)))
+                    except Exception as e:
+                        self._failed(stats, file_path, e)
+                dest_dirs = self.destination_dirs([(file_path, info.date) for file_path, info, _ in dated])
+
+                resolved = []
+                for (file_path, info, hit), dest_dir in zip(dated, dest_dirs):
+                    try:
+                        with self._timer('naming', file_path):
+                            dest_path = self.unique_destination(dest_dir, os.path.basename(file_path))
+                    except Exception as e:
+                        self._failed(stats, file_path, e)
+                        continue
+                    resolved.append((file_path, info, hit))
+                    stats.processed += 1
+                    yield PlanEntry(file_path, dest_path, info.size, info.date, info.source, action)
+                self._record_dates(resolved, cache, stats)
+        finally:
+            scanner.stop()
+            transfer_pool.shutdown(wait=True, cancel_futures=True)
+            date_pool.shutdown(wait=True, cancel_futures=True)
+            if cache:
+                cache.close()
+            stats.total = scanner.found
+            stats.cancelled = self.cancel_flag
+            stats.elapsed = time.monotonic() - started
+            self._finish_metrics(stats)
+
+    def execute_plan(self, entries, total=0):
+        """Carry out plan entries made earlier by plan()
+
+        Entries whose source changed size since planning fail, and a
+        destination that got taken in the meantime gets the next free name.
+        Entries an earlier execution of the same plan carried out are skipped.
+        """
+        self.cancel_flag = False
+        self.dest_index = DestinationIndex(dir_fds=True)
+        self._scanner = None
+        self.throttle = self._make_throttle()
+        self.metrics = RunMetrics() if self.config.metrics else None
+        stats = RunStats(total=total)
+        started = time.monotonic()
+
+        journal = self._open_journal(stats)
+        catalog = self._catalog = self._open_catalog()
+        date_pool, transfer_pool = self._executors()
+        scheduler = self._scheduler = self._make_scheduler(transfer_pool)
+        batch_size = self._batch_size()
+        in_flight = []
+        try:
+            for batch in _batched(entries, batch_size):
+                if self.cancel_flag:
+                    break
+                self._collect(in_flight, stats, journal)
+                if journal:
+                    journal.flush()
+                if catalog:
+                    catalog.flush()
+                in_flight = []
+                for entry in batch:
+                    if self.cancel_flag:
+                        break
+                    if journal and journal.is_done(entry.source):
+                        stats.resumed += 1
+                        stats.total -= 1
+                        continue
+                    try:
+                        st = os.stat(entry.source)
+                        if st.st_size != entry.size:
+                            raise ValueError("file changed since the plan was made")
+                        dest_dir, filename = os.path.split(entry.destination)
+                        with self._timer('makedirs', entry.source):
+                            self.dest_index.prepare(dest_dir)
+                        with self._timer('naming', entry.source):
+                            dest_path = self.dest_index.reserve(dest_dir, filename)
+                    except Exception as e:
+                        self._failed(stats, entry.source, e)
+                        continue
+                    info = DateInfo(entry.date, entry.date_source, entry.size, st.st_mtime_ns, st.st_ino)
+                    if journal:
+                        journal.begin(entry.source, dest_path, entry.size)
+                    job = self._schedule(scheduler, entry.source, entry.size, st.st_ino,
+                                         self.transfer, entry.source, dest_path, entry.size, hash_path=dest_path)
+                    in_flight.append(_Transfer(entry.source, dest_path, job, entry.size, False, info, dest_path))
+                scheduler.flush()
+
+            self._collect(in_flight, stats, journal)
+        finally:
+            scheduler.shutdown(wait=True, cancel_futures=True)
+            transfer_pool.shutdown(wait=True, cancel_futures=True)
+            date_pool.shutdown(wait=True, cancel_futures=True)
+            self.dest_index.close()
+            if catalog:
+                catalog.close()
+            self._catalog = None
+            if journal:
+                # Kept once the plan is done too, so executing it again skips every entry
+                journal.close()
+
+        stats.cancelled = self.cancel_flag
+        stats.elapsed = time.monotonic() - started
+        if self.throttle:
+            stats.throttled_seconds = self.throttle.waited
+        self._finish_metrics(stats)
+        return stats
+
+    def _submit_dates(self, batch, cache, date_pool):
+        """Start resolving the dates of a batch, reusing cached ones"""
+        cached = cache.lookup(batch) if cache else [None] * len(batch)
+        task = (timed, resolve_date) if self.metrics else (resolve_date,)
+        futures = []
+        for file_path, known in zip(batch, cached):
+            fn, *args = task
+            if date_pool is self._io:
+                # Held to the limit of the source's mount
+                fn = self._io.bind(fn, (file_path,))
+            futures.append(date_pool.submit(fn, *args, file_path, PHOTO_EXTENSIONS, known))
+        return futures
+
+    def _date_result(self, file_path, future):
+        """(DateInfo, hit) of a submitted date, recording its time when metrics are on"""
+        if not self.metrics:
+            return future.result()
+        result, seconds = future.result()
+        self.metrics.observe('dates', seconds, file_path)
+        return result
+
+    def _make_throttle(self):
+        """Rate limiter for a run's transfers, None when nothing limits them"""
+        config = self.config
+        if not (config.max_bytes_per_second or config.max_files_per_second or config.adaptive_throttle):
+            return None
+        return Throttle(config.max_bytes_per_second, config.max_files_per_second, config.adaptive_throttle)
+
+    def _make_scheduler(self, transfer_pool):
+        """Transfer scheduler over the pool, with a large file lane when running on threads"""
+        if self._io:
+            # Large files share the I/O loop, on a lane of large_workers calls
+            return TransferScheduler(transfer_pool, 0, self.config.large_file_size,
+                                     large_pool=self._io.lane(self.config.large_workers))
+        large_workers = self.config.large_workers if self.config.workers > 1 else 0
+        return TransferScheduler(transfer_pool, large_workers, self.config.large_file_size)
+
+    def _schedule(self, scheduler, file_path, size, inode, fn, *args, hash_path=None):
+        """Queue a transfer, timed where it runs when metrics are on
+
+        With the catalog on, hash_path (the file's place in the library) is
+        hashed on the worker once the transfer is done.
+        """
+        if self._catalog and hash_path:
+            fn, args = _with_hash, (fn, hash_path, size) + args
+        if self.metrics:
+            fn, args = timed, (fn,) + args
+        if self._io:
+            # Held to the limits of the source's mount and the library's
+            fn = self._io.bind(fn, (file_path, hash_path))
+        return scheduler.add(file_path, size, inode, fn, *args)
+
+    def _timer(self, stage, file_path):
+        """Context manager timing file_path in a stage, a no-op without metrics"""
+        if self.metrics:
+            return self.metrics.timer(stage, file_path)
+        return NO_TIMER
+
+    def _failed(self, stats, file_path, error):
+        """Count and report a file that could not be organized"""
+        stats.failed += 1
+        if self.metrics:
+            self.metrics.error(error)
+        self.on_error(file_path, error)
+
+    def _finish_metrics(self, stats):
+        """Hand the run's metrics to its stats"""
+        if not self.metrics:
+            return
+        scan_seconds = getattr(self._scanner, 'seconds', None)
+        if scan_seconds is not None:
+            self.metrics.record_total('scan', scan_seconds)
+        self.metrics.finish(stats)
+        stats.metrics = self.metrics
+
+    def _record_dates(self, resolved, cache, stats):
+        """Count cache hits of a batch and store its fresh dates"""
+        hits = sum(1 for _, _, hit in resolved if hit)
+        stats.cache_hits += hits
+        stats.cache_misses += len(resolved) - hits
+        if cache:
+            cache.update(resolved)
+
+    def _collect(self, in_flight, stats, journal=None):
+        """Wait for submitted transfers in order and report each one"""
+        for file_path, dest_path, future, size, duplicate, info, library_path in in_flight:
+            stats.total = self._current_total(stats)
+            self._pending.pop(dest_path, None)
+            # Drop transfers that have not started yet once cancelled
+            if self.cancel_flag and future.cancel():
+                self._release(dest_path)
+                if journal:
+                    journal.forget(file_path)
+                continue
+            try:
+                method = future.result()
+                if self.metrics:
+                    method, seconds = method
+                    self.metrics.observe('transfer', seconds, file_path, size)
+                if self._catalog:
+                    method, digest = method
+                    self._catalog.add(file_path, library_path, info, digest)
+            except Exception as e:
+                self._release(dest_path)
+                if journal:
+                    journal.forget(file_path)
+                self._failed(stats, file_path, e)
+                continue
+
+            if journal:
+                journal.complete(file_path)
+            stats.processed += 1
+            if method:
+                stats.transfer_methods[method] = stats.transfer_methods.get(method, 0) + 1
+            if duplicate:
+                stats.duplicates += 1
+                stats.bytes_deduplicated += size
+            else:
+                stats.bytes_transferred += size
+            if self.on_progress:
+                self.on_progress(stats, file_path)
+
+    def _release(self, dest_path):
+        """Give back the name of a file that was never placed"""
+        if dest_path:
+            self.dest_index.release(dest_path)
+
+    def _current_total(self, stats):
+        """Best known total: exact once the walk is done, a lower bound before"""
+        if self._scanner is None:
+            return stats.total
+        # Files placed by an interrupted earlier run, or an earlier incremental one, are not counted again
+        skipped = stats.resumed + stats.unchanged
+        if self._scanner.done:
+            return self._scanner.found - skipped
+        return max(self._scanner.found, self.expected_total) - skipped
+
+    def _print_error(self, file_path, error):
+        action = 'moving' if self.config.delete_source else 'copying'
+        print(f"Error {action} {file_path}: {str(error)}")
@@ -0,0 +1,181 @@
+"""
+EXIF reader
+-----------
+A small reader for the date tags in EXIF/TIFF structures. It follows IFD0
+and the Exif IFD straight to DateTimeOriginal, DateTimeDigitized and
+DateTime, so only a few hundred bytes of a file are read and MakerNotes and
+thumbnails are never parsed.
+"""
+
+import os
+import struct
+from datetime import datetime
+
+# TIFF tags the fast reader looks at
+TAG_DATETIME = 306
+TAG_EXIF_IFD = 34665
+TAG_DATETIME_ORIGINAL = 36867
+TAG_DATETIME_DIGITIZED = 36868
+
+# Most trusted date first
+FAST_DATE_TAGS = (TAG_DATETIME_ORIGINAL, TAG_DATETIME_DIGITIZED, TAG_DATETIME)
+
+# Tag names, reported as the source of a date
+TAG_NAMES = {
+    TAG_DATETIME: 'DateTime',
+    TAG_DATETIME_ORIGINAL: 'DateTimeOriginal',
+    TAG_DATETIME_DIGITIZED: 'DateTimeDigitized',
+}
+
+# JPEG markers without a length field
+_STANDALONE_MARKERS = {0x01, 0xD8} | set(range(0xD0, 0xD8))
+_MARKER_SOS = 0xDA
+_MARKER_EOI = 0xD9
+_MARKER_APP1 = 0xE1
+
+# Sanity limit on IFD sizes, so corrupt files cannot make us read megabytes
+MAX_IFD_ENTRIES = 1024
+
+
+def parse_exif_datetime(value):
+    """Parse an EXIF 'YYYY:MM:DD HH:MM:SS' value, None if blank or invalid"""
+    if isinstance(value, bytes):
+        value = value.decode('ascii', 'replace')
+    value = value.strip('\x00 ')
+    try:
+        return datetime(
+            int(value[0:4]), int(value[5:7]), int(value[8:10]),
+            int(value[11:13]), int(value[14:16]), int(value[17:19])
+        )
+    except (ValueError, IndexError):
+        return None
+
+
+class TiffReader:
+    """Reads date tags from a TIFF structure starting at base in an open file"""
+
+    def __init__(self, f, base):
+        self.f = f
+        self.base = base
+        f.seek(base)
+        header = f.read(8)
+        if len(header) < 8 or header[:2] not in (b'II', b'MM'):
+            raise ValueError("not a TIFF header")
+        self.order = '<' if header[:2] == b'II' else '>'
+        magic, self.ifd0 = struct.unpack(self.order + 'HI', header[2:])
+        if magic != 42:
+            raise ValueError("bad TIFF magic")
+
+    def read_ifd(self, offset, wanted):
+        """Return {tag: (type, count, value_field)} for the wanted tags in one IFD"""
+        f = self.f
+        f.seek(self.base + offset)
+        raw = f.read(2)
+        if len(raw) < 2:
+            raise ValueError("truncated IFD")
+        (count,) = struct.unpack(self.order + 'H', raw)
+        if count > MAX_IFD_ENTRIES:
+            raise ValueError("implausible IFD size")
+        data = f.read(count * 12)
+        if len(data) < count * 12:
+            raise ValueError("truncated IFD")
+
+        entries = {}
+        for i in range(0, count * 12, 12):
+            tag, type_, n = struct.unpack(self.order + 'HHI', data[i:i + 8])
+            if tag in wanted:
+                entries[tag] = (type_, n, data[i + 8:i + 12])
+        return entries
+
+    def read_ascii(self, entry):
+        """Read the value of an ASCII entry"""
+        type_, n, field = entry
+        if type_ != 2:
+            return None
+        if n <= 4:
+            return field[:n]
+        (offset,) = struct.unpack(self.order + 'I', field)
+        self.f.seek(self.base + offset)
+        return self.f.read(min(n, 64))
+
+    def read_offset(self, entry):
+        """Read the value of a LONG (or IFD) pointer entry"""
+        (offset,) = struct.unpack(self.order + 'I', entry[2])
+        return offset
+
+    def dates(self):
+        """Dates found in IFD0 and the Exif IFD, keyed by tag"""
+        # TIFF/EP based RAW files may keep DateTimeOriginal in IFD0 itself
+        ifd0 = self.read_ifd(self.ifd0, {TAG_DATETIME, TAG_DATETIME_ORIGINAL, TAG_EXIF_IFD})
+        entries = dict(ifd0)
+        if TAG_EXIF_IFD in ifd0:
+            exif_ifd = self.read_ifd(
+                self.read_offset(ifd0[TAG_EXIF_IFD]),
+                {TAG_DATETIME_ORIGINAL, TAG_DATETIME_DIGITIZED}
+            )
+            entries.update(exif_ifd)
+
+        dates = {}
+        for tag in FAST_DATE_TAGS:
+            if tag in entries:
+                date = parse_exif_datetime(self.read_ascii(entries[tag]) or b'')
+                if date:
+                    dates[tag] = date
+        return dates
+
+
+def best_date(dates):
+    """Most trusted (date, tag name) out of TiffReader.dates(), None if empty"""
+    for tag in FAST_DATE_TAGS:
+        if tag in dates:
+            return dates[tag], TAG_NAMES[tag]
+    return None
+
+
+def _find_jpeg_exif(f):
+    """Seek through the JPEG markers and return the TIFF offset of the EXIF block"""
+    if f.read(2) != b'\xff\xd8':
+        raise ValueError("not a JPEG file")
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            raise ValueError("bad JPEG marker")
+        marker = f.read(1)
+        # Skip fill bytes
+        while marker == b'\xff':
+            marker = f.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in _STANDALONE_MARKERS:
+            continue
+        if marker in (_MARKER_SOS, _MARKER_EOI):
+            # Image data starts, no EXIF before it
+            return None
+        raw = f.read(2)
+        if len(raw) < 2:
+            return None
+        (length,) = struct.unpack('>H', raw)
+        if length < 2:
+            raise ValueError("bad JPEG segment length")
+        if marker == _MARKER_APP1:
+            start = f.tell()
+            if f.read(6) == b'Exif\x00\x00':
+                return start + 6
+            f.seek(start)
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_exif_date(file_path):
+    """Read the capture date of a JPEG from its EXIF header without Pillow
+
+    Returns (date, tag name), None when the file has no usable date, and
+    raises ValueError when it is not a JPEG the reader understands.
+    """
+    with open(file_path, 'rb') as f:
+        tiff_offset = _find_jpeg_exif(f)
+        if tiff_offset is None:
+            return None
+        return best_date(TiffReader(f, tiff_offset).dates())
@@ -0,0 +1,182 @@
+"""
+Run journal
+-----------
+A write-ahead log of the transfers of an organize run, so a run that crashed
+or was cancelled halfway through can pick up where it stopped.
+
+Every transfer is recorded as started, with its destination, before any
+data is written, and marked done once the file is in place. Files are
+written under a temporary name next to their destination and renamed into
+place when complete (see organizer.transfer), so a destination either holds
+the whole file or does not exist.
+
+On the next run with the same source, destinations and settings, the
+journal first settles the transfers that were still running: temporary
+files are removed, and a transfer whose destination made it into place is
+counted as done. Done transfers whose destination no longer exists are
+dropped, so those files are placed again. Sources that are done are then skipped before they are
+dated, with one set lookup each.
+
+Executing a plan is journalled the same way, keyed by the plan file, so
+executing it again skips the entries an earlier execution carried out.
+
+The journal lives in the user cache directory and is removed after a run
+that finished without failures; the journal of a plan is kept. A watch run
+only ends when stopped, so it drops done transfers as it goes and its
+journal holds no more than the transfers in flight.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+from .cache import default_cache_dir
+from .transfer import partial_path
+
+JOURNAL_DIRNAME = 'journals'
+
+
+def default_journal_path(config):
+    """Journal location for the run a config describes"""
+    key = json.dumps([
+        os.path.abspath(config.source),
+        os.path.abspath(config.photo_dest),
+        os.path.abspath(config.video_dest) if config.video_dest else '',
+        config.file_types,
+        config.language,
+        config.delete_source,
+    ])
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.sqlite'
+    return os.path.join(default_cache_dir(), JOURNAL_DIRNAME, name)
+
+
+def plan_journal_path(plan_path):
+    """Journal location for executing the plan file at plan_path"""
+    key = os.path.abspath(plan_path)
+    name = 'plan-' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.sqlite'
+    return os.path.join(default_cache_dir(), JOURNAL_DIRNAME, name)
+
+
+def _remove(path):
+    """Remove a file if it exists, returning whether it did"""
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+class Journal:
+    """Started and completed transfers of a run, keyed by absolute source path
+
+    wal=False uses SQLite's rollback journal, for journals on a shared file system.
+    """
+
+    def __init__(self, path, wal=True):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        if wal:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+        else:
+            # WAL needs shared memory, which network file systems do not provide
+            self.conn.execute('PRAGMA journal_mode=DELETE')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS transfers ('
+            ' source TEXT PRIMARY KEY,'
+            ' dest TEXT,'
+            ' size INTEGER NOT NULL,'
+            ' done INTEGER NOT NULL DEFAULT 0'
+            ') WITHOUT ROWID'
+        )
+        self.conn.commit()
+        self._done = {
+            source for (source,) in self.conn.execute('SELECT source FROM transfers WHERE done')
+        }
+
+    def recover(self, delete_source):
+        """Settle transfers an earlier run left unfinished, returning the partial files removed
+
+        A destination in place means the file was complete, as it only gets
+        its name once fully written; when moving, a leftover source is then
+        removed. Anything else is forgotten so the file is transferred again,
+        as are done transfers whose destination has since gone, say because
+        the library was cleared or moved.
+        """
+        removed = 0
+        done = self.conn.execute('SELECT source, dest FROM transfers WHERE done AND dest IS NOT NULL').fetchall()
+        gone = [(source,) for source, dest in done if not os.path.exists(dest)]
+        if gone:
+            with self.conn:
+                self.conn.executemany('DELETE FROM transfers WHERE source = ?', gone)
+            self._done.difference_update(source for (source,) in gone)
+        rows = self.conn.execute('SELECT source, dest, size FROM transfers WHERE NOT done').fetchall()
+        with self.conn:
+            for source, dest, size in rows:
+                placed = False
+                if dest:
+                    removed += _remove(partial_path(dest))
+                    try:
+                        placed = os.stat(dest).st_size == size
+                    except OSError:
+                        pass
+                if placed:
+                    if delete_source:
+                        _remove(source)
+                    self.conn.execute('UPDATE transfers SET done = 1 WHERE source = ?', (source,))
+                    self._done.add(source)
+                else:
+                    self.conn.execute('DELETE FROM transfers WHERE source = ?', (source,))
+        return removed
+
+    def is_done(self, file_path):
+        """Whether an earlier attempt already placed this file"""
+        return os.path.abspath(file_path) in self._done
+
+    def begin(self, file_path, dest_path, size):
+        """Record a transfer as started; committed before returning, ahead of any write"""
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO transfers (source, dest, size, done) VALUES (?, ?, ?, 0)',
+                (os.path.abspath(file_path), dest_path and os.path.abspath(dest_path), size)
+            )
+
+    def complete(self, file_path):
+        """Mark a transfer as done; written with the next flush"""
+        self.conn.execute(
+            'UPDATE transfers SET done = 1 WHERE source = ?', (os.path.abspath(file_path),)
+        )
+
+    def forget(self, file_path):
+        """Drop a transfer that failed or never started, so it is tried again"""
+        self.conn.execute('DELETE FROM transfers WHERE source = ?', (os.path.abspath(file_path),))
+
+    def flush(self):
+        """Commit completed and forgotten transfers"""
+        self.conn.commit()
+
+    def prune(self):
+        """Drop done transfers, for a watch run whose watcher never hands a file out twice"""
+        with self.conn:
+            self.conn.execute('DELETE FROM transfers WHERE done')
+        self._done.clear()
+
+    def clear(self):
+        """Forget every transfer, to start over"""
+        with self.conn:
+            self.conn.execute('DELETE FROM transfers')
+        self._done.clear()
+
+    def close(self, finished=False):
+        """Commit and close, removing the journal when the run finished"""
+        try:
+            self.conn.commit()
+        finally:
+            self.conn.close()
+        if finished:
+            for suffix in ('', '-wal', '-shm'):
+                _remove(self.path + suffix)
@@ -0,0 +1,263 @@
+"""
+Run metrics
+-----------
+Optional per-stage instrumentation of an organize run, to tell where the
+time of a slow run goes: walking the source, reading dates, creating
+folders, picking names, hashing for dedup or transferring.
+
+Every file's time in a stage is added to a fixed-bucket histogram, so
+recording costs two perf_counter calls and a bisect. Stages also count
+bytes, and keep the slowest files seen. Errors are counted by exception type.
+
+Work on the worker pools is timed where it runs, through timed(), and
+recorded on the organizer thread when the result is collected, so none of
+this needs a lock. With metrics off the organizer skips all of it.
+
+The result can be printed as a summary, or exported as JSON or in the
+Prometheus text format.
+"""
+
+import heapq
+import json
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import nullcontext
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# Slowest files kept per stage
+SLOWEST_FILES = 10
+
+METRIC_PREFIX = 'photo_organizer'
+
+# Stands in for a timer when metrics are off
+NO_TIMER = nullcontext()
+
+# RunStats counters included in exports
+_COUNTERS = (
+    'total', 'processed', 'failed', 'bytes_transferred', 'cache_hits', 'cache_misses',
+    'duplicates', 'bytes_deduplicated', 'resumed', 'throttled_seconds',
+)
+
+
+def timed(fn, *args):
+    """Call fn(*args) and return (result, seconds); picklable for process pools"""
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class Histogram:
+    """Counts of observations per latency bucket, plus their sum and maximum"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket and one for everything above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile, the maximum past the last"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def cumulative(self):
+        """(upper bound, observations at or below it) pairs, ending with +Inf"""
+        seen = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            pairs.append((bound, seen))
+        return pairs
+
+
+class StageMetrics:
+    """Latency histogram, bytes and slowest files of one stage"""
+
+    def __init__(self, slowest=SLOWEST_FILES):
+        self.histogram = Histogram()
+        self.bytes = 0
+        self.slowest_kept = slowest
+        self._slowest = []
+
+    def observe(self, seconds, path=None, size=0):
+        self.histogram.observe(seconds)
+        self.bytes += size
+        if path is not None and self.slowest_kept:
+            item = (seconds, path)
+            if len(self._slowest) < self.slowest_kept:
+                heapq.heappush(self._slowest, item)
+            elif item > self._slowest[0]:
+                heapq.heapreplace(self._slowest, item)
+
+    @property
+    def slowest(self):
+        """(seconds, path) of the slowest files, slowest first"""
+        return sorted(self._slowest, reverse=True)
+
+
+class _Timer:
+    """Context manager timing one file in one stage"""
+
+    __slots__ = ('metrics', 'stage', 'path', 'size', 'started')
+
+    def __init__(self, metrics, stage, path, size):
+        self.metrics = metrics
+        self.stage = stage
+        self.path = path
+        self.size = size
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started, self.path, self.size)
+
+
+class RunMetrics:
+    """Stage timings, errors and final counters of one run"""
+
+    def __init__(self, slowest=SLOWEST_FILES):
+        self.slowest = slowest
+        self.stages = {}
+        self.errors = Counter()
+        # Whole-stage times of work not split per file, such as the walk
+        self.stage_totals = {}
+        self.counters = {}
+        self.transfer_methods = {}
+        self.elapsed = 0.0
+
+    def stage(self, name):
+        metrics = self.stages.get(name)
+        if metrics is None:
+            metrics = self.stages[name] = StageMetrics(self.slowest)
+        return metrics
+
+    def observe(self, stage, seconds, path=None, size=0):
+        """Record one file's time (and bytes) in a stage"""
+        self.stage(stage).observe(seconds, path, size)
+
+    def timer(self, stage, path=None, size=0):
+        """Context manager recording the time of its block for path"""
+        return _Timer(self, stage, path, size)
+
+    def error(self, error):
+        """Count a failed file by exception type"""
+        self.errors[type(error).__name__] += 1
+
+    def record_total(self, stage, seconds):
+        """Record the total time of a stage not timed per file"""
+        self.stage_totals[stage] = self.stage_totals.get(stage, 0.0) + seconds
+
+    def finish(self, stats):
+        """Take over the final counters of a run"""
+        self.counters = {name: getattr(stats, name) for name in _COUNTERS}
+        self.transfer_methods = dict(stats.transfer_methods)
+        self.elapsed = stats.elapsed
+
+    def summary(self):
+        """Lines of a human readable report"""
+        lines = [f"{'stage':<10} {'files':>8} {'total s':>9} {'mean ms':>9} "
+                 f"{'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'MB/s':>8}"]
+        for name, seconds in self.stage_totals.items():
+            if name not in self.stages:
+                lines.append(f"{name:<10} {'':>8} {seconds:9.2f}")
+        for name, stage in self.stages.items():
+            h = stage.histogram
+            mean = h.sum / h.count if h.count else 0.0
+            rate = f"{stage.bytes / 1e6 / h.sum:8.1f}" if stage.bytes and h.sum else f"{'':>8}"
+            lines.append(
+                f"{name:<10} {h.count:8d} {h.sum:9.2f} {mean * 1000:9.2f} "
+                f"{h.quantile(0.5) * 1000:9.2f} {h.quantile(0.95) * 1000:9.2f} {h.max * 1000:9.2f} {rate}"
+            )
+        if self.errors:
+            lines.append("Errors: " + ", ".join(f"{name} {count}" for name, count in self.errors.most_common()))
+        slowest = sorted(
+            ((seconds, name, path) for name, stage in self.stages.items() for seconds, path in stage.slowest),
+            reverse=True
+        )[:self.slowest]
+        if slowest:
+            lines.append("Slowest files:")
+            lines.extend(f"  {seconds * 1000:9.1f} ms  {name:<9} {path}" for seconds, name, path in slowest)
+        return lines
+
+    def to_dict(self):
+        """Everything recorded, as JSON-ready data"""
+        return {
+            'elapsed': self.elapsed,
+            'counters': self.counters,
+            'transfer_methods': self.transfer_methods,
+            'errors': dict(self.errors),
+            'stage_totals': self.stage_totals,
+            'stages': {
+                name: {
+                    'count': stage.histogram.count,
+                    'seconds': stage.histogram.sum,
+                    'max_seconds': stage.histogram.max,
+                    'bytes': stage.bytes,
+                    'buckets': [[bound if bound != float('inf') else '+Inf', count]
+                                for bound, count in stage.histogram.cumulative()],
+                    'slowest': [{'seconds': seconds, 'path': path} for seconds, path in stage.slowest],
+                }
+                for name, stage in self.stages.items()
+            },
+        }
+
+    def to_prometheus(self):
+        """Everything recorded except file paths, in the Prometheus text format"""
+        p = METRIC_PREFIX
+        lines = [f'# TYPE {p}_stage_seconds histogram']
+        for name, stage in self.stages.items():
+            for bound, count in stage.histogram.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{p}_stage_seconds_bucket{{stage="{name}",le="{le}"}} {count}')
+            lines.append(f'{p}_stage_seconds_sum{{stage="{name}"}} {stage.histogram.sum}')
+            lines.append(f'{p}_stage_seconds_count{{stage="{name}"}} {stage.histogram.count}')
+        lines.append(f'# TYPE {p}_stage_bytes_total counter')
+        for name, stage in self.stages.items():
+            lines.append(f'{p}_stage_bytes_total{{stage="{name}"}} {stage.bytes}')
+        lines.append(f'# TYPE {p}_stage_total_seconds gauge')
+        for name, seconds in self.stage_totals.items():
+            lines.append(f'{p}_stage_total_seconds{{stage="{name}"}} {seconds}')
+        lines.append(f'# TYPE {p}_errors_total counter')
+        for name, count in self.errors.items():
+            lines.append(f'{p}_errors_total{{type="{name}"}} {count}')
+        lines.append(f'# TYPE {p}_transfers_total counter')
+        for name, count in self.transfer_methods.items():
+            lines.append(f'{p}_transfers_total{{method="{name}"}} {count}')
+        for name, value in self.counters.items():
+            lines.append(f'# TYPE {p}_{name} gauge')
+            lines.append(f'{p}_{name} {value}')
+        lines.append(f'# TYPE {p}_run_seconds gauge')
+        lines.append(f'{p}_run_seconds {self.elapsed}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Export to path, in Prometheus text for .prom and .txt files and JSON otherwise"""
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.lower().endswith(('.prom', '.txt')):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=2)
@@ -0,0 +1,221 @@
+"""
+Photo dates
+-----------
+Reads the capture date from photo headers without decoding any pixels.
+
+- JPEG: the EXIF APP1 segment, see organizer.exif
+- HEIC/HEIF: the ISOBMFF meta box lists the file's items in iinf and where
+  each one is stored in iloc; the Exif item holds a TIFF structure
+- CR2, NEF, ARW and DNG: TIFF files themselves, read from IFD0
+- WebP: the EXIF chunk of the RIFF container
+
+Every reader seeks straight to the date tags, so a 50 MB RAW costs a few
+small reads like a JPEG does.
+"""
+
+import os
+import struct
+
+from .exif import TiffReader, best_date, read_exif_date
+from .video import atoms, riff_chunks
+
+# Brands of HEIF based image files
+_HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1', b'avif'}
+
+# Bytes searched for a TIFF header when an Exif payload has an odd prefix
+_TIFF_SEARCH = 16
+
+
+def _read_tiff_at(f, base, size=_TIFF_SEARCH):
+    """Dates of a TIFF structure at base, or of one just after a short prefix"""
+    f.seek(base)
+    head = f.read(size + 4)
+    for magic in (b'II*\x00', b'MM\x00*'):
+        index = head.find(magic)
+        if index >= 0:
+            return best_date(TiffReader(f, base + index).dates())
+    raise ValueError("no TIFF header in Exif data")
+
+
+# HEIC / HEIF
+
+def _full_box(f, start):
+    """Version of a full box and the position after its version and flags"""
+    f.seek(start)
+    raw = f.read(4)
+    if len(raw) < 4:
+        raise ValueError("truncated box")
+    return raw[0], start + 4
+
+
+def _exif_item_ids(f, start, end):
+    """IDs of the Exif items listed in an iinf box"""
+    version, pos = _full_box(f, start)
+    pos += 2 if version == 0 else 4
+    ids = []
+    for kind, infe_start, _infe_end in atoms(f, pos, end):
+        if kind != b'infe':
+            continue
+        infe_version, item = _full_box(f, infe_start)
+        # Versions 0 and 1 predate item types and never carry Exif
+        if infe_version < 2:
+            continue
+        id_size = 2 if infe_version == 2 else 4
+        raw = f.read(id_size + 2 + 4)
+        if len(raw) < id_size + 6:
+            raise ValueError("truncated infe box")
+        item_id = int.from_bytes(raw[:id_size], 'big')
+        if raw[id_size + 2:] == b'Exif':
+            ids.append(item_id)
+    return ids
+
+
+def _item_locations(f, start, end, wanted):
+    """{item ID: (construction method, offset)} of the wanted items in an iloc box"""
+    version, pos = _full_box(f, start)
+    f.seek(pos)
+    raw = f.read(2)
+    if len(raw) < 2:
+        raise ValueError("truncated iloc box")
+    offset_size, length_size = raw[0] >> 4, raw[0] & 15
+    base_offset_size = raw[1] >> 4
+    index_size = raw[1] & 15 if version in (1, 2) else 0
+    id_size = 4 if version == 2 else 2
+
+    def number(size):
+        if not size:
+            return 0
+        data = f.read(size)
+        if len(data) < size:
+            raise ValueError("truncated iloc box")
+        return int.from_bytes(data, 'big')
+
+    count = number(4 if version == 2 else 2)
+    locations = {}
+    for _ in range(count):
+        item_id = number(id_size)
+        method = number(2) & 15 if version in (1, 2) else 0
+        number(2)  # data reference index
+        base = number(base_offset_size)
+        extents = number(2)
+        first = None
+        for _ in range(extents):
+            number(index_size)
+            offset = number(offset_size)
+            number(length_size)
+            if first is None:
+                first = offset
+        if item_id in wanted and first is not None:
+            locations[item_id] = (method, base + first)
+        if f.tell() > end:
+            raise ValueError("iloc box overruns its size")
+    return locations
+
+
+def read_heif_date(file_path):
+    """Capture date of a HEIC/HEIF image from its Exif item as (date, tag name)
+
+    Raises ValueError when the file is not HEIF.
+    """
+    with open(file_path, 'rb') as f:
+        end = os.fstat(f.fileno()).st_size
+        first = True
+        for kind, start, box_end in atoms(f, 0, end):
+            if first:
+                if kind != b'ftyp':
+                    raise ValueError("not a HEIF file")
+                f.seek(start)
+                brands = f.read(min(box_end - start, 64))
+                if not {brands[i:i + 4] for i in range(0, len(brands), 4)} & _HEIF_BRANDS:
+                    raise ValueError("not a HEIF file")
+                first = False
+                continue
+            if kind != b'meta':
+                continue
+
+            _version, pos = _full_box(f, start)
+            boxes = {child: (child_start, child_end) for child, child_start, child_end in atoms(f, pos, box_end)}
+            if b'iinf' not in boxes or b'iloc' not in boxes:
+                return None
+            ids = _exif_item_ids(f, *boxes[b'iinf'])
+            if not ids:
+                return None
+            locations = _item_locations(f, *boxes[b'iloc'], set(ids))
+            for item_id in ids:
+                if item_id not in locations:
+                    continue
+                method, offset = locations[item_id]
+                if method == 1:
+                    # Stored in the meta box's own idat
+                    if b'idat' not in boxes:
+                        continue
+                    offset += boxes[b'idat'][0]
+                elif method != 0:
+                    continue
+                # The item starts with the offset of the TIFF header past this field
+                f.seek(offset)
+                raw = f.read(4)
+                if len(raw) < 4:
+                    continue
+                (header_offset,) = struct.unpack('>I', raw)
+                found = _read_tiff_at(f, offset + 4 + header_offset)
+                if found:
+                    return found
+            return None
+        if first:
+            raise ValueError("not a HEIF file")
+    return None
+
+
+# RAW
+
+def read_tiff_date(file_path):
+    """Capture date of a TIFF based RAW (CR2, NEF, ARW, DNG) as (date, tag name)
+
+    Raises ValueError when the file does not start with a TIFF header.
+    """
+    with open(file_path, 'rb') as f:
+        return best_date(TiffReader(f, 0).dates())
+
+
+# WebP
+
+def read_webp_date(file_path):
+    """Capture date of a WebP image from its EXIF chunk as (date, tag name)
+
+    Raises ValueError when the file is not a RIFF WebP.
+    """
+    with open(file_path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WEBP':
+            raise ValueError("not a WebP file")
+        end = os.fstat(f.fileno()).st_size
+        for chunk_id, _list_type, payload, _chunk_end in riff_chunks(f, 12, end):
+            if chunk_id == b'EXIF':
+                return _read_tiff_at(f, payload)
+    return None
+
+
+PHOTO_READERS = {
+    '.jpg': read_exif_date,
+    '.jpeg': read_exif_date,
+    '.heic': read_heif_date,
+    '.heif': read_heif_date,
+    '.webp': read_webp_date,
+    '.cr2': read_tiff_date,
+    '.nef': read_tiff_date,
+    '.arw': read_tiff_date,
+    '.dng': read_tiff_date,
+}
+
+
+def read_photo_date(file_path):
+    """Capture date of a photo as (date, tag name) from its header, None if not set
+
+    Raises ValueError for files without a header reader, or that the reader
+    does not understand, so the caller can try Pillow instead.
+    """
+    reader = PHOTO_READERS.get(os.path.splitext(file_path)[1].lower())
+    if reader is None:
+        raise ValueError("no header reader for this file type")
+    return reader(file_path)
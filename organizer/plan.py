@@ -0,0 +1,194 @@
+"""
+Move plans
+----------
+A plan lists what an organize run would do, one entry per file: source,
+destination, size, date source and action. Planning only stats files and
+reads their headers, so a large import can be reviewed and estimated before
+anything is copied, and the saved plan can be executed later, also on
+another machine.
+
+Plans are written as JSON lines (.jsonl), with a header line holding the
+settings they were made with, or as a SQLite file (.sqlite, .sqlite3, .db).
+"""
+
+import json
+import os
+import sqlite3
+from collections import namedtuple
+from contextlib import closing
+from datetime import datetime
+
+PLAN_VERSION = 1
+SQLITE_SUFFIXES = ('.sqlite', '.sqlite3', '.db')
+
+# Rough transfer rates behind the duration estimate
+ESTIMATE_BYTES_PER_SECOND = 100e6
+ESTIMATE_FILES_PER_SECOND = 500
+
+PlanEntry = namedtuple('PlanEntry', 'source destination size date date_source action')
+
+
+def _is_sqlite(path):
+    return path.lower().endswith(SQLITE_SUFFIXES)
+
+
+def _device(path):
+    """st_dev of path, or of its closest existing parent"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.stat(path).st_dev
+
+
+def moves_by_rename(source, dest):
+    """Whether moving from source to dest can rename instead of copying data"""
+    try:
+        return _device(source) == _device(dest)
+    except OSError:
+        return False
+
+
+def _entry_to_dict(entry):
+    return {
+        'src': entry.source,
+        'dst': entry.destination,
+        'size': entry.size,
+        'date': entry.date.isoformat(),
+        'date_source': entry.date_source,
+        'action': entry.action,
+    }
+
+
+def _entry_from_values(src, dst, size, date, date_source, action):
+    return PlanEntry(src, dst, size, datetime.fromisoformat(date), date_source, action)
+
+
+class PlanSummary:
+    """Totals of a plan, overall and per destination folder"""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        # Bytes that have to be copied, as opposed to renamed in place
+        self.bytes_to_copy = 0
+        self.folders = {}
+
+    def add(self, entry, renamed=False):
+        """Count one entry; renamed entries cost no data transfer"""
+        self.files += 1
+        self.bytes += entry.size
+        if not renamed:
+            self.bytes_to_copy += entry.size
+        folder = os.path.dirname(entry.destination)
+        files, size = self.folders.get(folder, (0, 0))
+        self.folders[folder] = (files + 1, size + entry.size)
+
+    def estimated_seconds(self, bytes_per_second=ESTIMATE_BYTES_PER_SECOND,
+                          files_per_second=ESTIMATE_FILES_PER_SECOND):
+        """Expected run time at the given data rate plus per-file overhead"""
+        return self.bytes_to_copy / bytes_per_second + self.files / files_per_second
+
+
+class PlanWriter:
+    """Writes a plan to a JSON lines or SQLite file"""
+
+    def __init__(self, path, settings):
+        self.path = path
+        header = {'plan_version': PLAN_VERSION, 'created': datetime.now().isoformat()}
+        header.update(settings)
+        if _is_sqlite(path):
+            if os.path.exists(path):
+                os.remove(path)
+            self._conn = sqlite3.connect(path)
+            self._conn.execute('CREATE TABLE header (value TEXT NOT NULL)')
+            self._conn.execute(
+                'CREATE TABLE entries ('
+                ' id INTEGER PRIMARY KEY,'
+                ' src TEXT NOT NULL, dst TEXT NOT NULL, size INTEGER NOT NULL,'
+                ' date TEXT NOT NULL, date_source TEXT NOT NULL, action TEXT NOT NULL)'
+            )
+            self._conn.execute('INSERT INTO header VALUES (?)', (json.dumps(header),))
+            self._file = None
+        else:
+            self._conn = None
+            self._file = open(path, 'w', encoding='utf-8')
+            self._file.write(json.dumps(header) + '\n')
+
+    def write(self, entry):
+        """Append one entry"""
+        if self._conn:
+            self._conn.execute(
+                'INSERT INTO entries (src, dst, size, date, date_source, action) VALUES (?, ?, ?, ?, ?, ?)',
+                (entry.source, entry.destination, entry.size, entry.date.isoformat(),
+                 entry.date_source, entry.action)
+            )
+        else:
+            self._file.write(json.dumps(_entry_to_dict(entry)) + '\n')
+
+    def close(self):
+        if self._conn:
+            self._conn.commit()
+            self._conn.close()
+        else:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PlanReader:
+    """Reads a plan written by PlanWriter"""
+
+    # Settings that travel with a plan to the machine executing it
+    SETTINGS = ('source', 'photo_dest', 'video_dest', 'file_types', 'language', 'delete_source')
+
+    def __init__(self, path):
+        self.path = path
+        if _is_sqlite(path):
+            with closing(sqlite3.connect(path)) as conn:
+                self.header = json.loads(conn.execute('SELECT value FROM header').fetchone()[0])
+        else:
+            with open(path, encoding='utf-8') as f:
+                self.header = json.loads(f.readline())
+        if self.header.get('plan_version') != PLAN_VERSION:
+            raise ValueError(f"Unsupported plan version in {path}")
+
+    def settings(self):
+        """The organizer settings the plan was made with"""
+        return {key: self.header[key] for key in self.SETTINGS if key in self.header}
+
+    def count(self):
+        """Number of entries in the plan"""
+        if _is_sqlite(self.path):
+            with closing(sqlite3.connect(self.path)) as conn:
+                return conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        with open(self.path, 'rb') as f:
+            return sum(1 for _ in f) - 1
+
+    def __iter__(self):
+        if _is_sqlite(self.path):
+            conn = sqlite3.connect(self.path)
+            try:
+                rows = conn.execute(
+                    'SELECT src, dst, size, date, date_source, action FROM entries ORDER BY id'
+                )
+                for row in rows:
+                    yield _entry_from_values(*row)
+            finally:
+                conn.close()
+        else:
+            with open(self.path, encoding='utf-8') as f:
+                f.readline()
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        yield _entry_from_values(
+                            item['src'], item['dst'], item['size'], item['date'],
+                            item['date_source'], item['action']
+                        )
@@ -0,0 +1,76 @@
+"""
+Progress tracking
+-----------------
+Turns the engine's running counters into throughput figures and an ETA for
+the GUI and the command line. Rates are measured over a sliding window, so
+they follow the current speed rather than the average since the start.
+"""
+
+import time
+from collections import deque
+
+# Seconds of history the rates are measured over
+RATE_WINDOW = 5.0
+
+
+def format_duration(seconds):
+    """Format seconds as H:MM:SS or M:SS"""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class ProgressTracker:
+    """Throughput and ETA from a stream of (processed, total, bytes) samples"""
+
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self.processed = 0
+        self.total = 0
+        self.bytes_done = 0
+        self._samples = deque()
+
+    def update(self, processed, total, bytes_done, now=None):
+        """Record the latest counters"""
+        now = time.monotonic() if now is None else now
+        self.processed = processed
+        self.total = total
+        self.bytes_done = bytes_done
+        self._samples.append((now, processed, bytes_done))
+        # Keep one sample older than the window as the rate baseline
+        while len(self._samples) > 2 and now - self._samples[1][0] >= self.window:
+            self._samples.popleft()
+
+    def _rate(self, index):
+        if len(self._samples) < 2:
+            return 0.0
+        first, last = self._samples[0], self._samples[-1]
+        elapsed = last[0] - first[0]
+        return (last[index] - first[index]) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def files_per_second(self):
+        return self._rate(1)
+
+    @property
+    def bytes_per_second(self):
+        return self._rate(2)
+
+    @property
+    def eta(self):
+        """Seconds left at the current file rate, None while unknown"""
+        rate = self.files_per_second
+        if rate <= 0 or self.total <= self.processed:
+            return None
+        return (self.total - self.processed) / rate
+
+    def summary(self):
+        """One line with file and byte rates and the ETA"""
+        text = f"{self.files_per_second:.1f} files/s, {self.bytes_per_second / 1e6:.1f} MB/s"
+        eta = self.eta
+        if eta is not None:
+            text += f", ETA {format_duration(eta)}"
+        return text
@@ -0,0 +1,141 @@
+"""
+Source scanning
+---------------
+Walks the source folder with os.scandir and streams matching media files to
+the organizer through a bounded queue, so transfers start as soon as the
+first files are found and a huge tree never sits in memory as one list.
+"""
+
+import os
+import queue
+import threading
+import time
+
+# Paths buffered between the scanner thread and the organizer
+SCAN_QUEUE_SIZE = 10_000
+
+# Marks the end of the scan in the queue
+_DONE = object()
+
+
+def scan_media(source, extensions):
+    """Yield matching files under source in the same order as os.walk"""
+    stack = [source]
+    while stack:
+        folder = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        # Like os.walk, list linked folders but do not follow them
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(extensions):
+                        yield entry.path
+        except OSError:
+            # Unreadable folders are skipped, as os.walk does
+            continue
+        stack.extend(reversed(subdirs))
+
+
+class ScanQueue:
+    """Runs scan_media on a background thread and hands out batches of paths
+
+    found counts the files seen so far and done tells whether the walk has
+    finished, so the total can be refined while the run is already going.
+    seconds is the time spent walking, not counting waits on a full queue.
+    """
+
+    def __init__(self, source, extensions, maxsize=SCAN_QUEUE_SIZE):
+        self.source = source
+        self.extensions = extensions
+        self.found = 0
+        self.done = False
+        self.seconds = 0.0
+        self._queue = queue.Queue(maxsize)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._scan, name='scan', daemon=True)
+
+    def start(self):
+        """Start walking the source folder"""
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the walk early and wait for the scanner thread to exit"""
+        self._stop.set()
+        # Unblock a scanner waiting on a full queue
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread.join()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _scan(self):
+        walk = scan_media(self.source, self.extensions)
+        try:
+            while True:
+                started = time.perf_counter()
+                path = next(walk, None)
+                self.seconds += time.perf_counter() - started
+                if path is None:
+                    return
+                self.found += 1
+                if not self._put(path):
+                    return
+        finally:
+            self.done = True
+            self._put(_DONE)
+
+    def batches(self, size):
+        """Yield lists of up to size paths, waiting only for the first of each"""
+        finished = False
+        while not finished:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            batch = [item]
+            while len(batch) < size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    finished = True
+                    break
+                batch.append(item)
+            yield batch
+
+
+class PathList:
+    """Hands out a fixed list of paths in batches, in place of a ScanQueue"""
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.found = len(paths)
+        self.done = True
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def batches(self, size):
+        for i in range(0, len(self.paths), size):
+            yield self.paths[i:i + size]
@@ -0,0 +1,76 @@
+"""
+Transfer scheduling
+-------------------
+Decides the order transfers reach the disks in. Names are still reserved in
+scan order, so the _1, _2, ... suffixes do not depend on the schedule; only
+the order the copies run in changes.
+
+The transfers of a batch are held back and submitted together: small files
+first, grouped by source folder and sorted by inode, which on most file
+systems follows the order the data was written in, so a hard disk or NAS
+reads them mostly sequentially. Files of at least large_size go to a lane
+of their own with large_workers threads, so a few multi-gigabyte videos
+stream one after the other instead of fighting each other and every small
+file for the heads.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Files at least this large are streamed in the large lane
+LARGE_FILE_SIZE = 64 * 1024 * 1024
+# Large files transferred at the same time
+LARGE_WORKERS = 1
+
+
+class ScheduledTransfer:
+    """A queued transfer; behaves as its future once submitted"""
+
+    __slots__ = ('key', 'fn', 'args', 'future')
+
+    def __init__(self, key, fn, args):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.future = None
+
+    def result(self):
+        return self.future.result()
+
+    def cancel(self):
+        return self.future.cancel()
+
+
+class TransferScheduler:
+    """Queues the transfers of a batch and submits them in disk order on flush()"""
+
+    def __init__(self, pool, large_workers=LARGE_WORKERS, large_size=LARGE_FILE_SIZE, large_pool=None):
+        self.pool = pool
+        self.large_size = large_size
+        # Without worker threads (large_workers 0) large files share the main
+        # pool, unless the caller hands in a large_pool of its own
+        self._large_pool = large_pool
+        self._owns_large_pool = large_pool is None and large_workers > 0
+        if self._owns_large_pool:
+            self._large_pool = ThreadPoolExecutor(large_workers, thread_name_prefix='organize-large')
+        self._queued = []
+
+    def add(self, file_path, size, inode, fn, *args):
+        """Queue fn(*args) moving file_path; submitted by the next flush()"""
+        large = size >= self.large_size
+        job = ScheduledTransfer((large, os.path.dirname(file_path), inode), fn, args)
+        self._queued.append(job)
+        return job
+
+    def flush(self):
+        """Submit everything queued: small files by folder and inode, then large ones"""
+        queued, self._queued = self._queued, []
+        queued.sort(key=lambda job: job.key)
+        for job in queued:
+            pool = self._large_pool if job.key[0] and self._large_pool else self.pool
+            job.future = pool.submit(job.fn, *job.args)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """Stop the large lane; the main pool and a given large_pool belong to the caller"""
+        if self._owns_large_pool:
+            self._large_pool.shutdown(wait=wait, cancel_futures=cancel_futures)
@@ -0,0 +1,434 @@
+"""
+Sharded runs
+------------
+Splits one very large organize run over several worker processes, on one
+machine or on several machines that see the source and destinations under
+the same paths.
+
+A work manifest (a SQLite file on the shared file system) is made once: it
+lists the source folders, or the files of a precomputed file list, each
+assigned to one of a fixed number of shards by a hash of its folder path,
+so a folder always lands in the same shard. Workers then claim shards from
+the manifest's lease table until none is left. A lease runs out unless its
+worker renews it, so the shard of a crashed worker is taken over by the
+next one to ask.
+
+Each shard is organized into its own staging tree next to the library,
+DEST/.shards/<shard>/Year/Month, with its run journal in the staging tree,
+so a worker taking over resumes where the crashed one stopped and no two
+workers ever pick names in the same folder. Shard journals use SQLite's
+rollback journal like the manifest, and stay until the merge removes the
+staging tree. Once every shard is done, one worker merges the staging trees
+into the library in shard order, renaming each file into its Year/Month
+folder and adding _1, _2, ... where files of different shards (or files
+already in the library) share a name. The merge only renames within one
+file system and is safe to run again after a crash.
+
+Leases compare wall clock times of different machines, so their clocks
+should be roughly in sync; the default lease is generous for that reason.
+"""
+
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from dataclasses import replace
+
+from .destindex import DestinationIndex
+from .engine import Organizer, RunStats
+from .plan import PlanReader
+from .transfer import PARTIAL_SUFFIX
+
+MANIFEST_VERSION = 1
+DEFAULT_SHARDS = 64
+# Seconds a claimed shard stays reserved without being renewed
+LEASE_SECONDS = 600
+
+STAGING_DIRNAME = '.shards'
+JOURNAL_FILENAME = 'journal.sqlite'
+
+# Rows inserted per statement while making a manifest
+_INSERT_CHUNK = 10_000
+
+# RunStats counters added up over the shards of a worker
+_SUMMED = (
+    'total', 'processed', 'failed', 'bytes_transferred', 'cache_hits', 'cache_misses',
+    'resumed', 'partial_files_removed', 'throttled_seconds',
+)
+
+# Outcome of a merge
+MergeStats = namedtuple('MergeStats', 'shards files renamed')
+
+
+def shard_of(folder, shards):
+    """Shard a folder belongs to, the same on every machine"""
+    digest = hashlib.sha1(os.fsencode(folder)).digest()
+    return int.from_bytes(digest[:8], 'big') % shards
+
+
+def staging_dir(root, shard):
+    """Staging tree of a shard under a destination root"""
+    return os.path.join(root, STAGING_DIRNAME, f'{shard:05d}')
+
+
+def default_owner():
+    """Name a worker claims shards under"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _folders(source):
+    """Yield source and every folder below it, not following links"""
+    stack = [source]
+    while stack:
+        folder = stack.pop()
+        yield folder
+        try:
+            with os.scandir(folder) as entries:
+                stack.extend(
+                    entry.path for entry in entries
+                    if entry.is_dir(follow_symlinks=False)
+                )
+        except OSError:
+            continue
+
+
+def _folder_files(folder, extensions):
+    """Matching files directly in folder, sorted by name"""
+    try:
+        with os.scandir(folder) as entries:
+            names = sorted(
+                entry.name for entry in entries
+                if entry.name.lower().endswith(extensions) and entry.is_file()
+            )
+    except OSError:
+        return []
+    return [os.path.join(folder, name) for name in names]
+
+
+class WorkManifest:
+    """Shards of a sharded run, their leases and the settings of the run
+
+    Uses SQLite's rollback journal, not WAL, which needs shared memory that
+    network file systems do not provide.
+    """
+
+    def __init__(self, path, timeout=60):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No work manifest at {path}")
+        self.path = path
+        # Transactions are begun explicitly, so claims can take the write lock up front
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        row = self.conn.execute('SELECT value FROM header').fetchone()
+        self.header = json.loads(row[0])
+        if self.header.get('manifest_version') != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported work manifest version in {path}")
+
+    @classmethod
+    def create(cls, path, settings, shards=DEFAULT_SHARDS, file_list=None):
+        """Write a manifest for a run with settings, from a file list or by walking the source"""
+        if os.path.exists(path):
+            raise FileExistsError(f"Work manifest {path} already exists")
+        # Made under a temporary name, so workers never see half a manifest
+        partial = path + PARTIAL_SUFFIX
+        if os.path.exists(partial):
+            os.remove(partial)
+        conn = sqlite3.connect(partial)
+        try:
+            conn.execute('CREATE TABLE header (value TEXT NOT NULL)')
+            conn.execute(
+                'CREATE TABLE work ('
+                ' shard INTEGER NOT NULL, path TEXT NOT NULL, is_folder INTEGER NOT NULL)'
+            )
+            conn.execute(
+                'CREATE TABLE shards ('
+                ' id INTEGER PRIMARY KEY,'
+                " state TEXT NOT NULL DEFAULT 'pending',"
+                ' owner TEXT, lease_until REAL NOT NULL DEFAULT 0,'
+                ' attempts INTEGER NOT NULL DEFAULT 0,'
+                ' processed INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0,'
+                ' bytes INTEGER NOT NULL DEFAULT 0)'
+            )
+            conn.execute(
+                'CREATE TABLE merge (owner TEXT, lease_until REAL NOT NULL, done INTEGER NOT NULL)'
+            )
+            conn.execute('INSERT INTO merge VALUES (NULL, 0, 0)')
+            header = {
+                'manifest_version': MANIFEST_VERSION,
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'shards': shards,
+            }
+            header.update(settings)
+            conn.execute('INSERT INTO header VALUES (?)', (json.dumps(header),))
+
+            if file_list:
+                items = ((path, False) for path in file_list)
+            else:
+                items = ((folder, True) for folder in _folders(settings['source']))
+            used = set()
+            chunk = []
+            for item, is_folder in items:
+                shard = shard_of(item if is_folder else os.path.dirname(item), shards)
+                used.add(shard)
+                chunk.append((shard, item, is_folder))
+                if len(chunk) >= _INSERT_CHUNK:
+                    conn.executemany('INSERT INTO work VALUES (?, ?, ?)', chunk)
+                    chunk = []
+            conn.executemany('INSERT INTO work VALUES (?, ?, ?)', chunk)
+            conn.execute('CREATE INDEX work_shard ON work (shard)')
+            conn.executemany('INSERT INTO shards (id) VALUES (?)', ((shard,) for shard in sorted(used)))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(partial, path)
+        return cls(path)
+
+    def settings(self):
+        """The organizer settings of the run"""
+        return {key: self.header[key] for key in PlanReader.SETTINGS if key in self.header}
+
+    def paths(self, shard, extensions):
+        """Matching files of a shard, folder by folder"""
+        rows = self.conn.execute(
+            'SELECT path, is_folder FROM work WHERE shard = ? ORDER BY rowid', (shard,)
+        ).fetchall()
+        for path, is_folder in rows:
+            if is_folder:
+                yield from _folder_files(path, extensions)
+            elif path.lower().endswith(extensions):
+                yield path
+
+    def claim(self, owner, lease=LEASE_SECONDS):
+        """Lease the next pending shard, or one whose lease ran out; None when there is none"""
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.conn.execute(
+                "SELECT id FROM shards WHERE state = 'pending'"
+                " OR (state = 'running' AND lease_until < ?) ORDER BY id LIMIT 1", (now,)
+            ).fetchone()
+            if row:
+                self.conn.execute(
+                    "UPDATE shards SET state = 'running', owner = ?, lease_until = ?,"
+                    " attempts = attempts + 1 WHERE id = ?", (owner, now + lease, row[0])
+                )
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return row[0] if row else None
+
+    def renew(self, shard, owner, lease=LEASE_SECONDS):
+        """Extend a lease; False when owner no longer holds it"""
+        cursor = self.conn.execute(
+            "UPDATE shards SET lease_until = ? WHERE id = ? AND owner = ? AND state = 'running'",
+            (time.time() + lease, shard, owner)
+        )
+        return cursor.rowcount == 1
+
+    def finish(self, shard, owner, stats):
+        """Mark a leased shard done with the counters of its run; False when the lease was lost"""
+        cursor = self.conn.execute(
+            "UPDATE shards SET state = 'done', lease_until = 0, processed = ?, failed = ?, bytes = ?"
+            " WHERE id = ? AND owner = ? AND state = 'running'",
+            (stats.processed, stats.failed, stats.bytes_transferred, shard, owner)
+        )
+        return cursor.rowcount == 1
+
+    def counts(self):
+        """Number of shards per state"""
+        return dict(self.conn.execute('SELECT state, COUNT(*) FROM shards GROUP BY state'))
+
+    def unfinished(self):
+        """Number of shards not done yet"""
+        return self.conn.execute("SELECT COUNT(*) FROM shards WHERE state != 'done'").fetchone()[0]
+
+    def done_shards(self):
+        """IDs of the finished shards, in order"""
+        return [shard for (shard,) in self.conn.execute("SELECT id FROM shards WHERE state = 'done' ORDER BY id")]
+
+    def claim_merge(self, owner, lease=LEASE_SECONDS):
+        """Lease the merge once every shard is done; False if it is done, running or not due"""
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            claimed = (
+                not self.unfinished()
+                and self.conn.execute(
+                    'UPDATE merge SET owner = ?, lease_until = ? WHERE NOT done AND lease_until < ?',
+                    (owner, now + lease, now)
+                ).rowcount == 1
+            )
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return claimed
+
+    def renew_merge(self, owner, lease=LEASE_SECONDS):
+        cursor = self.conn.execute(
+            'UPDATE merge SET lease_until = ? WHERE owner = ? AND NOT done', (time.time() + lease, owner)
+        )
+        return cursor.rowcount == 1
+
+    def finish_merge(self, owner):
+        self.conn.execute('UPDATE merge SET done = 1, lease_until = 0 WHERE owner = ?', (owner,))
+
+    def merged(self):
+        return bool(self.conn.execute('SELECT done FROM merge').fetchone()[0])
+
+    def close(self):
+        self.conn.close()
+
+
+class _LeaseKeeper:
+    """Renews a lease on its own thread and connection until stopped
+
+    on_lost is called once when the lease turns out to be taken over.
+    """
+
+    def __init__(self, manifest_path, renew, args, lease, on_lost):
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(manifest_path, renew, args, lease, on_lost),
+            name='lease', daemon=True
+        )
+
+    def _run(self, manifest_path, renew, args, lease, on_lost):
+        manifest = WorkManifest(manifest_path)
+        try:
+            while not self._stopped.wait(lease / 3):
+                if not getattr(manifest, renew)(*args, lease):
+                    on_lost()
+                    return
+        finally:
+            manifest.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        self._thread.join()
+
+
+def shard_config(config, shard):
+    """Config organizing a shard into its staging trees, journaled there"""
+    photo_stage = staging_dir(config.photo_dest, shard)
+    return replace(
+        config,
+        photo_dest=photo_stage,
+        video_dest=staging_dir(config.video_dest, shard) if config.video_dest else '',
+        resume=True,
+        journal_path=os.path.join(photo_stage, JOURNAL_FILENAME),
+        # Kept until the merge, so a shard done but not yet marked finished is not redone
+        shared_journal=True,
+        # The library is only complete after the merge, so there is nothing to dedup against
+        dedup='',
+        # Staged paths move in the merge, so a catalog of them would go stale
+        catalog=False,
+        incremental=False,
+    )
+
+
+def organize_shards(manifest, config, owner=None, lease=LEASE_SECONDS,
+                    on_progress=None, on_error=None, on_shard=None):
+    """Claim and organize shards until none is left, returning the summed RunStats
+
+    on_shard(shard, stats) is called after each shard. Only settings local to
+    this worker are taken from config; the run's settings come from the manifest.
+    """
+    owner = owner or default_owner()
+    config = replace(config, **manifest.settings())
+    totals = RunStats()
+    started = time.monotonic()
+    while (shard := manifest.claim(owner, lease)) is not None:
+        organizer = Organizer(shard_config(config, shard), on_progress, on_error)
+        paths = list(manifest.paths(shard, config.extensions()))
+        with _LeaseKeeper(manifest.path, 'renew', (shard, owner), lease, organizer.cancel):
+            stats = organizer.run_paths(paths)
+        if stats.cancelled:
+            # Lease lost to another worker, which redoes the shard from its journal
+            totals.cancelled = True
+            break
+        manifest.finish(shard, owner, stats)
+        for name in _SUMMED:
+            setattr(totals, name, getattr(totals, name) + getattr(stats, name))
+        for method, count in stats.transfer_methods.items():
+            totals.transfer_methods[method] = totals.transfer_methods.get(method, 0) + count
+        if on_shard:
+            on_shard(shard, stats)
+    totals.elapsed = time.monotonic() - started
+    return totals
+
+
+def _merge_tree(stage, root, index):
+    """Rename the files of one staging tree into root, returning (files, renamed)"""
+    files = renamed = 0
+    for year in sorted(os.listdir(stage)):
+        year_dir = os.path.join(stage, year)
+        if not os.path.isdir(year_dir):
+            continue
+        for month in sorted(os.listdir(year_dir)):
+            month_dir = os.path.join(year_dir, month)
+            if not os.path.isdir(month_dir):
+                continue
+            dest_dir = os.path.join(root, year, month)
+            index.prepare(dest_dir)
+            for name in sorted(os.listdir(month_dir)):
+                if name.endswith(PARTIAL_SUFFIX):
+                    continue
+                dest_path = index.reserve(dest_dir, name)
+                os.rename(os.path.join(month_dir, name), dest_path)
+                files += 1
+                renamed += os.path.basename(dest_path) != name
+    return files, renamed
+
+
+def _remove_stage(stage):
+    """Remove what is left of a merged staging tree: its journal, partial files and folders"""
+    for folder, _, names in os.walk(stage, topdown=False):
+        for name in names:
+            if folder == stage or name.endswith(PARTIAL_SUFFIX):
+                os.remove(os.path.join(folder, name))
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+
+
+def merge_shards(manifest, owner=None, lease=LEASE_SECONDS):
+    """Merge the staging trees of a finished run into the library
+
+    Returns MergeStats, or None when shards are still running, the merge is
+    already done, or another worker holds it.
+    """
+    owner = owner or default_owner()
+    if not manifest.claim_merge(owner, lease):
+        return None
+    settings = manifest.settings()
+    roots = [root for root in (settings['photo_dest'], settings.get('video_dest')) if root]
+    shards = manifest.done_shards()
+    files = renamed = 0
+    index = DestinationIndex()
+    with _LeaseKeeper(manifest.path, 'renew_merge', (owner,), lease, lambda: None):
+        for shard in shards:
+            for root in roots:
+                stage = staging_dir(root, shard)
+                if not os.path.isdir(stage):
+                    continue
+                merged, clashes = _merge_tree(stage, root, index)
+                files += merged
+                renamed += clashes
+                _remove_stage(stage)
+    for root in roots:
+        try:
+            os.rmdir(os.path.join(root, STAGING_DIRNAME))
+        except OSError:
+            pass
+    manifest.finish_merge(owner)
+    return MergeStats(len(shards), files, renamed)
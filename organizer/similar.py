@@ -0,0 +1,311 @@
+"""
+Near-duplicate detection
+------------------------
+Finds burst shots, resized and re-encoded copies and other images that look
+the same but are not byte-identical, which organizer.dedup does not catch.
+
+Every image gets a 64-bit perceptual hash computed from a tiny grayscale
+thumbnail: dHash compares neighbouring pixels of a 9x8 thumbnail, pHash
+compares the low frequencies of a 32x32 thumbnail's DCT with their median.
+JPEGs are opened in draft mode, so the decoder scales them down by up to 8
+while decoding instead of producing every pixel first.
+
+The hashes are kept as packed uint64 arrays, in memory and in a small .npz
+file in the scanned folder, where unchanged files (same size and
+modification time) reuse them on the next pass. Pairs within a Hamming
+distance are found with a multi-index search: the hashes are cut into four
+16-bit bands, and any two hashes within distance d share a band within
+distance d // 4 (pigeonhole). Each band is sorted once, with a table of
+where each of its 65536 values starts, and probed with every flip of up to
+d // 4 bits, so only hashes sharing a band are compared instead of every
+pair.
+
+Groups are formed around the files to keep: the largest file not yet in a
+group keeps every other such file within the distance of it, then the next
+largest, and so on. Pairs are not joined transitively, so a chain of small
+steps never puts a file in the group of a keeper it does not resemble. The
+kept files stay; the others are reported, or moved to a quarantine folder.
+
+Needs NumPy and Pillow, both imported only when a pass runs.
+"""
+
+import os
+import shutil
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+
+from .scan import scan_media
+
+SIMILAR_FILENAME = '.photo_organizer_similar.npz'
+HASH_KINDS = ('dhash', 'phash')
+DEFAULT_DISTANCE = 6
+
+# Image types Pillow can open (HEIC/HEIF only with the pillow-heif plugin)
+SIMILAR_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.heif')
+
+# Bands of the multi-index search and their width in bits
+BANDS = 4
+BAND_BITS = 64 // BANDS
+# Hashes probed per step, bounding the memory of candidate pairs
+PROBE_CHUNK = 65536
+
+# A kept file and the others that look like it, as (path, distance) pairs
+SimilarGroup = namedtuple('SimilarGroup', 'keeper similar')
+SimilarStats = namedtuple('SimilarStats', 'files hashed unreadable pairs')
+
+
+def _numpy():
+    """NumPy, imported on first use"""
+    import numpy
+    return numpy
+
+
+def _thumbnail(path, size):
+    """Grayscale pixels of an image scaled to size (width, height), as floats"""
+    from PIL import Image
+    np = _numpy()
+    with Image.open(path) as img:
+        if img.format == 'JPEG':
+            # Decode at 1/2, 1/4 or 1/8 scale where that still covers size
+            img.draft('L', (size[0] * 4, size[1] * 4))
+        gray = img.convert('L').resize(size, Image.Resampling.BOX)
+    return np.asarray(gray, dtype=np.float32)
+
+
+def dhash_bits(path):
+    """64 dHash bits of an image: whether each pixel is brighter than its left neighbour"""
+    pixels = _thumbnail(path, (9, 8))
+    return (pixels[:, 1:] > pixels[:, :-1]).ravel()
+
+
+_dct_matrix = None
+
+
+def phash_bits(path):
+    """64 pHash bits of an image: which low DCT frequencies lie above their median"""
+    global _dct_matrix
+    np = _numpy()
+    if _dct_matrix is None:
+        n = np.arange(32)
+        _dct_matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / 64).astype(np.float32)
+    pixels = _thumbnail(path, (32, 32))
+    low = (_dct_matrix @ pixels @ _dct_matrix.T)[:8, :8].ravel()
+    return low > np.median(low)
+
+
+_HASHERS = {'dhash': dhash_bits, 'phash': phash_bits}
+
+
+def pack_hashes(bits):
+    """Pack rows of 64 booleans into a uint64 array"""
+    np = _numpy()
+    packed = np.packbits(np.asarray(bits, dtype=bool).reshape(-1, 64), axis=1)
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+
+_byte_counts = None
+
+
+def popcount(values):
+    """Number of set bits of each value of a uint64 array"""
+    global _byte_counts
+    np = _numpy()
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values).astype(np.int64)
+    # NumPy before 2.0: count per byte through a table
+    if _byte_counts is None:
+        _byte_counts = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+    return _byte_counts[np.ascontiguousarray(values).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _band_masks(bits, radius):
+    """Every flip of up to radius bits of a bits-wide band"""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for positions in combinations(range(bits), r):
+            masks.append(sum(1 << p for p in positions))
+    return masks
+
+
+def similar_pairs(hashes, distance=DEFAULT_DISTANCE):
+    """(i, j, distance) arrays of the pairs i < j of hashes within distance"""
+    np = _numpy()
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    count = len(hashes)
+    found_i, found_j = [], []
+    masks = np.array(_band_masks(BAND_BITS, distance // BANDS), dtype=np.int64)
+    for band in range(BANDS):
+        keys = ((hashes >> np.uint64(band * BAND_BITS)) & np.uint64((1 << BAND_BITS) - 1)).astype(np.int64)
+        order = np.argsort(keys, kind='stable')
+        # Where each band value's run starts in the sorted order, and its length
+        lengths = np.bincount(keys, minlength=1 << BAND_BITS)
+        starts = np.cumsum(lengths) - lengths
+        for start in range(0, count, PROBE_CHUNK):
+            chunk = np.arange(start, min(start + PROBE_CHUNK, count))
+            for mask in masks:
+                probe = keys[chunk] ^ mask
+                low = starts[probe]
+                counts = lengths[probe]
+                total = int(counts.sum())
+                if not total:
+                    continue
+                # Expand each probe into its range of the sorted band
+                first = np.repeat(low - (np.cumsum(counts) - counts), counts)
+                i = np.repeat(chunk, counts)
+                j = order[first + np.arange(total)]
+                keep = i < j
+                i, j = i[keep], j[keep]
+                close = popcount(hashes[i] ^ hashes[j]) <= distance
+                found_i.append(i[close])
+                found_j.append(j[close])
+    if not found_i:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    # Pairs sharing several bands were found once per band
+    codes = np.unique(np.concatenate(found_i) * count + np.concatenate(found_j))
+    i, j = codes // count, codes % count
+    return i, j, popcount(hashes[i] ^ hashes[j])
+
+
+def _groups(i, j, rank):
+    """(keeper, members) of the pairs (i, j), largest groups first
+
+    Keepers are taken in the order of rank(index) among the indices not yet
+    grouped, and each gets those of its pair partners not yet grouped.
+    """
+    partners = {}
+    for a, b in zip(i.tolist(), j.tolist()):
+        partners.setdefault(a, []).append(b)
+        partners.setdefault(b, []).append(a)
+    grouped = set()
+    groups = []
+    for keeper in sorted(partners, key=rank):
+        if keeper in grouped:
+            continue
+        grouped.add(keeper)
+        members = sorted(k for k in partners[keeper] if k not in grouped)
+        if members:
+            grouped.update(members)
+            groups.append((keeper, members))
+    return sorted(groups, key=lambda group: (-len(group[1]), min(group[0], group[1][0])))
+
+
+def _load(root, kind):
+    """{relative path: (size, mtime_ns, hash)} saved by the last pass over root"""
+    np = _numpy()
+    try:
+        with np.load(os.path.join(root, SIMILAR_FILENAME)) as saved:
+            if str(saved['kind']) != kind:
+                return {}
+            return {
+                path: (size, mtime_ns, value)
+                for path, size, mtime_ns, value in zip(
+                    saved['paths'].tolist(), saved['sizes'].tolist(),
+                    saved['mtimes'].tolist(), saved['hashes'])
+            }
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def _save(root, kind, paths, sizes, mtimes, hashes):
+    np = _numpy()
+    path = os.path.join(root, SIMILAR_FILENAME)
+    partial = path + '.partial.npz'
+    try:
+        np.savez(partial, kind=np.array(kind), paths=np.array(paths, dtype=str),
+                 sizes=np.array(sizes, dtype=np.int64), mtimes=np.array(mtimes, dtype=np.int64),
+                 hashes=hashes)
+        os.replace(partial, path)
+    except OSError as e:
+        print(f"Could not save perceptual hashes: {str(e)}")
+
+
+def _hash_file(hasher, path):
+    try:
+        return hasher(path)
+    except Exception:
+        # Unreadable, truncated or a type this Pillow cannot open
+        return None
+
+
+def find_similar(root, distance=DEFAULT_DISTANCE, kind='dhash', workers=4, exclude='', on_progress=None):
+    """Hash the images under root and return (groups, SimilarStats)
+
+    Each SimilarGroup keeps its largest file, and its similar files are all
+    within distance of that one. Files under exclude (such as a
+    quarantine folder) are left out; on_progress(done, total) is called while
+    hashing.
+    """
+    np = _numpy()
+    hasher = _HASHERS[kind]
+    exclude = os.path.join(os.path.abspath(exclude), '') if exclude else None
+    saved = _load(root, kind)
+
+    paths, sizes, mtimes, rows, fresh = [], [], [], [], []
+    for path in scan_media(root, SIMILAR_EXTENSIONS):
+        if exclude and os.path.abspath(path).startswith(exclude):
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        relative = os.path.relpath(path, root)
+        known = saved.get(relative)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            rows.append(known[2])
+        else:
+            rows.append(None)
+            fresh.append(len(paths))
+        paths.append(relative)
+        sizes.append(st.st_size)
+        mtimes.append(st.st_mtime_ns)
+
+    unreadable = set()
+    if fresh:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            jobs = pool.map(_hash_file, [hasher] * len(fresh), [os.path.join(root, paths[k]) for k in fresh])
+            for done, (k, bits) in enumerate(zip(fresh, jobs), 1):
+                if bits is None:
+                    unreadable.add(k)
+                else:
+                    rows[k] = pack_hashes(bits)[0]
+                if on_progress:
+                    on_progress(done, len(fresh))
+
+    readable = [k for k in range(len(paths)) if k not in unreadable]
+    paths = [paths[k] for k in readable]
+    sizes = [sizes[k] for k in readable]
+    mtimes = [mtimes[k] for k in readable]
+    hashes = np.array([rows[k] for k in readable], dtype=np.uint64)
+    if fresh or len(saved) != len(paths):
+        _save(root, kind, paths, sizes, mtimes, hashes)
+
+    i, j, dist = similar_pairs(hashes, distance)
+    groups = []
+    # The largest file keeps, the shorter path on a tie
+    for keeper, others in _groups(i, j, lambda k: (-sizes[k], len(paths[k]), k)):
+        distances = popcount(hashes[others] ^ hashes[keeper])
+        groups.append(SimilarGroup(
+            os.path.join(root, paths[keeper]),
+            [(os.path.join(root, paths[k]), int(d)) for k, d in zip(others, distances)]
+        ))
+    return groups, SimilarStats(len(paths) + len(unreadable), len(fresh) - len(unreadable), len(unreadable), len(i))
+
+
+def quarantine(groups, root, folder):
+    """Move the similar files of groups into folder, keeping their paths below root
+
+    Returns the number of files moved.
+    """
+    moved = 0
+    for group in groups:
+        for path, _distance in group.similar:
+            target = os.path.join(folder, os.path.relpath(path, root))
+            try:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+                moved += 1
+            except OSError as e:
+                print(f"Error quarantining {path}: {str(e)}")
+    return moved
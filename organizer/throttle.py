@@ -0,0 +1,176 @@
+"""
+Transfer throttling
+-------------------
+Rate limits for organizing onto (or from) storage other people use at the
+same time, such as a NAS during office hours.
+
+Bytes per second and files per second are each limited by a token bucket
+shared by every transfer thread. A transfer reserves its size and one file
+before it starts and sleeps until the buckets have refilled enough to cover
+it. A bucket may go into debt, so a file larger than the burst still gets
+through and the transfers after it wait until it is paid off.
+
+In adaptive mode the limits are a ceiling. The time per MiB of every
+transfer is sampled, and when the median of a window of transfers rises to
+BACKOFF_LATENCY times the quietest window seen (or of LATENCY_FLOOR, so
+jitter in sub-millisecond copies from the page cache does not count), the
+rates are halved; calm windows win them back a step at a time, as TCP
+congestion control does.
+Without a byte limit, adaptive mode takes the throughput of its first
+window as the ceiling.
+"""
+
+import threading
+import time
+
+# Seconds of traffic a bucket saves up while idle
+BURST_SECONDS = 1.0
+
+# Transfers sampled per adaptive window
+ADAPT_WINDOW = 16
+# Backing off once latency reaches this multiple of the baseline
+BACKOFF_LATENCY = 2.0
+BACKOFF_FACTOR = 0.5
+# Share of the ceiling won back per calm window, and the lowest share allowed
+RECOVER_STEP = 0.1
+MIN_SCALE = 0.05
+# Growth of the baseline per window, so a lasting slowdown becomes the new normal
+BASELINE_DRIFT = 1.05
+# Baselines below this are raised to it before comparing, in seconds per MiB
+LATENCY_FLOOR = 0.005
+# Smaller transfers count as this many bytes when measuring latency
+LATENCY_UNIT = 1024 * 1024
+
+
+def parse_rate(text):
+    """Parse a rate such as 500K, 20M or 1.5G (per second) into a number"""
+    text = text.strip().upper().removesuffix('/S').removesuffix('B')
+    factor = 1
+    for suffix, multiple in (('K', 1024), ('M', 1024 ** 2), ('G', 1024 ** 3)):
+        if text.endswith(suffix):
+            text, factor = text[:-1], multiple
+            break
+    value = float(text) * factor
+    if value < 0:
+        raise ValueError(f"Negative rate: {text}")
+    return value
+
+
+class TokenBucket:
+    """Thread-safe token bucket that refills at rate tokens per second"""
+
+    def __init__(self, rate):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.burst = max(1.0, rate * BURST_SECONDS)
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def set_rate(self, rate):
+        """Change the rate, keeping what has been saved up so far"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.burst = max(1.0, rate * BURST_SECONDS)
+            self._tokens = min(self._tokens, self.burst)
+
+    def reserve(self, amount):
+        """Take amount tokens and return the seconds to wait before using them"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class Throttle:
+    """Byte and file rate limits shared by all transfer threads, optionally adaptive
+
+    A limit of 0 means no limit.
+    """
+
+    def __init__(self, bytes_per_second=0, files_per_second=0, adaptive=False):
+        self.bytes_per_second = bytes_per_second
+        self.files_per_second = files_per_second
+        self.adaptive = adaptive
+        self.bytes = TokenBucket(bytes_per_second) if bytes_per_second > 0 else None
+        self.files = TokenBucket(files_per_second) if files_per_second > 0 else None
+        # Share of the limits currently allowed, and seconds spent waiting
+        self.scale = 1.0
+        self.waited = 0.0
+        self.backoffs = 0
+        self._lock = threading.Lock()
+        self._interrupted = threading.Event()
+        # Latencies of the current window, its bytes and start, and the baseline
+        self._samples = []
+        self._window_bytes = 0
+        self._window_started = None
+        self._baseline = None
+
+    def call(self, size, fn, *args):
+        """Call fn(*args), which moves size bytes, once the limits allow it"""
+        self.acquire(size)
+        if not self.adaptive:
+            return fn(*args)
+        started = time.perf_counter()
+        result = fn(*args)
+        self.observe(time.perf_counter() - started, size)
+        return result
+
+    def acquire(self, size):
+        """Wait until one file of size bytes may be transferred"""
+        delay = 0.0
+        if self.files:
+            delay = self.files.reserve(1)
+        if self.bytes:
+            delay = max(delay, self.bytes.reserve(size))
+        if delay > 0:
+            with self._lock:
+                self.waited += delay
+            self._interrupted.wait(delay)
+
+    def interrupt(self):
+        """Let every waiting and later transfer through at once, for cancelling a run"""
+        self._interrupted.set()
+
+    def observe(self, seconds, size):
+        """Sample the latency of a finished transfer, adapting the rates per window"""
+        with self._lock:
+            if self._window_started is None:
+                self._window_started = time.monotonic() - seconds
+            self._samples.append(seconds * LATENCY_UNIT / max(size, LATENCY_UNIT))
+            self._window_bytes += size
+            if len(self._samples) < ADAPT_WINDOW:
+                return
+            samples = sorted(self._samples)
+            now = time.monotonic()
+            if self.bytes is None:
+                # First window without a byte limit: what the link does unthrottled
+                self.bytes_per_second = self._window_bytes / max(now - self._window_started, 1e-3)
+                self.bytes = TokenBucket(self.bytes_per_second)
+            self._samples = []
+            self._window_bytes = 0
+            self._window_started = now
+            self._adapt(samples[len(samples) // 2])
+
+    def _adapt(self, latency):
+        if self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+        else:
+            self._baseline *= BASELINE_DRIFT
+        if latency >= max(self._baseline, LATENCY_FLOOR) * BACKOFF_LATENCY:
+            self.scale = max(MIN_SCALE, self.scale * BACKOFF_FACTOR)
+            self.backoffs += 1
+        elif self.scale < 1.0:
+            self.scale = min(1.0, self.scale + RECOVER_STEP)
+        else:
+            return
+        if self.bytes:
+            self.bytes.set_rate(self.bytes_per_second * self.scale)
+        if self.files:
+            self.files.set_rate(self.files_per_second * self.scale)
@@ -0,0 +1,235 @@
+"""
+File transfers
+--------------
+Puts a file in its destination as cheaply as the source and destination
+allow, instead of always pushing the bytes through shutil.copy2.
+
+Strategies:
+- rename: os.rename when moving within one device, no data is touched
+- hardlink: a second name for the same inode, for copies on one device
+- reflink: a copy-on-write clone (FICLONE) on Btrfs, XFS and similar
+- copy_file_range: an in-kernel copy, server side on NFS 4.2 and SMB3
+- copy: shutil.copy2 / shutil.move, the fallback for everything else
+
+In 'auto' mode moves on one device are renamed and copies try reflink and
+then copy_file_range. A strategy that fails as unsupported for a source and
+destination device pair is not tried again for that pair.
+
+Strategies that write data do so under a temporary name next to the
+destination (see partial_path) and rename it into place when complete, so a
+crash never leaves a truncated file under a real name.
+
+Given an open descriptor of the destination folder (dir_fd), the file is
+created, renamed and linked relative to it, without resolving the folder's
+path again. The plain copy fallback always works on paths.
+
+Large files that have to be copied through user space are streamed in big
+chunks, with the kernel told to read ahead and to drop the pages afterwards,
+so one video does not push everything else out of the page cache.
+"""
+
+import errno
+import os
+import shutil
+import stat
+import sys
+
+TRANSFER_MODES = ('auto', 'copy', 'hardlink', 'reflink', 'copy_file_range')
+
+# ioctl request number for FICLONE on Linux
+FICLONE = 0x40049409
+
+# copy_file_range chunk size
+COPY_CHUNK = 1 << 30
+
+# Buffer for streaming large files where there is no in-kernel copy
+LARGE_BUFFER = 8 * 1024 * 1024
+
+PARTIAL_SUFFIX = '.partial'
+
+# Errors that mean "not possible here" rather than a failed transfer
+_UNSUPPORTED = {
+    errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EPERM,
+    errno.EOPNOTSUPP, getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP), errno.EBADF,
+}
+
+
+def partial_path(dest_path):
+    """Temporary name a file is written under before it is renamed to dest_path"""
+    folder, name = os.path.split(dest_path)
+    return os.path.join(folder, '.' + name + PARTIAL_SUFFIX)
+
+
+def _target(dst, dir_fd):
+    """dst as passed to os calls: its name relative to dir_fd, or the path itself"""
+    return dst if dir_fd is None else os.path.basename(dst)
+
+
+def _opener(dir_fd):
+    """open() opener creating files relative to dir_fd"""
+    if dir_fd is None:
+        return None
+    return lambda path, flags: os.open(path, flags, 0o666, dir_fd=dir_fd)
+
+
+def _copy_metadata(fsrc, fdst):
+    """Copy permission bits and times of an open source to an open destination"""
+    st = os.fstat(fsrc.fileno())
+    os.chmod(fdst.fileno(), stat.S_IMODE(st.st_mode))
+    os.utime(fdst.fileno(), ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def _atomic(copy, src, dst, dir_fd=None):
+    """Run copy(src, tmp, dir_fd) and rename tmp to dst, removing tmp if anything fails"""
+    tmp = _target(partial_path(dst), dir_fd)
+    try:
+        copy(src, tmp, dir_fd)
+        os.replace(tmp, _target(dst, dir_fd), src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+    except BaseException:
+        try:
+            os.remove(tmp, dir_fd=dir_fd)
+        except OSError:
+            pass
+        raise
+
+
+class _Unsupported(Exception):
+    """A strategy cannot be used for this source and destination"""
+
+
+def _reflink(src, dst, dir_fd=None):
+    if sys.platform != 'linux':
+        raise _Unsupported()
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb', opener=_opener(dir_fd)) as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        _copy_metadata(fsrc, fdst)
+
+
+def _copy_file_range(src, dst, dir_fd=None):
+    if not hasattr(os, 'copy_file_range'):
+        raise _Unsupported()
+    with open(src, 'rb') as fsrc, open(dst, 'wb', opener=_opener(dir_fd)) as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        copied = 0
+        while chunk := os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_CHUNK):
+            copied += chunk
+        # Some FUSE, overlay and virtual file systems answer 0 right away
+        if not copied and size:
+            raise _Unsupported()
+        if copied < size:
+            raise OSError(f"copy_file_range copied {copied} of {size} bytes")
+        _copy_metadata(fsrc, fdst)
+
+
+def _copy2(src, dst, dir_fd=None):
+    shutil.copy2(src, dst)
+
+
+def _advise(f, advice):
+    """posix_fadvise on a whole open file, where supported"""
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(f.fileno(), 0, 0, advice)
+        except OSError:
+            pass
+
+
+def _copy_large(src, dst, dir_fd=None):
+    """Stream a large file sequentially in LARGE_BUFFER chunks, sendfile where available"""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if hasattr(os, 'POSIX_FADV_SEQUENTIAL'):
+            _advise(fsrc, os.POSIX_FADV_SEQUENTIAL)
+        if sys.platform == 'linux':
+            offset = 0
+            while sent := os.sendfile(fdst.fileno(), fsrc.fileno(), offset, LARGE_BUFFER):
+                offset += sent
+            size = os.fstat(fsrc.fileno()).st_size
+            if offset < size:
+                raise OSError(f"sendfile copied {offset} of {size} bytes")
+        else:
+            shutil.copyfileobj(fsrc, fdst, LARGE_BUFFER)
+        if hasattr(os, 'POSIX_FADV_DONTNEED'):
+            _advise(fsrc, os.POSIX_FADV_DONTNEED)
+    shutil.copystat(src, dst)
+
+
+class Transferer:
+    """Copies or moves files with the cheapest strategy that works
+
+    transfer() returns the name of the strategy that placed the file.
+    """
+
+    def __init__(self, mode='auto', delete_source=False, large_size=None):
+        if mode not in TRANSFER_MODES:
+            raise ValueError(f"Unknown transfer mode: {mode}")
+        self.mode = mode
+        self.delete_source = delete_source
+        # Copies of files at least this large are streamed, None never streams
+        self.large_size = large_size
+        # st_dev per folder, and strategies that failed per device pair
+        self._devices = {}
+        self._unsupported = set()
+
+    def _device(self, folder):
+        device = self._devices.get(folder)
+        if device is None:
+            device = os.stat(folder).st_dev
+            self._devices[folder] = device
+        return device
+
+    def _candidates(self, same_device):
+        """Strategies to try in order, before the copy fallback"""
+        if self.mode == 'auto':
+            if self.delete_source:
+                return ['rename'] if same_device else ['copy_file_range']
+            return ['reflink', 'copy_file_range'] if same_device else ['copy_file_range']
+        if self.mode == 'copy':
+            return []
+        return [self.mode]
+
+    def transfer(self, src, dst, dir_fd=None):
+        """Place src at dst, removing src afterwards when moving
+
+        dir_fd is an optional open descriptor of dst's folder to work relative to.
+        """
+        pair = (self._device(os.path.dirname(src) or '.'), self._device(os.path.dirname(dst) or '.'))
+        for name in self._candidates(pair[0] == pair[1]):
+            if (name, pair) in self._unsupported:
+                continue
+            try:
+                self._run(name, src, dst, dir_fd)
+            except _Unsupported:
+                self._unsupported.add((name, pair))
+                continue
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                self._unsupported.add((name, pair))
+                continue
+            if self.delete_source and name != 'rename':
+                os.remove(src)
+            return name
+
+        if self.delete_source:
+            # Like shutil.move: a rename where possible, else copy and remove
+            try:
+                os.rename(src, _target(dst, dir_fd), dst_dir_fd=dir_fd)
+                return 'copy'
+            except OSError:
+                pass
+        large = self.large_size is not None and os.stat(src).st_size >= self.large_size
+        _atomic(_copy_large if large else _copy2, src, dst)
+        if self.delete_source:
+            os.remove(src)
+        return 'copy'
+
+    def _run(self, name, src, dst, dir_fd):
+        if name == 'rename':
+            os.rename(src, _target(dst, dir_fd), dst_dir_fd=dir_fd)
+        elif name == 'hardlink':
+            os.link(src, _target(dst, dir_fd), dst_dir_fd=dir_fd)
+        elif name == 'reflink':
+            _atomic(_reflink, src, dst, dir_fd)
+        elif name == 'copy_file_range':
+            _atomic(_copy_file_range, src, dst, dir_fd)
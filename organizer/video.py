@@ -0,0 +1,260 @@
+"""
+Video dates
+-----------
+Reads the recording date from video containers without decoding anything.
+
+MP4/MOV files are walked atom by atom. Only the 8 or 16 byte atom headers
+are read, so a moov atom behind gigabytes of mdat costs a seek, not a read.
+Inside moov the reader looks at udta/©day (local time, as written by phones
+and cameras) and mvhd (UTC seconds since 1904).
+
+AVI files are walked chunk by chunk through the RIFF lists, skipping the
+movi list with the actual frames, to the IDIT date chunk or an EXIF block in
+a strd chunk.
+"""
+
+import io
+import os
+import re
+import struct
+from datetime import datetime, timezone
+
+from .exif import TiffReader, best_date, parse_exif_datetime
+
+# Seconds between the QuickTime epoch (1904-01-01) and the Unix epoch
+QUICKTIME_EPOCH_OFFSET = 2082844800
+
+# Top-level atoms a QuickTime/MP4 file may start with
+_MP4_FIRST_ATOMS = {b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot', b'uuid'}
+
+# Upper bound on bytes read from a single metadata atom or chunk
+MAX_METADATA_READ = 64 * 1024
+
+_ISO_DATE = re.compile(rb'(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2}):(\d{2}))?')
+
+_MONTHS = {
+    b'JAN': 1, b'FEB': 2, b'MAR': 3, b'APR': 4, b'MAY': 5, b'JUN': 6,
+    b'JUL': 7, b'AUG': 8, b'SEP': 9, b'OCT': 10, b'NOV': 11, b'DEC': 12,
+}
+
+
+def _iso_date(value):
+    """Parse the date and time at the start of a QuickTime date string, ignoring the zone"""
+    match = _ISO_DATE.match(value.strip())
+    if not match:
+        return None
+    parts = [int(part) for part in match.groups(b'0')]
+    try:
+        return datetime(*parts)
+    except ValueError:
+        return None
+
+
+# MP4 / MOV
+
+def atoms(f, start, end):
+    """Yield (type, payload start, atom end) for the atoms between start and end
+
+    Also walks the boxes of ISOBMFF images such as HEIC, see organizer.photo.
+    """
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            raw = f.read(8)
+            if len(raw) < 8:
+                return
+            (size,) = struct.unpack('>Q', raw)
+            header_size = 16
+        elif size == 0:
+            # Runs to the end of the file
+            size = end - pos
+        if size < header_size:
+            raise ValueError("bad atom size")
+        yield kind, pos + header_size, pos + size
+        pos += size
+
+
+def _read_payload(f, start, end):
+    f.seek(start)
+    return f.read(min(end - start, MAX_METADATA_READ))
+
+
+def _mvhd_date(payload):
+    """Creation time of a movie header, converted to local time"""
+    if not payload:
+        return None
+    if payload[0] == 1:
+        (seconds,) = struct.unpack('>Q', payload[4:12])
+    else:
+        (seconds,) = struct.unpack('>I', payload[4:8])
+    seconds -= QUICKTIME_EPOCH_OFFSET
+    # Zero (1904) or pre-1970 values mean the camera did not set a date
+    if seconds <= 0:
+        return None
+    try:
+        return datetime.fromtimestamp(seconds, timezone.utc).astimezone().replace(tzinfo=None)
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+def _udta_date(f, start, end):
+    """©day from a udta atom, as a QuickTime text atom or an iTunes-style meta/ilst"""
+    for kind, payload_start, payload_end in atoms(f, start, end):
+        if kind == b'\xa9day':
+            # 16-bit length, 16-bit language, then the text
+            date = _iso_date(_read_payload(f, payload_start, payload_end)[4:])
+            if date:
+                return date
+        elif kind == b'meta':
+            # Full box: skip version and flags
+            for meta_kind, ilst_start, ilst_end in atoms(f, payload_start + 4, payload_end):
+                if meta_kind != b'ilst':
+                    continue
+                for item_kind, item_start, item_end in atoms(f, ilst_start, ilst_end):
+                    if item_kind != b'\xa9day':
+                        continue
+                    for data_kind, data_start, data_end in atoms(f, item_start, item_end):
+                        if data_kind == b'data':
+                            # Type and locale come before the value
+                            date = _iso_date(_read_payload(f, data_start, data_end)[8:])
+                            if date:
+                                return date
+    return None
+
+
+def read_mp4_date(file_path):
+    """Recording date of an MP4/MOV file as (date, source), None if not set
+
+    Raises ValueError when the file does not look like an MP4/MOV.
+    """
+    with open(file_path, 'rb') as f:
+        end = os.fstat(f.fileno()).st_size
+        first = True
+        for kind, start, atom_end in atoms(f, 0, end):
+            if first and kind not in _MP4_FIRST_ATOMS:
+                raise ValueError("not an MP4/MOV file")
+            first = False
+            if kind != b'moov':
+                continue
+
+            mvhd = None
+            for child, child_start, child_end in atoms(f, start, atom_end):
+                if child == b'udta':
+                    date = _udta_date(f, child_start, child_end)
+                    if date:
+                        return date, 'udta.day'
+                elif child == b'mvhd':
+                    mvhd = _mvhd_date(_read_payload(f, child_start, child_end))
+            if mvhd:
+                return mvhd, 'mvhd'
+            return None
+        if first:
+            raise ValueError("not an MP4/MOV file")
+    return None
+
+
+# AVI
+
+def riff_chunks(f, start, end):
+    """Yield (id, list type or None, payload start, chunk end) for RIFF chunks
+
+    Also walks WebP files, see organizer.photo.
+    """
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        chunk_id, size = struct.unpack('<4sI', header)
+        payload = pos + 8
+        chunk_end = min(payload + size, end)
+        list_type = None
+        if chunk_id in (b'LIST', b'RIFF'):
+            list_type = f.read(4)
+            payload += 4
+        yield chunk_id, list_type, payload, chunk_end
+        # Chunks are padded to an even size
+        pos += 8 + size + (size & 1)
+
+
+def _idit_date(value):
+    """Parse an IDIT value: 'MON JAN 02 15:04:05 2006' or EXIF style"""
+    value = value.strip(b'\x00\r\n ')
+    date = parse_exif_datetime(value)
+    if date:
+        return date
+    parts = value.upper().split()
+    if len(parts) != 5 or parts[1][:3] not in _MONTHS:
+        return None
+    try:
+        hour, minute, second = (int(part) for part in parts[3].split(b':'))
+        return datetime(int(parts[4]), _MONTHS[parts[1][:3]], int(parts[2]), hour, minute, second)
+    except ValueError:
+        return None
+
+
+def _strd_date(data):
+    """Date from an EXIF block that some cameras embed in strd"""
+    for magic in (b'II*\x00', b'MM\x00*'):
+        index = data.find(magic)
+        if index >= 0:
+            try:
+                found = best_date(TiffReader(io.BytesIO(data), index).dates())
+            except (ValueError, struct.error):
+                continue
+            if found:
+                return found[0]
+    return None
+
+
+def read_avi_date(file_path):
+    """Recording date of an AVI file as (date, source), None if not set
+
+    Raises ValueError when the file is not a RIFF AVI.
+    """
+    with open(file_path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'AVI ':
+            raise ValueError("not an AVI file")
+        end = os.fstat(f.fileno()).st_size
+
+        strd = None
+        stack = [(12, end)]
+        while stack:
+            start, stop = stack.pop()
+            for chunk_id, list_type, payload, chunk_end in riff_chunks(f, start, stop):
+                if list_type:
+                    # Never descend into the frame data
+                    if list_type != b'movi':
+                        stack.append((payload, chunk_end))
+                elif chunk_id == b'IDIT':
+                    date = _idit_date(_read_payload(f, payload, chunk_end))
+                    if date:
+                        return date, 'IDIT'
+                elif chunk_id == b'strd' and strd is None:
+                    strd = _strd_date(_read_payload(f, payload, chunk_end))
+        if strd:
+            return strd, 'strd'
+    return None
+
+
+VIDEO_READERS = {
+    '.mp4': read_mp4_date,
+    '.mov': read_mp4_date,
+    '.avi': read_avi_date,
+}
+
+
+def read_video_date(file_path):
+    """Recording date of a supported video as (date, source), None if unknown"""
+    reader = VIDEO_READERS.get(os.path.splitext(file_path)[1].lower())
+    if reader is None:
+        return None
+    return reader(file_path)
@@ -0,0 +1,366 @@
+"""
+Watching the source folder
+--------------------------
+Reports media files as they land in the source folder, for a long-running
+organizer on an ingest folder that is filled continuously.
+
+On Linux the watcher uses inotify, so it sleeps in select() until the kernel
+reports a change and never walks the tree again. Elsewhere, or when inotify
+is unavailable or out of watches, it falls back to walking the tree every
+poll_interval seconds.
+
+Files still being written are debounced: a file is handed over once it has
+been closed after writing or moved into the folder, or once it has not
+changed for settle seconds. Polling can only see a file sit still between
+two walks, so there it is handed over after two walks that agree.
+
+Watchers share ScanQueue's start(), stop(), batches(), found and done, so the
+organizer feeds them through the same date and transfer pipeline as a scan.
+"""
+
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from .scan import scan_media
+
+# Seconds a file has to stay unchanged before it counts as complete
+DEFAULT_SETTLE = 2.0
+# Seconds between walks of the polling watcher
+DEFAULT_POLL_INTERVAL = 5.0
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_ONLYDIR)
+
+_EVENT = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+
+class _Watcher:
+    """Debouncing and batching shared by the inotify and polling watchers"""
+
+    kind = None
+
+    def __init__(self, source, extensions, settle=DEFAULT_SETTLE):
+        self.source = source
+        self.extensions = extensions
+        self.settle = settle
+        self.found = 0
+        self.done = False
+        # Candidate paths and the time they may be handed over
+        self._pending = {}
+        # Paths already handed over, so a later write does not repeat them
+        self._handed = set()
+        # (size, mtime_ns) of files organized by a run while watching, see skip()
+        self._organized = {}
+        # Wall clock time watching began
+        self._since = 0.0
+        self._stopped = threading.Event()
+        self._watching = False
+
+    def start(self):
+        """Start watching the source folder, unless already watching"""
+        if not self._watching:
+            self._since = time.time()
+            self._open()
+            self._watching = True
+        return self
+
+    def stop(self):
+        """Stop watching; safe to call from any thread"""
+        self._stopped.set()
+        self._wake()
+
+    def skip(self, path):
+        """Do not hand out path, which a run organized while this watcher was open, unless it changes
+
+        Only files changed since watching began are remembered; older ones
+        are never reported, and remembering them would hold the whole tree.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        if st.st_ctime >= self._since - self.settle:
+            self._organized[path] = (st.st_size, st.st_mtime_ns)
+
+    def _was_organized(self, path):
+        signature = self._organized.pop(path, None)
+        if signature is None:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return signature == (st.st_size, st.st_mtime_ns)
+
+    def _matches(self, name):
+        return name.lower().endswith(self.extensions)
+
+    def _ready(self, now):
+        """Pop the pending paths that are due and still exist"""
+        ready = []
+        for path, deadline in list(self._pending.items()):
+            if deadline > now:
+                continue
+            del self._pending[path]
+            if path not in self._handed and os.path.isfile(path):
+                self._handed.add(path)
+                if not self._was_organized(path):
+                    ready.append(path)
+        return ready
+
+    def batches(self, size):
+        """Yield lists of up to size new files until stopped
+
+        An empty list is yielded each time the watcher is about to wait, so
+        the organizer can finish what is in flight instead of holding it
+        until the next file arrives.
+        """
+        idle = True
+        try:
+            while not self._stopped.is_set():
+                ready = self._ready(time.monotonic())
+                if ready:
+                    self.found += len(ready)
+                    for i in range(0, len(ready), size):
+                        yield ready[i:i + size]
+                    idle = False
+                    continue
+                if not idle:
+                    idle = True
+                    yield []
+                timeout = None
+                if self._pending:
+                    timeout = max(0.0, min(self._pending.values()) - time.monotonic())
+                self._wait(timeout)
+        finally:
+            self.done = True
+            self._close()
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _wait(self, timeout):
+        """Sleep until something changes or timeout seconds pass (None: no limit)"""
+        raise NotImplementedError
+
+    def _wake(self):
+        pass
+
+    def _close(self):
+        pass
+
+
+class InotifyWatcher(_Watcher):
+    """Watches the source tree with one inotify watch per folder"""
+
+    kind = 'inotify'
+
+    def __init__(self, source, extensions, settle=DEFAULT_SETTLE):
+        super().__init__(source, extensions, settle)
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._ctypes = ctypes
+        self._fd = None
+        self._wake_r = self._wake_w = None
+        self._folders = {}
+
+    def _open(self):
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            self._raise_errno()
+        self._fd = fd
+        self._wake_r, self._wake_w = os.pipe()
+        try:
+            self._watch_tree(self.source)
+        except OSError:
+            self._close()
+            raise
+
+    def _raise_errno(self, path=None):
+        code = self._ctypes.get_errno()
+        raise OSError(code, os.strerror(code), path)
+
+    def _watch_tree(self, folder, pick_up=False):
+        """Watch folder and the folders below it, queueing files found if pick_up"""
+        stack = [folder]
+        while stack:
+            current = stack.pop()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(current), WATCH_MASK)
+            if wd < 0:
+                # The folder vanished in the meantime; anything else is fatal
+                if self._ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                self._raise_errno(current)
+            self._folders[wd] = current
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif pick_up and self._matches(entry.name):
+                            self._pending.setdefault(entry.path, time.monotonic() + self.settle)
+            except OSError:
+                continue
+
+    def _rescan(self):
+        """Queue files that changed since watching began, after lost events"""
+        for path in scan_media(self.source, self.extensions):
+            try:
+                recent = os.stat(path).st_mtime >= self._since - self.settle
+            except OSError:
+                continue
+            if recent and path not in self._handed:
+                self._pending.setdefault(path, time.monotonic() + self.settle)
+
+    def _wait(self, timeout):
+        readable, _, _ = select.select([self._fd, self._wake_r], [], [], timeout)
+        if self._wake_r in readable:
+            os.read(self._wake_r, _READ_SIZE)
+        if self._fd in readable:
+            self._read_events()
+
+    def _read_events(self):
+        while True:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                return
+            now = time.monotonic()
+            pos = 0
+            while pos + _EVENT.size <= len(data):
+                wd, mask, _cookie, length = _EVENT.unpack_from(data, pos)
+                name = data[pos + _EVENT.size:pos + _EVENT.size + length].rstrip(b'\0')
+                pos += _EVENT.size + length
+                self._handle(wd, mask, os.fsdecode(name), now)
+
+    def _handle(self, wd, mask, name, now):
+        if mask & IN_Q_OVERFLOW:
+            self._rescan()
+            return
+        if mask & IN_IGNORED:
+            self._folders.pop(wd, None)
+            return
+        folder = self._folders.get(wd)
+        if folder is None or not name:
+            return
+        path = os.path.join(folder, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(path, pick_up=True)
+            return
+        if not self._matches(name):
+            return
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self._pending.pop(path, None)
+            self._handed.discard(path)
+        elif mask & IN_MOVED_TO:
+            # A file renamed into place is complete, and new even under an old name
+            self._handed.discard(path)
+            self._pending[path] = now
+        elif mask & IN_CLOSE_WRITE:
+            self._pending[path] = now
+        elif path not in self._handed:
+            # Created or still being written
+            self._pending[path] = now + self.settle
+
+    def _wake(self):
+        if self._wake_w is not None:
+            try:
+                os.write(self._wake_w, b'x')
+            except OSError:
+                pass
+
+    def _close(self):
+        for fd in (self._fd, self._wake_r, self._wake_w):
+            if fd is not None:
+                os.close(fd)
+        self._fd = self._wake_r = self._wake_w = None
+
+
+class PollingWatcher(_Watcher):
+    """Walks the source tree every poll_interval seconds and compares stats"""
+
+    kind = 'polling'
+
+    def __init__(self, source, extensions, settle=DEFAULT_SETTLE, poll_interval=DEFAULT_POLL_INTERVAL):
+        super().__init__(source, extensions, settle)
+        self.poll_interval = poll_interval
+        # (size, mtime_ns) and time of last change per path, as of the last walk
+        self._seen = {}
+        self._next_poll = 0.0
+
+    def _snapshot(self):
+        snapshot = {}
+        for path in scan_media(self.source, self.extensions):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def _open(self):
+        # Files present at the start are not new
+        now = time.monotonic()
+        self._seen = {path: (signature, now) for path, signature in self._snapshot().items()}
+        self._handed.update(self._seen)
+        self._next_poll = now + self.poll_interval
+
+    def _poll(self):
+        now = time.monotonic()
+        seen = {}
+        for path, signature in self._snapshot().items():
+            previous = self._seen.get(path)
+            if previous is None or previous[0] != signature:
+                seen[path] = (signature, now)
+            else:
+                seen[path] = previous
+                if path not in self._handed and now - previous[1] >= self.settle:
+                    self._pending[path] = now
+        # Forget files that went away, so a new file with the same name counts
+        self._handed.intersection_update(seen)
+        self._seen = seen
+
+    def _wait(self, timeout):
+        now = time.monotonic()
+        delay = self._next_poll - now
+        if timeout is not None:
+            delay = min(delay, timeout)
+        if delay > 0 and self._stopped.wait(delay):
+            return
+        if time.monotonic() >= self._next_poll:
+            self._poll()
+            self._next_poll = time.monotonic() + self.poll_interval
+
+
+def open_watcher(source, extensions, settle=DEFAULT_SETTLE,
+                 poll_interval=DEFAULT_POLL_INTERVAL, polling=False):
+    """Start the best available watcher on source: inotify on Linux, polling otherwise"""
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(source, extensions, settle).start()
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable, polling instead: {str(e)}")
+    return PollingWatcher(source, extensions, settle, poll_interval).start()
@@ -8,18 +8,41 @@ Features:
 - Organizes photos and videos by date taken
 - Optional separate processing for photos and videos
 - Creates year/month folder structure automatically
-- Supports multiple media formats (JPG, PNG, GIF, MP4, MOV, AVI)
+- Supports multiple media formats (JPG, PNG, GIF, HEIC/HEIF, WebP, RAW, MP4, MOV, AVI)
 - Maintains original file metadata
 - Handles duplicate filenames
 - Supports English and Swedish folder naming
 - Option to remove source files after organization
+- Command line mode for headless batch runs (python -m photo_organizer --help)
 """
 
 import os
 import sys
+
+if __name__ == "__main__" and len(sys.argv) > 1:
+    # Any arguments mean a headless command line run, before Tk is imported
+    from multiprocessing import freeze_support
+    freeze_support()
+    from organizer.cli import main
+    sys.exit(main())
+
 from tkinter import *
 from tkinter import ttk
 
+from organizer import (
+    MONTH_TRANSLATIONS,
+    PHOTO_EXTENSIONS,
+    VIDEO_EXTENSIONS,
+    Organizer,
+    OrganizerConfig,
+    get_localized_month,
+    get_media_date,
+)
+from organizer.progress import ProgressTracker
+
+# How often the GUI picks up progress from the organizing thread
+PROGRESS_POLL_MS = 100
+
 class PhotoOrganizerApp:
     def __init__(self, root):
         self.root = root
@@ -29,12 +52,10 @@ class PhotoOrganizerApp:
         self.root.resizable(False, False)
         
         # Move heavy imports to class variables
-        self._PIL = None
-        self._shutil = None
         self._locale = None
-        self._datetime = None
         self._filedialog = None
         self._threading = None
+        self._queue = None
         
         # App information
         self.app_info = {
@@ -45,31 +66,23 @@ class PhotoOrganizerApp:
             'email': 'info@express-it.se'
         }
         
-        # Add cancellation flag
+        # Add cancellation flag and the engine of the running organize
         self.cancel_flag = False
+        self.organizer = None
+        
+        # Progress events from the organizing thread, read by the Tk main loop
+        self.progress_events = None
+        self.progress_tracker = None
         
         # Define supported file types
-        self.photo_extensions = ('.jpg', '.jpeg', '.png', '.gif')
-        self.video_extensions = ('.mp4', '.mov', '.avi')
+        self.photo_extensions = PHOTO_EXTENSIONS
+        self.video_extensions = VIDEO_EXTENSIONS
         
         # Initialize file type selection
         self.file_type_selection = StringVar(value='all')
         
         # Define month translations
-        self.month_translations = {
-            'English': {
-                'January': 'January', 'February': 'February', 'March': 'March',
-                'April': 'April', 'May': 'May', 'June': 'June',
-                'July': 'July', 'August': 'August', 'September': 'September',
-                'October': 'October', 'November': 'November', 'December': 'December'
-            },
-            'Swedish': {
-                'January': 'Januari', 'February': 'Februari', 'March': 'Mars',
-                'April': 'April', 'May': 'Maj', 'June': 'Juni',
-                'July': 'Juli', 'August': 'Augusti', 'September': 'September',
-                'October': 'Oktober', 'November': 'November', 'December': 'December'
-            }
-        }
+        self.month_translations = MONTH_TRANSLATIONS
         
         # Initialize counters
         self.processed_files = 0
@@ -80,21 +93,15 @@ class PhotoOrganizerApp:
 
     def lazy_load_imports(self):
         """Lazy load heavy imports only when needed"""
-        if self._PIL is None:
-            from PIL import Image
-            self._PIL = Image
-        if self._shutil is None:
-            import shutil
-            self._shutil = shutil
-        if self._datetime is None:
-            from datetime import datetime
-            self._datetime = datetime
         if self._filedialog is None:
             from tkinter import filedialog
             self._filedialog = filedialog
         if self._threading is None:
             import threading
             self._threading = threading
+        if self._queue is None:
+            import queue
+            self._queue = queue
 
     def lazy_load_locale(self):
         """Lazy load locale for language detection"""
@@ -247,6 +254,10 @@ class PhotoOrganizerApp:
         self.counter_var = StringVar(value="Files Processed: 0 / 0")
         ttk.Label(progress_frame, textvariable=self.counter_var).grid(row=0, column=0, sticky=W, pady=5)
         
+        # Throughput and ETA
+        self.rate_var = StringVar(value="")
+        ttk.Label(progress_frame, textvariable=self.rate_var).grid(row=0, column=1, sticky=E, pady=5)
+        
         # Progress bar
         self.progress = ttk.Progressbar(progress_frame, mode='determinate', length=600)
         self.progress.grid(row=1, column=0, columnspan=2, pady=5)
@@ -389,7 +400,7 @@ class PhotoOrganizerApp:
         
         # Update file count
         if self.source_path.get():
-            self.update_file_count()
+            self.reset_file_count()
     def toggle_video_destination(self):
         """Enable/disable video destination selection based on checkbox"""
         state = 'normal' if self.separate_videos.get() else 'disabled'
@@ -406,7 +417,7 @@ class PhotoOrganizerApp:
         folder = self._filedialog.askdirectory()
         if folder:
             self.source_path.set(folder)
-            self.update_file_count()
+            self.reset_file_count()
 
     def browse_photo_dest(self):
         """Open dialog to select photo destination folder"""
@@ -422,57 +433,41 @@ class PhotoOrganizerApp:
         if folder:
             self.video_dest_path.set(folder)
 
-    def update_file_count(self):
-        """Update the total file count when source folder is selected"""
-        source = self.source_path.get()
-        if source:
-            selection = self.file_type_selection.get()
-            if selection == 'all':
-                extensions = self.photo_extensions + self.video_extensions
-            elif selection == 'photos':
-                extensions = self.photo_extensions
-            else:  # videos
-                extensions = self.video_extensions
-                
-            self.total_files = sum(1 for root, _, files in os.walk(source)
-                                 for f in files if f.lower().endswith(extensions))
-            self.processed_files = 0
-            self.counter_var.set(f"Files Processed: {self.processed_files} / {self.total_files}")
+    def build_config(self):
+        """Collect the current settings into an engine config"""
+        return OrganizerConfig(
+            source=self.source_path.get(),
+            photo_dest=self.photo_dest_path.get(),
+            video_dest=self.video_dest_path.get() if self.separate_videos.get() else '',
+            file_types=self.file_type_selection.get(),
+            language=self.language_var.get(),
+            delete_source=self.delete_files.get(),
+            workers=min(8, os.cpu_count() or 1),
+        )
+
+    def reset_file_count(self):
+        """Reset the file counter when the source folder or file type changes
+
+        The tree is not walked here; the run reports the files found so far as
+        its total while it walks the source.
+        """
+        self.total_files = 0
+        self.processed_files = 0
+        self.counter_var.set("Files Processed: 0 / 0")
 
     def get_media_date(self, file_path):
         """Get the creation date of a media file"""
-        self.lazy_load_imports()  # Ensure modules are loaded
-        
-        try:
-            # Try to get EXIF data for photos
-            if file_path.lower().endswith(self.photo_extensions):
-                with self._PIL.open(file_path) as img:
-                    exif = img._getexif()
-                    if exif:
-                        # Look for DateTimeOriginal or DateTime tag
-                        for tag_id in (36867, 306):  # EXIF tags for dates
-                            if tag_id in exif:
-                                date_str = exif[tag_id]
-                                return self._datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
-            
-            # Fall back to file modification time
-            timestamp = os.path.getmtime(file_path)
-            return self._datetime.fromtimestamp(timestamp)
-            
-        except Exception as e:
-            print(f"Error getting date for {file_path}: {str(e)}")
-            # Return current date if all methods fail
-            return self._datetime.now()
+        return get_media_date(file_path, self.photo_extensions)
 
     def get_localized_month(self, date):
         """Get month name in current language"""
-        english_month = date.strftime('%B')
-        selected_language = self.language_var.get()
-        return self.month_translations[selected_language][english_month]
+        return get_localized_month(date, self.language_var.get())
 
     def cancel_organization(self):
         """Cancel the organization process"""
         self.cancel_flag = True
+        if self.organizer:
+            self.organizer.cancel()
         self.status_var.set("Cancelling... Please wait.")
         self.cancel_button['state'] = 'disabled'
 
@@ -498,95 +493,89 @@ class PhotoOrganizerApp:
         self.status_var.set("Starting organization...")
         self.progress['value'] = 0
         self.processed_files = 0
+        self.rate_var.set("")
         
-        # Make sure threading is loaded
+        # Make sure threading and queue are loaded
         self.lazy_load_imports()
+        self.progress_events = self._queue.Queue()
+        self.progress_tracker = ProgressTracker()
         
         # Run in separate thread to keep GUI responsive
         thread = self._threading.Thread(target=self.organize_files)
         thread.daemon = True
         thread.start()
+        self.root.after(PROGRESS_POLL_MS, self.poll_progress)
 
     def organize_files(self):
-        """Main function to organize files"""
-        # Ensure all required modules are loaded
-        self.lazy_load_imports()
-        
-        source = self.source_path.get()
-        photo_dest = self.photo_dest_path.get()
-        video_dest = self.video_dest_path.get() if self.separate_videos.get() else photo_dest
-        should_delete = self.delete_files.get()
-        
+        """Main function to organize files, runs on the worker thread"""
         # Reset cancel flag
         self.cancel_flag = False
-        
-        # Get list of media files based on selection
-        selection = self.file_type_selection.get()
-        if selection == 'all':
-            extensions = self.photo_extensions + self.video_extensions
-        elif selection == 'photos':
-            extensions = self.photo_extensions
-        else:  # videos
-            extensions = self.video_extensions
-            
-        files = []
-        for root, _, filenames in os.walk(source):
-            for filename in filenames:
-                if filename.lower().endswith(extensions):
-                    files.append(os.path.join(root, filename))
-
-        self.total_files = len(files)
-        self.progress['maximum'] = self.total_files
-        self.processed_files = 0
+        self.organizer = Organizer(self.build_config(), on_progress=self.report_progress)
+        try:
+            stats = self.organizer.run()
+        except Exception as e:
+            self.progress_events.put(('failed', e))
+        else:
+            self.progress_events.put(('done', stats))
 
-        for file_path in files:
-            # Check if cancellation was requested
-            if self.cancel_flag:
-                self.status_var.set("Organization cancelled.")
-                break
-                
+    def report_progress(self, stats, file_path):
+        """Queue engine progress for the GUI; never touches Tk from the worker thread"""
+        self.progress_events.put(
+            ('progress', stats.processed, stats.total, stats.bytes_transferred, file_path)
+        )
+
+    def poll_progress(self):
+        """Show the latest queued progress, called from the Tk main loop"""
+        latest = None
+        finished = None
+        while True:
             try:
-                # Determine if file is video or photo
-                is_video = file_path.lower().endswith(self.video_extensions)
-                dest_base = video_dest if is_video else photo_dest
-                
-                # Get date from file
-                date = self.get_media_date(file_path)
-                
-                # Create year/month folders with localized month name
-                month = self.get_localized_month(date)
-                year_month = f"{date.year}/{month}"
-                dest_dir = os.path.join(dest_base, year_month)
-                os.makedirs(dest_dir, exist_ok=True)
-                
-                # Handle duplicate filenames
-                filename = os.path.basename(file_path)
-                base, ext = os.path.splitext(filename)
-                counter = 1
-                dest_path = os.path.join(dest_dir, filename)
-                while os.path.exists(dest_path):
-                    dest_path = os.path.join(dest_dir, f"{base}_{counter}{ext}")
-                    counter += 1
-
-                # Move or copy file based on checkbox selection
-                if should_delete:
-                    self._shutil.move(file_path, dest_path)
-                else:
-                    self._shutil.copy2(file_path, dest_path)
-                
-                # Update progress
-                self.processed_files += 1
-                self.progress['value'] = self.processed_files
-                self.counter_var.set(f"Files Processed: {self.processed_files} / {self.total_files}")
-                self.status_var.set(f"Processing: {filename}")
-                self.root.update()
-
-            except Exception as e:
-                print(f"Error {'moving' if should_delete else 'copying'} {file_path}: {str(e)}")
-
-        if not self.cancel_flag:
-            action_text = "moved" if should_delete else "copied"
-            self.status_var.set(f"Organization completed! {self.processed_files} files have been {action_text}.")
+                event = self.progress_events.get_nowait()
+            except self._queue.Empty:
+                break
+            if event[0] == 'progress':
+                latest = event
+            else:
+                finished = event
+
+        if latest:
+            self.show_progress(*latest[1:])
+        if finished:
+            self.finish_organization(*finished)
+        else:
+            self.root.after(PROGRESS_POLL_MS, self.poll_progress)
+
+    def show_progress(self, processed, total, bytes_done, file_path):
+        """Update the progress frame"""
+        self.processed_files = processed
+        self.total_files = total
+        self.progress_tracker.update(processed, total, bytes_done)
+        self.progress['maximum'] = total
+        self.progress['value'] = processed
+        self.counter_var.set(f"Files Processed: {processed} / {total}")
+        self.rate_var.set(self.progress_tracker.summary())
+        self.status_var.set(f"Processing: {os.path.basename(file_path)}")
+
+    def finish_organization(self, outcome, result):
+        """Show the outcome of a run and re-enable the buttons"""
+        if outcome == 'failed':
+            self.status_var.set(f"Organization failed: {result}")
+        elif result.cancelled:
+            self.status_var.set("Organization cancelled. Start again with the same settings to resume.")
+        else:
+            self.show_progress(result.processed, result.total, result.bytes_transferred, '')
+            self.rate_var.set(
+                f"{result.files_per_second:.1f} files/s, {result.bytes_per_second / 1e6:.1f} MB/s"
+            )
+            action_text = "moved" if self.organizer.config.delete_source else "copied"
+            status = (
+                f"Organization completed! {result.processed} files have been {action_text} "
+                f"({result.files_per_second:.1f} files/s)."
+            )
+            if result.resumed:
+                status += f" {result.resumed} files were already done by the interrupted run."
+            self.status_var.set(status)
+        self.organizer = None
         
         # Reset buttons
         self.start_button['state'] = 'normal'